@@ -0,0 +1,68 @@
+"""Benchmark the compression of a trained CRF model
+SYNOPSIS:
+python benchmark_compression.py [-thresholds <t1,t2,...>] [-top_k <k1,k2,...>] <config_file> <model_file> <dev_file>
+
+The features of the development data are extracted once with the config file
+of the model. The model is compressed with each threshold and each top_k
+setting (compress_model.py), and the size, the number of features, the loading
+and tagging times, and the F1 score (conlleval) of the original and the
+compressed models are reported.
+"""
+import os
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from crfsuite_feature import FeatureExtractor
+from crfsuite_model import CRFSuiteModel
+from compress_model import compress_model
+from sweep import evaluate
+
+
+def test_model(model_file, dev_crfsuite_file, dev_file, tag_file):
+    start = time.time()
+    model = CRFSuiteModel(model_file)
+    loading = time.time() - start
+    start = time.time()
+    model.tag_file(dev_crfsuite_file, tag_file)
+    tagging = time.time() - start
+    return {
+        "features": len(model.attr_labels) + int((model.trans != 0).sum()),
+        "size": os.path.getsize(model_file) / 1024.0,
+        "loading": loading,
+        "tagging": tagging,
+        "f1": evaluate(dev_file, tag_file)[2],
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-thresholds", default="0.001,0.01,0.05,0.1", help="Comma-separated weight thresholds")
+    parser.add_argument("-top_k", default="", help="Comma-separated numbers of state features per label")
+    parser.add_argument("config_file", help="Path to the config file of the model")
+    parser.add_argument("model_file", help="Path to the model file")
+    parser.add_argument("dev_file", help="Path to development data (e.g., ./data/test_sample-space.txt)")
+    args = parser.parse_args()
+
+    settings = [("threshold=%s" % t, {"threshold": float(t)}) for t in args.thresholds.split(",") if t]
+    settings += [("top_k=%s" % k, {"top_k": int(k)}) for k in args.top_k.split(",") if k]
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        dev_crfsuite_file = os.path.join(tmp_dir, "dev.crfsuite")
+        tag_file = os.path.join(tmp_dir, "dev.tag")
+        FeatureExtractor(args.config_file).extract(args.dev_file, dev_crfsuite_file)
+
+        results = [("original", test_model(args.model_file, dev_crfsuite_file, args.dev_file, tag_file))]
+        for name, options in settings:
+            model_file = os.path.join(tmp_dir, "model.bin")
+            compress_model(args.model_file, model_file, **options)
+            results.append((name, test_model(model_file, dev_crfsuite_file, args.dev_file, tag_file)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print()
+    print("{:18s} {:>10s} {:>12s} {:>9s} {:>9s} {:>8s}".format("model", "features", "size", "loading", "tagging", "F1"))
+    for name, r in results:
+        print("{:18s} {:10d} {:10.1f}KB {:8.3f}s {:8.3f}s {:8.2f}".format(
+            name, r["features"], r["size"], r["loading"], r["tagging"], r["f1"]))
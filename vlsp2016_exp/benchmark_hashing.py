@@ -0,0 +1,99 @@
+"""Benchmark feature hashing of the CRF attributes
+SYNOPSIS:
+python benchmark_hashing.py [-work_dir <work_dir>] [-bits <b1,b2,...>] [-unsigned] [-config <config_file>]... <training_file> <test_file>
+
+For each configuration file (by default config1) and each setting (string
+attributes, hashed attributes with 2^bits indices), the script extracts
+features, trains a CRF model with crfsuite, tags the test data and reports
+the number of attributes and the size of the model, the peak memory usage
+(max. RSS) and the time of the training process, and the F1 score (conlleval).
+"""
+import os
+import shlex
+import pathlib
+import subprocess
+import time
+import yaml
+from argparse import ArgumentParser
+from crfsuite_feature import FeatureExtractor, load_config
+from crfsuite_model import CRFSuiteModel
+from sweep import evaluate
+
+
+def get_settings(bits, signed):
+    settings = [("strings", None)]
+    for b in bits:
+        settings.append(("hashing-%dbits" % b, {"bits": b, "signed": signed}))
+    return settings
+
+
+def run(config_file, feature_hashing, exp_dir, training_file, test_file):
+    pathlib.Path(exp_dir).mkdir(parents=True, exist_ok=True)
+    cfg = load_config(config_file)
+    cfg['feature_hashing'] = feature_hashing
+    exp_config = os.path.join(exp_dir, "config.yml")
+    with open(exp_config, "w") as fo:
+        yaml.dump(cfg, fo, allow_unicode=True)
+
+    training_crfsuite_file = os.path.join(exp_dir, "train.crfsuite")
+    test_crfsuite_file = os.path.join(exp_dir, "test.crfsuite")
+    test_tag = os.path.join(exp_dir, "test.tag")
+    model_file = os.path.join(exp_dir, "model.bin")
+
+    extractor = FeatureExtractor(exp_config)
+    extractor.extract(training_file, training_crfsuite_file)
+    extractor.extract(test_file, test_crfsuite_file)
+
+    # The training process is waited for with wait4 to get its own max. RSS
+    start = time.time()
+    comd = shlex.split(extractor.crfpath()) + ["learn"] + shlex.split(extractor.crf_options()) + \
+        ["-m", model_file, training_crfsuite_file]
+    print(" ".join(comd))
+    with open(os.path.join(exp_dir, "learn.log"), "w") as log:
+        proc = subprocess.Popen(comd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+    training_time = time.time() - start
+    if status != 0:
+        raise RuntimeError("crfsuite learn failed, see %s" % os.path.join(exp_dir, "learn.log"))
+
+    model = CRFSuiteModel(model_file)
+    model.tag_file(test_crfsuite_file, test_tag)
+
+    return {
+        "attributes": model.num_attrs,
+        "model_size": os.path.getsize(model_file) / (1024.0 * 1024.0),
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss": usage.ru_maxrss / 1024.0,
+        "time": training_time,
+        "f1": evaluate(test_file, test_tag)[2],
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-work_dir", default="./work_dir/hashing", help="Path to working directory")
+    parser.add_argument("-bits", default="16,18,20,22", help="Comma-separated numbers of hashing bits")
+    parser.add_argument("-unsigned", action="store_true", help="Hash without signed values")
+    parser.add_argument("-config", action="append", help="Config file (can be repeated, default: config1)")
+    parser.add_argument("training_file", help="Path to training data")
+    parser.add_argument("test_file", help="Path to test data")
+    args = parser.parse_args()
+
+    bits = [int(b) for b in args.bits.split(",")]
+    configs = args.config if args.config else ["./config/config1.yml"]
+
+    results = []
+    for config_file in configs:
+        config_name = os.path.splitext(os.path.basename(config_file))[0]
+        for name, feature_hashing in get_settings(bits, not args.unsigned):
+            print("# %s, attributes: %s" % (config_name, name), flush=True)
+            exp_dir = os.path.join(args.work_dir, config_name, name)
+            r = run(config_file, feature_hashing, exp_dir, args.training_file, args.test_file)
+            results.append((config_name, name, r))
+            print()
+
+    print("| Config | Attributes | # Attributes | Model (MB) | Training max. RSS (MB) | Training time (sec.) | F1 |")
+    print("|--------|------------|--------------|------------|------------------------|----------------------|----|")
+    for config_name, name, r in results:
+        print("| {} | {} | {} | {:.2f} | {:.1f} | {:.2f} | {:.2f} |".format(
+            config_name, name, r["attributes"], r["model_size"], r["max_rss"], r["time"], r["f1"]))
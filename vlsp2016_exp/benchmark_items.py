@@ -0,0 +1,68 @@
+"""Benchmark the items of crfutils.readiter: dicts against crfutils.Item
+SYNOPSIS:
+python benchmark_items.py <config_file> <data_file>
+
+All sequences of the data file are read and their features are extracted
+(and kept in memory) with each kind of item. Each kind of item is run in
+its own process, so that the peak memory usage (max. RSS) of the processes
+can be compared. The generated features are checked to be identical.
+"""
+import sys
+import json
+import time
+import hashlib
+import resource
+import subprocess
+from argparse import ArgumentParser
+import crfutils
+from crfsuite_feature import FeatureExtractor
+
+
+def run(config_file, data_file, compact):
+    extractor = FeatureExtractor(config_file)
+    start = time.time()
+    sequences = []
+    with open(data_file) as fi:
+        for X in crfutils.readiter(fi, extractor.fields.split(' '), compact=compact):
+            extractor.feature_extractor(X)
+            sequences.append(X)
+    elapsed = time.time() - start
+
+    h = hashlib.sha1()
+    for X in sequences:
+        for x in X:
+            h.update(("\t".join(x['F']) + "\n").encode("utf-8"))
+    return {
+        "tokens": sum(len(X) for X in sequences),
+        "time": elapsed,
+        # ru_maxrss is in kilobytes on Linux
+        "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "checksum": h.hexdigest(),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-mode", default=None, choices=["dict", "compact"], help="Run a single mode and print the result as JSON")
+    parser.add_argument("config_file", help="Path to config file")
+    parser.add_argument("data_file", help="Path to data file (e.g., ./data/train_sample-space.txt)")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(run(args.config_file, args.data_file, args.mode == "compact")))
+        sys.exit(0)
+
+    results = dict()
+    for mode in ["dict", "compact"]:
+        output = subprocess.check_output([sys.executable, __file__, "-mode", mode, args.config_file, args.data_file])
+        results[mode] = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+    if results["dict"]["checksum"] != results["compact"]["checksum"]:
+        raise ValueError("crfutils.Item generated different features")
+
+    print("# Tokens: %d" % results["dict"]["tokens"])
+    for mode in ["dict", "compact"]:
+        r = results[mode]
+        print("{:8s} {:.3f} sec. ({:.0f} tokens/sec.), max. RSS: {:.1f} MB".format(
+            mode, r["time"], r["tokens"] / r["time"], r["max_rss"] / 1024.0))
+    print("Memory: {:.2f}x".format(results["dict"]["max_rss"] / float(results["compact"]["max_rss"])))
@@ -0,0 +1,101 @@
+"""Benchmark quantization of word embedding features
+SYNOPSIS:
+python benchmark_quantize.py [-work_dir <work_dir>] [-bits <b1,b2,...>] [-config <config_file>]... <training_file> <test_file>
+
+For each configuration file (by default config1 and config3) and each
+quantization setting (full precision, uniform quantization with 2^bits
+levels, binarized sign features), the script extracts features, trains a
+CRF model with crfsuite, tags the test data and reports the size of the
+training feature file, the training time and the F1 score (conlleval).
+"""
+import os
+import pathlib
+import time
+import yaml
+from argparse import ArgumentParser
+import conlleval
+from crfsuite_feature import FeatureExtractor, load_config
+from crfsuite_model import CRFSuiteModel
+
+
+def get_settings(bits):
+    settings = [("none", None)]
+    for b in bits:
+        settings.append(("uniform-%dbits" % b, {"mode": "uniform", "bits": b}))
+    settings.append(("sign", {"mode": "sign"}))
+    return settings
+
+
+def evaluate(test_file, tag_file):
+    """Return the overall F1 score of the tagged test data"""
+    with open(test_file) as f1, open(tag_file) as f2:
+        lines = []
+        for line, tag in zip(f1, f2):
+            line = line.strip('\n')
+            tag = tag.strip('\n')
+            lines.append("%s %s" % (line, tag) if line.strip() else "")
+    counts = conlleval.evaluate(lines)
+    overall = conlleval.calculate_metrics(counts.correct_chunk, counts.found_guessed, counts.found_correct)
+    return 100. * overall.fscore
+
+
+def run(config_file, quantize, exp_dir, training_file, test_file):
+    pathlib.Path(exp_dir).mkdir(parents=True, exist_ok=True)
+    cfg = load_config(config_file)
+    cfg['word_embeddings']['quantize'] = quantize
+    exp_config = os.path.join(exp_dir, "config.yml")
+    with open(exp_config, "w") as fo:
+        yaml.dump(cfg, fo, allow_unicode=True)
+
+    training_crfsuite_file = os.path.join(exp_dir, "train.crfsuite")
+    test_crfsuite_file = os.path.join(exp_dir, "test.crfsuite")
+    test_tag = os.path.join(exp_dir, "test.tag")
+    model_file = os.path.join(exp_dir, "model.bin")
+
+    extractor = FeatureExtractor(exp_config)
+    extractor.extract(training_file, training_crfsuite_file)
+    extractor.extract(test_file, test_crfsuite_file)
+
+    start = time.time()
+    comd = "%s learn %s -m %s %s > %s" % (extractor.crfpath(), extractor.crf_options(), model_file,
+                                          training_crfsuite_file, os.path.join(exp_dir, "learn.log"))
+    print(comd)
+    os.system(comd)
+    training_time = time.time() - start
+
+    model = CRFSuiteModel(model_file)
+    model.tag_file(test_crfsuite_file, test_tag)
+
+    return {
+        "size": os.path.getsize(training_crfsuite_file) / (1024.0 * 1024.0),
+        "time": training_time,
+        "f1": evaluate(test_file, test_tag),
+    }
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-work_dir", default="./work_dir/quantize", help="Path to working directory")
+    parser.add_argument("-bits", default="2,4,8", help="Comma-separated bit-widths of uniform quantization")
+    parser.add_argument("-config", action="append", help="Config file (can be repeated, default: config1 and config3)")
+    parser.add_argument("training_file", help="Path to training data")
+    parser.add_argument("test_file", help="Path to test data")
+    args = parser.parse_args()
+
+    bits = [int(b) for b in args.bits.split(",")]
+    configs = args.config if args.config else ["./config/config1.yml", "./config/config3.yml"]
+
+    results = []
+    for config_file in configs:
+        config_name = os.path.splitext(os.path.basename(config_file))[0]
+        for name, quantize in get_settings(bits):
+            print("# %s, quantization: %s" % (config_name, name), flush=True)
+            exp_dir = os.path.join(args.work_dir, config_name, name)
+            r = run(config_file, quantize, exp_dir, args.training_file, args.test_file)
+            results.append((config_name, name, r))
+            print()
+
+    print("| Config | Quantization | Feature file (MB) | Training time (sec.) | F1 |")
+    print("|--------|--------------|-------------------|----------------------|----|")
+    for config_name, name, r in results:
+        print("| {} | {} | {:.2f} | {:.2f} | {:.2f} |".format(config_name, name, r["size"], r["time"], r["f1"]))
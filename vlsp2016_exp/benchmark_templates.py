@@ -0,0 +1,58 @@
+"""Benchmark crfutils.apply_templates against crfutils.TemplateEngine
+SYNOPSIS:
+python benchmark_templates.py [-repeat <n>] <config_file> <data_file>
+
+Both implementations are applied to the same observations, and the
+generated features are checked to be identical.
+"""
+import time
+from argparse import ArgumentParser
+import crfutils
+from crfsuite_feature import FeatureExtractor, gen_regex_observation, gen_gazetteer_observation
+
+
+def read_observations(extractor, data_file):
+    sequences = []
+    with open(data_file) as fi:
+        for X in crfutils.readiter(fi, extractor.fields.split(' ')):
+            for x in X:
+                extractor.observation(x)
+            gen_regex_observation(X)
+            gen_gazetteer_observation(X, gazetteer = extractor.gazetteer)
+            sequences.append(X)
+    return sequences
+
+
+def run(sequences, apply, repeat):
+    start = time.time()
+    for i in range(repeat):
+        for X in sequences:
+            for x in X:
+                x['F'] = []
+            apply(X)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-repeat", type=int, default=5, help="Number of passes over the data")
+    parser.add_argument("config_file", help="Path to config file")
+    parser.add_argument("data_file", help="Path to data file (e.g., ./data/train_sample-space.txt)")
+    args = parser.parse_args()
+
+    extractor = FeatureExtractor(args.config_file)
+    sequences = read_observations(extractor, args.data_file)
+    n_tokens = sum(len(X) for X in sequences) * args.repeat
+    print("# Sentences: %d, tokens: %d, templates: %d" % (len(sequences), n_tokens // args.repeat, len(extractor.templates)))
+
+    old_time = run(sequences, lambda X: crfutils.apply_templates(X, extractor.templates), args.repeat)
+    old_features = [[x['F'] for x in X] for X in sequences]
+    new_time = run(sequences, extractor.template_engine.apply, args.repeat)
+    new_features = [[x['F'] for x in X] for X in sequences]
+
+    if old_features != new_features:
+        raise ValueError("TemplateEngine generated different features")
+
+    print("apply_templates: {:.3f} sec. ({:.0f} tokens/sec.)".format(old_time, n_tokens / old_time))
+    print("TemplateEngine:  {:.3f} sec. ({:.0f} tokens/sec.)".format(new_time, n_tokens / new_time))
+    print("Speedup: {:.2f}x".format(old_time / new_time))
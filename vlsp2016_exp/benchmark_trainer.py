@@ -0,0 +1,82 @@
+"""Benchmark the CRF trainers: `crfsuite learn` against crf_trainer.py
+SYNOPSIS:
+python benchmark_trainer.py [-workers 1 2 4] [-crf_options "<options>"] <config_file> <training_file> <test_file>
+
+The features of the training and test data are extracted once. `crfsuite learn`
+(crfpath of the config file, skipped if it is not found) is trained on the
+training feature file, the native trainer on the features in memory, with each
+number of workers. The models are evaluated on the test data (F1 score of
+conlleval), and the training times and the model sizes are reported.
+"""
+import os
+import time
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from crfsuite_feature import FeatureExtractor, load_config
+from crfsuite_model import CRFSuiteModel
+from crf_trainer import CRFTrainer
+from sweep import evaluate
+
+
+def test_model(model_file, test_crfsuite_file, test_file, tag_file):
+    CRFSuiteModel(model_file).tag_file(test_crfsuite_file, tag_file)
+    return evaluate(test_file, tag_file)[2], os.path.getsize(model_file)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-workers", type=int, nargs="+", default=[1], help="Numbers of workers of the native trainer")
+    parser.add_argument("-crf_options", default=None, help="Options of `crfsuite learn` (default: crf_options of the config file)")
+    parser.add_argument("config_file", help="Path to config file")
+    parser.add_argument("training_file", help="Path to training data (e.g., ./data/train_sample-space.txt)")
+    parser.add_argument("test_file", help="Path to test data (e.g., ./data/test_sample-space.txt)")
+    args = parser.parse_args()
+
+    cfg = load_config(args.config_file)
+    crf_options = args.crf_options if args.crf_options is not None else cfg["crf_options"]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        train_crfsuite_file = os.path.join(tmp_dir, "train.crfsuite")
+        test_crfsuite_file = os.path.join(tmp_dir, "test.crfsuite")
+        tag_file = os.path.join(tmp_dir, "test.tag")
+        extractor = FeatureExtractor(args.config_file)
+        extractor.extract(args.training_file, train_crfsuite_file)
+        extractor.extract(args.test_file, test_crfsuite_file)
+
+        results = []
+        crfpath = cfg["crfpath"]
+        if shutil.which(crfpath.split()[0]) is None:
+            print("[Warning] %s not found, `crfsuite learn` is skipped" % crfpath)
+        else:
+            model_file = os.path.join(tmp_dir, "crfsuite.bin")
+            start = time.time()
+            status = os.system("%s learn %s -m %s %s > %s" % (crfpath, crf_options, model_file, train_crfsuite_file,
+                                                              os.path.join(tmp_dir, "learn.log")))
+            elapsed = time.time() - start
+            if status != 0:
+                print("[Warning] crfsuite learn failed with status %d" % (status >> 8))
+            else:
+                f1, size = test_model(model_file, test_crfsuite_file, args.test_file, tag_file)
+                results.append(("crfsuite learn", None, elapsed, f1, size))
+
+        for workers in args.workers:
+            model_file = os.path.join(tmp_dir, "native-%d.bin" % workers)
+            start = time.time()
+            trainer = CRFTrainer.from_crf_options(crf_options, workers=workers)
+            trainer.append_data(extractor, args.training_file)
+            loading = time.time() - start
+            trainer.train(model_file)
+            elapsed = time.time() - start - loading
+            trainer = None
+            f1, size = test_model(model_file, test_crfsuite_file, args.test_file, tag_file)
+            results.append(("native (%d workers)" % workers, loading, elapsed, f1, size))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print()
+    print("crf_options: %s" % crf_options)
+    print("{:20s} {:>10s} {:>10s} {:>8s} {:>12s}".format("trainer", "features", "training", "F1", "model size"))
+    for name, loading, elapsed, f1, size in results:
+        print("{:20s} {:>10s} {:9.2f}s {:8.2f} {:10.1f}KB".format(
+            name, "-" if loading is None else "%.2fs" % loading, elapsed, f1, size / 1024.0))
@@ -0,0 +1,762 @@
+"""Linear-chain CRF trainer.
+   Trains the first-order linear-chain CRF of CRFsuite (crf1d) on attribute
+   sequences held in memory, e.g., the features generated by
+   FeatureExtractor, and writes the model in the format of `crfsuite learn`,
+   so that it is loaded by CRFSuiteModel (and by `crfsuite tag`).
+
+   The log-likelihood and its gradient are computed with the
+   forward-backward algorithm in NumPy, on batches of sequences of similar
+   lengths. Sequences are split into shards, one per worker process, and
+   the workers compute the gradients of their shards at the same time.
+
+   Training algorithms and parameters (the same names and defaults as crfsuite):
+   - lbfgs: L-BFGS on the log-likelihood with L2 regularization (c2) and
+     L1 regularization (c1, OWL-QN), max_iterations, num_memories,
+     epsilon, period, delta, max_linesearch.
+   - l2sgd: SGD with L2 regularization (c2), max_iterations (epochs),
+     period, delta, calibration.eta, calibration.rate, calibration.samples,
+     calibration.candidates, calibration.max_trials. With several workers,
+     each worker runs an epoch on its shard and the weights are averaged
+     after each epoch (iterative parameter mixing).
+   - feature.possible_states, feature.possible_transitions: generate state
+     features for all (attribute, label) pairs and transition features for
+     all pairs of labels, not only the ones that occur in the data.
+
+SYNOPSIS (same options as `crfsuite learn`, e.g., as crfpath "python crf_trainer.py"):
+python crf_trainer.py learn [-workers <n>] [-a <algorithm>] [-p <name>=<value>]... -m <model_file> <feature_file>
+"""
+import time
+import shlex
+import multiprocessing
+from collections import deque
+from argparse import ArgumentParser
+import numpy as np
+import crfutils
+from crfsuite_model import FEATURE_DTYPE, FT_STATE, FT_TRANS, to_attributes, parse_item, write_model
+
+
+# Parameters of the training algorithms and their default values (the same as crfsuite).
+ALGORITHM_PARAMS = {
+    "lbfgs": {
+        "c1": 0.0,
+        "c2": 1.0,
+        "num_memories": 6,
+        "max_iterations": 2 ** 31 - 1,
+        "epsilon": 1e-5,
+        "period": 10,
+        "delta": 1e-5,
+        "max_linesearch": 20,
+    },
+    "l2sgd": {
+        "c2": 1.0,
+        "max_iterations": 1000,
+        "period": 10,
+        "delta": 1e-6,
+        "calibration.eta": 0.1,
+        "calibration.rate": 2.0,
+        "calibration.samples": 1000,
+        "calibration.candidates": 10,
+        "calibration.max_trials": 20,
+    },
+}
+
+FEATURE_PARAMS = {
+    "feature.possible_states": 0,
+    "feature.possible_transitions": 0,
+}
+
+# Maximum number of tokens of a batch of the forward-backward algorithm.
+BATCH_TOKENS = 2000
+
+# Maximum number of expanded state features (see Shard.expand) kept in memory by a shard.
+EXPANSION_CACHE_SIZE = 1 << 25
+
+# Labels are stored in the low bits of the (attribute, label) keys.
+LABEL_BITS = 16
+
+
+def parse_crf_options(crf_options):
+    """Split crf_options (options of `crfsuite learn`) into the algorithm, the parameters and the other options"""
+    algorithm = None
+    params = []
+    others = []
+    tokens = shlex.split(crf_options)
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == "-a" and i + 1 < len(tokens):
+            algorithm = tokens[i + 1]
+            i += 2
+        elif tokens[i] == "-p" and i + 1 < len(tokens):
+            name, _, value = tokens[i + 1].partition("=")
+            params.append((name, value))
+            i += 2
+        else:
+            others.append(tokens[i])
+            i += 1
+    return algorithm, params, others
+
+
+class FeatureSet(object):
+    """
+    State features (attribute, label) and transition features (label, label).
+    The state features are sorted by attribute, the features of the attribute
+    a are attr_ptr[a]:attr_ptr[a+1], feat_label gives their labels. The
+    weight vector is made of the weights of the state features followed by
+    the transition weights (a num_labels x num_labels matrix, in which only
+    the entries of trans_mask are features).
+    """
+    def __init__(self, labels, attributes, keys, trans_mask):
+        self.labels = labels
+        self.attributes = attributes
+        self.num_labels = len(labels)
+        feat_attr = keys >> LABEL_BITS
+        self.feat_label = (keys & ((1 << LABEL_BITS) - 1)).astype(np.int64)
+        self.attr_ptr = np.zeros(len(attributes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(feat_attr, minlength=len(attributes)), out=self.attr_ptr[1:])
+        self.num_state = len(keys)
+        self.trans_mask = trans_mask
+        self.size = self.num_state + self.num_labels * self.num_labels
+
+    def split(self, w):
+        """Returns the state weights and the transition matrix of a weight vector"""
+        L = self.num_labels
+        return w[:self.num_state], w[self.num_state:].reshape(L, L)
+
+    def write_model(self, model_file, w):
+        """Write the model in the format of `crfsuite learn`
+        Features with a zero weight and attributes without features are
+        left out, as crfsuite does.
+        """
+        w_state, trans = self.split(w)
+        feat_attr = np.repeat(np.arange(len(self.attributes)), np.diff(self.attr_ptr))
+        active = np.nonzero(w_state != 0)[0]
+        src, dst = np.nonzero(self.trans_mask & (trans != 0))
+
+        features = np.zeros(len(src) + len(active), dtype=FEATURE_DTYPE)
+        features["type"][:len(src)] = FT_TRANS
+        features["src"][:len(src)] = src
+        features["dst"][:len(src)] = dst
+        features["weight"][:len(src)] = trans[src, dst]
+        features["type"][len(src):] = FT_STATE
+        features["src"][len(src):] = feat_attr[active]
+        features["dst"][len(src):] = self.feat_label[active]
+        features["weight"][len(src):] = w_state[active]
+        return write_model(model_file, self.labels, self.attributes, features)
+
+
+class Batch(object):
+    """
+    Sequences of a batch, padded to the length of the longest one.
+    The attributes of all items are stored in flat arrays (attrs, values),
+    rows gives the position (b * T + t) of the item of each attribute.
+    """
+    def __init__(self, sequences):
+        self.size = len(sequences)
+        self.lengths = np.array([len(y) for _, _, _, y in sequences], dtype=np.int64)
+        self.T = int(self.lengths.max())
+        T = self.T
+        self.mask = np.arange(T)[None, :] < self.lengths[:, None]
+        self.labels = np.zeros((self.size, T), dtype=np.int64)
+        rows = []
+        for b, (counts, attrs, values, y) in enumerate(sequences):
+            self.labels[b, :len(y)] = y
+            rows.append(b * T + np.repeat(np.arange(len(y)), counts))
+        self.attrs = np.concatenate([attrs for _, attrs, _, _ in sequences])
+        self.values = np.concatenate([values for _, _, values, _ in sequences])
+        self.rows = np.concatenate(rows)
+        self.seq_ptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum([len(attrs) for _, attrs, _, _ in sequences], out=self.seq_ptr[1:])
+
+
+def forward_backward(S, lengths, mask, trans):
+    """Forward-backward algorithm on a batch of sequences (with scaling)
+    Parameters
+    -----------
+    S: Array
+       State scores of shape (B, T, L), padded positions are ignored
+    lengths: Array
+       Lengths of the B sequences
+    mask: Array
+       Boolean matrix of shape (B, T), True for the positions of the sequences
+    trans: Array
+       Transition weights of shape (L, L)
+
+    Return
+    -----------
+    logZ: Array
+       Log partition function of each sequence
+    P: Array
+       Marginal probabilities of the labels, shape (B, T, L), zero for padded positions
+    Xi: Array
+       Expected number of each transition, summed over the batch, shape (L, L)
+    """
+    B, T, L = S.shape
+    smax = S.max(axis=2)
+    E = np.exp(S - smax[:, :, None])
+    tmax = trans.max()
+    M = np.exp(trans - tmax)
+
+    alpha = np.empty((B, T, L))
+    scale = np.ones((B, T))
+    a = E[:, 0]
+    c = a.sum(axis=1)
+    alpha[:, 0] = a / c[:, None]
+    scale[:, 0] = c
+    for t in range(1, T):
+        a = alpha[:, t - 1].dot(M) * E[:, t]
+        c = np.where(mask[:, t], a.sum(axis=1), 1.0)
+        alpha[:, t] = a / c[:, None]
+        scale[:, t] = c
+
+    beta = np.empty((B, T, L))
+    beta[:, T - 1] = 1.0
+    for t in range(T - 2, -1, -1):
+        b = (E[:, t + 1] * beta[:, t + 1]).dot(M.T) / scale[:, t + 1][:, None]
+        beta[:, t] = np.where(mask[:, t + 1][:, None], b, 1.0)
+
+    logZ = (np.log(scale) + smax * mask).sum(axis=1) + (lengths - 1) * tmax
+    P = alpha * beta * mask[:, :, None]
+    if T > 1:
+        W = E[:, 1:] * beta[:, 1:] / scale[:, 1:, None] * mask[:, 1:, None]
+        Xi = M * alpha[:, :-1].reshape(-1, L).T.dot(W.reshape(-1, L))
+    else:
+        Xi = np.zeros((L, L))
+    return logZ, P, Xi
+
+
+class Shard(object):
+    """Batches of sequences, computes the loss and the gradient of the log-likelihood on them"""
+
+    def __init__(self, sequences, features):
+        self.features = features
+        self.num_sequences = len(sequences)
+        self.batches = []
+        order = sorted(range(len(sequences)), key=lambda i: len(sequences[i][3]))
+        batch = []
+        tokens = 0
+        for i in order:
+            batch.append(sequences[i])
+            tokens += len(sequences[i][3])
+            if tokens >= BATCH_TOKENS:
+                self.batches.append(Batch(batch))
+                batch = []
+                tokens = 0
+        if batch:
+            self.batches.append(Batch(batch))
+        # Expanded state features of the first batches, as long as they fit in the cache
+        self.expansions = []
+        size = 0
+        for k, batch in enumerate(self.batches):
+            fids, values, cells = self.expanded(k)
+            size += len(fids)
+            if size > EXPANSION_CACHE_SIZE:
+                break
+            # Values of 1 (all the values of most feature sets) are not stored
+            self.expansions.append((fids, None if (values == 1).all() else values, cells))
+        self.observed = self.observed_counts()
+
+    def expand(self, attrs, values, rows):
+        """Returns the state features of attributes, their values and the cells (row * L + label) of their scores"""
+        fs = self.features
+        starts = fs.attr_ptr[attrs]
+        counts = fs.attr_ptr[attrs + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        fids = np.repeat(starts, counts) + offsets
+        cells = np.repeat(rows, counts) * fs.num_labels + fs.feat_label[fids]
+        return fids, np.repeat(values, counts), cells
+
+    def expanded(self, k):
+        """State features of the k-th batch, their values and the cells of their scores"""
+        if k < len(self.expansions):
+            return self.expansions[k]
+        batch = self.batches[k]
+        return self.expand(batch.attrs, batch.values, batch.rows)
+
+    def observed_counts(self):
+        """Feature counts of the reference labels"""
+        fs = self.features
+        L = fs.num_labels
+        counts = np.zeros(fs.size)
+        for k, batch in enumerate(self.batches):
+            fids, values, cells = self.expanded(k)
+            gold = (cells % L) == batch.labels.ravel()[cells // L]
+            counts[:fs.num_state] += np.bincount(fids[gold], weights=None if values is None else values[gold],
+                                                 minlength=fs.num_state)
+            y = batch.labels
+            pairs = (y[:, :-1] * L + y[:, 1:])[batch.mask[:, 1:]]
+            counts[fs.num_state:] += np.bincount(pairs, minlength=L * L)
+        return counts
+
+    def loss_gradient(self, w, gradient=True):
+        """Negative log-likelihood of the shard and its gradient"""
+        fs = self.features
+        L = fs.num_labels
+        w_state, trans = fs.split(w)
+        grad = np.zeros(fs.size) if gradient else None
+        logZ = 0.0
+        for k, batch in enumerate(self.batches):
+            fids, values, cells = self.expanded(k)
+            weights = w_state[fids] if values is None else w_state[fids] * values
+            S = np.bincount(cells, weights=weights, minlength=batch.size * batch.T * L).reshape(batch.size, batch.T, L)
+            lz, P, Xi = forward_backward(S, batch.lengths, batch.mask, trans)
+            logZ += lz.sum()
+            if gradient:
+                weights = P.ravel()[cells] if values is None else P.ravel()[cells] * values
+                grad[:fs.num_state] += np.bincount(fids, weights=weights, minlength=fs.num_state)
+                grad[fs.num_state:] += Xi.ravel()
+        loss = logZ - w.dot(self.observed)
+        if not gradient:
+            return loss
+        grad -= self.observed
+        # Transitions that are not features keep a zero weight
+        grad[fs.num_state:] *= fs.trans_mask.ravel()
+        return loss, grad
+
+    def sgd_epoch(self, w, t, t0, lam, seed):
+        """One epoch of SGD with L2 regularization over the sequences of the shard (in random order)
+        The weights are stored as decay * v, so that the regularization of an
+        update only rescales them.
+        Returns the new weights, the sum of the losses of the sequences and the new update count.
+        """
+        fs = self.features
+        L = fs.num_labels
+        v = w.copy()
+        decay = 1.0
+        loss = 0.0
+        trans_mask = fs.trans_mask.ravel()
+        items = [(k, b) for k, batch in enumerate(self.batches) for b in range(batch.size)]
+        rng = np.random.RandomState(seed)
+        for i in rng.permutation(len(items)):
+            k, b = items[i]
+            batch = self.batches[k]
+            n = int(batch.lengths[b])
+            lo, hi = batch.seq_ptr[b], batch.seq_ptr[b + 1]
+            y = batch.labels[b, :n]
+            fids, values, cells = self.expand(batch.attrs[lo:hi], batch.values[lo:hi], batch.rows[lo:hi] - b * batch.T)
+
+            eta = 1.0 / (lam * (t0 + t))
+            t += 1
+            decay *= 1.0 - eta * lam
+            trans = v[fs.num_state:].reshape(L, L) * decay
+            S = np.bincount(cells, weights=v[fids] * decay * values, minlength=n * L).reshape(1, n, L)
+            lz, P, Xi = forward_backward(S, np.array([n]), np.ones((1, n), dtype=bool), trans)
+
+            gold = (cells % L) == y[cells // L]
+            pairs = y[:-1] * L + y[1:]
+            loss += lz[0] - S.ravel()[np.arange(n) * L + y].sum() - trans.ravel()[pairs].sum()
+
+            np.add.at(v, fids, -eta / decay * (P.ravel()[cells] - gold) * values)
+            g_trans = Xi.ravel() - np.bincount(pairs, minlength=L * L)
+            v[fs.num_state:] -= eta / decay * g_trans * trans_mask
+            if decay < 1e-9:
+                v *= decay
+                decay = 1.0
+        return v * decay, loss, t
+
+
+def serve_shard(conn, shard):
+    """Run a worker process: call the methods of the shard requested by the parent"""
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        method, args = request
+        conn.send(getattr(shard, method)(*args))
+    conn.close()
+
+
+class ShardPool(object):
+    """
+    Shards of the training data, in worker processes (if there are several shards) or in-process.
+    Example usage:
+        pool = ShardPool(shards)
+        results = pool.call("loss_gradient", w)
+        pool.close()
+    """
+    def __init__(self, shards):
+        self.shards = shards
+        self.conns = []
+        self.procs = []
+        if len(shards) > 1:
+            for shard in shards:
+                parent_conn, child_conn = multiprocessing.Pipe()
+                proc = multiprocessing.Process(target=serve_shard, args=(child_conn, shard))
+                proc.daemon = True
+                proc.start()
+                child_conn.close()
+                self.conns.append(parent_conn)
+                self.procs.append(proc)
+
+    def call(self, method, *args):
+        """Call a method of all shards, returns the list of results"""
+        if not self.conns:
+            return [getattr(shard, method)(*args) for shard in self.shards]
+        for conn in self.conns:
+            conn.send((method, args))
+        return [conn.recv() for conn in self.conns]
+
+    def call_each(self, method, args_list):
+        """Call a method of each shard with its own arguments"""
+        if not self.conns:
+            return [getattr(shard, method)(*args) for shard, args in zip(self.shards, args_list)]
+        for conn, args in zip(self.conns, args_list):
+            conn.send((method, args))
+        return [conn.recv() for conn in self.conns]
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+            conn.close()
+        for proc in self.procs:
+            proc.join()
+
+
+def pseudo_gradient(w, g, c1):
+    """Pseudo-gradient of the L1-regularized objective (OWL-QN)"""
+    if c1 == 0:
+        return g
+    pg = g + c1 * np.sign(w)
+    zero = w == 0
+    gz = g[zero]
+    pg[zero] = np.where(gz + c1 < 0, gz + c1, np.where(gz - c1 > 0, gz - c1, 0.0))
+    return pg
+
+
+def two_loop(g, memory):
+    """L-BFGS two-loop recursion, returns the product of the inverse Hessian approximation and g"""
+    q = g.copy()
+    alphas = []
+    for s, y, rho in reversed(memory):
+        a = rho * s.dot(q)
+        q -= a * y
+        alphas.append(a)
+    if memory:
+        s, y, rho = memory[-1]
+        q *= s.dot(y) / y.dot(y)
+    for (s, y, rho), a in zip(memory, reversed(alphas)):
+        b = rho * y.dot(q)
+        q += (a - b) * s
+    return q
+
+
+class CRFTrainer(object):
+    """
+    Linear-chain CRF trainer (see the options of `crfsuite learn`).
+    Example usage:
+        trainer = CRFTrainer("l2sgd", {"c2": 3.2, "feature.possible_states": 1}, workers=4)
+        trainer.append_data(extractor, "train.txt")
+        trainer.train("model.bin")
+    """
+    def __init__(self, algorithm="lbfgs", params=None, workers=1):
+        """Initialize the trainer.
+        Args:
+            algorithm: lbfgs or l2sgd.
+            params: Dict of parameters (names of crfsuite), values can be strings.
+            workers: Number of processes that compute the gradients.
+        """
+        if algorithm not in ALGORITHM_PARAMS:
+            raise ValueError("Unsupported training algorithm: %s" % algorithm)
+        self.algorithm = algorithm
+        self.params = dict(ALGORITHM_PARAMS[algorithm])
+        self.params.update(FEATURE_PARAMS)
+        for name, value in (params or {}).items():
+            if name not in self.params:
+                print("[Warning] Parameter %s is not supported by %s, ignored" % (name, algorithm))
+                continue
+            self.params[name] = type(self.params[name])(float(value))
+        self.workers = workers
+
+        self.labels = []
+        self.label_ids = dict()
+        self.attributes = []
+        self.attr_ids = dict()
+        self.sequences = []
+        # (attribute, label) pairs of the data
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.pending_keys = []
+        self.num_pending = 0
+
+    @classmethod
+    def from_crf_options(cls, crf_options, workers=1):
+        algorithm, params, others = parse_crf_options(crf_options)
+        if others:
+            print("[Warning] Options %s are ignored" % " ".join(others))
+        return cls(algorithm or "lbfgs", dict(params), workers)
+
+    def label_id(self, label):
+        i = self.label_ids.get(label)
+        if i is None:
+            i = self.label_ids[label] = len(self.labels)
+            if i >> LABEL_BITS:
+                raise ValueError("Too many labels")
+            self.labels.append(label)
+        return i
+
+    def append(self, xseq, yseq):
+        """Append a training sequence
+        Args:
+            xseq: List of items, an item is a list of (attribute, value) pairs
+                  (see crfsuite_model.to_attributes).
+            yseq: List of labels.
+        """
+        if len(xseq) != len(yseq):
+            raise ValueError("The numbers of items (%d) and labels (%d) differ" % (len(xseq), len(yseq)))
+        if not xseq:
+            return
+        attr_ids = self.attr_ids
+        counts = []
+        attrs = []
+        values = []
+        for item in xseq:
+            counts.append(len(item))
+            for name, value in item:
+                a = attr_ids.get(name)
+                if a is None:
+                    a = attr_ids[name] = len(self.attributes)
+                    self.attributes.append(name)
+                attrs.append(a)
+                values.append(value)
+        y = np.array([self.label_id(label) for label in yseq], dtype=np.int64)
+        counts = np.array(counts, dtype=np.int64)
+        attrs = np.array(attrs, dtype=np.int64)
+        self.sequences.append((counts, attrs, np.array(values, dtype=np.float64), y))
+
+        self.pending_keys.append((attrs << LABEL_BITS) | np.repeat(y, counts))
+        self.num_pending += len(attrs)
+        if self.num_pending > 1 << 22:
+            self.merge_keys()
+
+    def merge_keys(self):
+        if self.pending_keys:
+            self.keys = np.unique(np.concatenate([self.keys] + self.pending_keys))
+            self.pending_keys = []
+            self.num_pending = 0
+
+    def append_data(self, extractor, data_file, field='y'):
+        """Append the sequences of a data file, with the features of a FeatureExtractor"""
+        with open(data_file) as fi:
+            for X in crfutils.readiter(fi, extractor.fields.split(' '), compact=True):
+                if not X:
+                    continue
+                extractor.feature_extractor(X)
+                self.append([to_attributes(x['F']) for x in X], [x[field] for x in X])
+
+    def append_file(self, feature_file):
+        """Append the sequences of a feature file in CRFsuite format"""
+        with open(feature_file) as fi:
+            xseq, yseq = [], []
+            for line in fi:
+                line = line.rstrip('\n')
+                if not line:
+                    self.append(xseq, yseq)
+                    xseq, yseq = [], []
+                else:
+                    label, attrs = parse_item(line)
+                    xseq.append(attrs)
+                    yseq.append(label)
+            self.append(xseq, yseq)
+
+    def feature_set(self):
+        """Generate the features of the training data"""
+        self.merge_keys()
+        L = len(self.labels)
+        if self.params["feature.possible_states"]:
+            keys = (np.arange(len(self.attributes), dtype=np.int64)[:, None] << LABEL_BITS) | np.arange(L)[None, :]
+            keys = keys.ravel()
+        else:
+            keys = self.keys
+        if self.params["feature.possible_transitions"]:
+            trans_mask = np.ones((L, L), dtype=bool)
+        else:
+            trans_mask = np.zeros((L, L), dtype=bool)
+            for _, _, _, y in self.sequences:
+                trans_mask[y[:-1], y[1:]] = True
+        return FeatureSet(list(self.labels), self.attributes, keys, trans_mask)
+
+    def train(self, model_file):
+        """Train the model and write it to model_file"""
+        start = time.time()
+        features = self.feature_set()
+        print("Number of instances: %d" % len(self.sequences))
+        print("Number of labels: %d" % features.num_labels)
+        print("Number of attributes: %d" % len(features.attributes))
+        print("Number of features: %d (state: %d, transition: %d)" % (
+            features.num_state + features.trans_mask.sum(), features.num_state, features.trans_mask.sum()))
+        print("Algorithm: %s, parameters: %s" % (self.algorithm, " ".join(
+            "%s=%s" % (name, value) for name, value in sorted(self.params.items()))))
+
+        # Shards of similar total lengths
+        order = sorted(range(len(self.sequences)), key=lambda i: -len(self.sequences[i][3]))
+        workers = max(1, min(self.workers, len(self.sequences)))
+        shards = [Shard([self.sequences[i] for i in order[k::workers]], features) for k in range(workers)]
+        pool = ShardPool(shards)
+        try:
+            if self.algorithm == "lbfgs":
+                w = self.lbfgs(pool, features)
+            else:
+                w = self.l2sgd(pool, features)
+        finally:
+            pool.close()
+
+        n = features.write_model(model_file, w)
+        print("Active features: %d" % n)
+        print("Total seconds required for training: %.3f" % (time.time() - start), flush=True)
+        return w
+
+    def lbfgs(self, pool, features):
+        p = self.params
+        c1, c2 = p["c1"], p["c2"]
+
+        def evaluate(w):
+            results = pool.call("loss_gradient", w)
+            f = sum(r[0] for r in results) + c2 * w.dot(w)
+            g = sum(r[1] for r in results) + 2 * c2 * w
+            return f, g
+
+        w = np.zeros(features.size)
+        f, g = evaluate(w)
+        objective = f
+        memory = deque(maxlen=p["num_memories"])
+        history = []
+        for k in range(1, p["max_iterations"] + 1):
+            begin = time.time()
+            pg = pseudo_gradient(w, g, c1)
+            d = -two_loop(pg, memory)
+            if c1 > 0:
+                # Keep the direction in the orthant of the pseudo-gradient
+                d[d * pg >= 0] = 0.0
+                orthant = np.where(w != 0, np.sign(w), -np.sign(pg))
+            step = 1.0 / np.linalg.norm(d) if k == 1 else 1.0
+            for trials in range(1, p["max_linesearch"] + 1):
+                w_new = w + step * d
+                if c1 > 0:
+                    w_new[np.sign(w_new) != orthant] = 0.0
+                f_new, g_new = evaluate(w_new)
+                objective_new = f_new + c1 * np.abs(w_new).sum()
+                if objective_new <= objective + 1e-4 * pg.dot(w_new - w):
+                    break
+                step *= 0.5
+            else:
+                print("L-BFGS terminated: the line search failed")
+                break
+            s, y = w_new - w, g_new - g
+            if s.dot(y) > 0:
+                memory.append((s, y, 1.0 / s.dot(y)))
+            w, f, g, objective = w_new, f_new, g_new, objective_new
+
+            print("Iteration %d: loss=%f, feature norm=%f, active features=%d, line search trials=%d, %.3f sec." % (
+                k, objective, np.linalg.norm(w), np.count_nonzero(w), trials, time.time() - begin), flush=True)
+
+            if np.linalg.norm(pseudo_gradient(w, g, c1)) / max(1.0, np.linalg.norm(w)) <= p["epsilon"]:
+                print("L-BFGS resulted in convergence")
+                break
+            history.append(objective)
+            if len(history) > p["period"]:
+                improvement = (history[-1 - p["period"]] - objective) / objective
+                if improvement < p["delta"]:
+                    print("L-BFGS terminated: the improvement of the loss is below delta")
+                    break
+        return w
+
+    def l2sgd(self, pool, features):
+        p = self.params
+        N = len(self.sequences)
+        lam = 2.0 * p["c2"] / N
+        eta = self.calibrate(features, lam)
+        t0 = 1.0 / (lam * eta)
+        print("Learning rate (eta): %f" % eta)
+
+        w = np.zeros(features.size)
+        t = 0
+        history = []
+        for epoch in range(1, p["max_iterations"] + 1):
+            begin = time.time()
+            results = pool.call_each("sgd_epoch", [(w, t, t0, lam, epoch * 1000 + k) for k in range(len(pool.shards))])
+            # Iterative parameter mixing: average the weights of the shards
+            w = sum(r[0] for r in results) / len(results)
+            t = max(r[2] for r in results)
+            loss = sum(r[1] for r in results) + 0.5 * lam * N * w.dot(w)
+            print("Epoch %d: loss=%f, feature norm=%f, %.3f sec." % (epoch, loss, np.linalg.norm(w), time.time() - begin),
+                  flush=True)
+            history.append(loss)
+            if len(history) > p["period"]:
+                improvement = (history[-1 - p["period"]] - loss) / loss
+                if improvement < p["delta"]:
+                    print("SGD terminated: the improvement of the loss is below delta")
+                    break
+        return w
+
+    def calibrate(self, features, lam):
+        """Choose the initial learning rate on a sample of the training data (as crfsuite)"""
+        p = self.params
+        rng = np.random.RandomState(0)
+        n = min(len(self.sequences), p["calibration.samples"])
+        sample = Shard([self.sequences[i] for i in rng.permutation(len(self.sequences))[:n]], features)
+        w0 = np.zeros(features.size)
+        init_loss = sample.loss_gradient(w0, gradient=False)
+
+        best_eta, best_loss = p["calibration.eta"], None
+        eta = p["calibration.eta"]
+        candidates = p["calibration.candidates"]
+        decreasing = False
+        for trial in range(p["calibration.max_trials"]):
+            w, _, _ = sample.sgd_epoch(w0, 0, 1.0 / (lam * eta), lam, 0)
+            loss = sample.loss_gradient(w, gradient=False) + 0.5 * lam * n * w.dot(w)
+            ok = np.isfinite(loss) and loss < init_loss
+            if ok:
+                candidates -= 1
+                if best_loss is None or loss < best_loss:
+                    best_eta, best_loss = eta, loss
+            print("Calibration: eta=%f, loss=%f%s" % (eta, loss, "" if ok else " (worse)"))
+            if not decreasing:
+                if ok and candidates > 0:
+                    eta *= p["calibration.rate"]
+                else:
+                    decreasing = True
+                    candidates = p["calibration.candidates"]
+                    eta = p["calibration.eta"] / p["calibration.rate"]
+            else:
+                if candidates <= 0:
+                    break
+                eta /= p["calibration.rate"]
+        return best_eta
+
+
+def tag_data(extractor, model, data_file, tag_file, batch_size=500):
+    """Tag a data file with the features of a FeatureExtractor, the same output as `crfsuite tag`
+    model is a CRFSuiteModel or a TaggerPool.
+    """
+    def write_tags(fo, tags):
+        for y in tags:
+            fo.write("".join("%s\n" % label for label in y) + "\n")
+
+    with open(data_file) as fi, open(tag_file, 'w') as fo:
+        batch = []
+        for X in crfutils.readiter(fi, extractor.fields.split(' '), compact=True):
+            if not X:
+                continue
+            extractor.feature_extractor(X)
+            batch.append(X)
+            if len(batch) >= batch_size:
+                write_tags(fo, model.tag_sequences(batch))
+                batch = []
+        if batch:
+            write_tags(fo, model.tag_sequences(batch))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["learn"], help="Only learn is supported")
+    parser.add_argument("-workers", type=int, default=1, help="Number of processes that compute the gradients")
+    parser.add_argument("-a", dest="algorithm", default="lbfgs", help="Training algorithm (lbfgs or l2sgd)")
+    parser.add_argument("-p", dest="params", action="append", default=[], help="Parameter (name=value)")
+    parser.add_argument("-m", dest="model_file", required=True, help="Path to the model file")
+    parser.add_argument("feature_file", help="Path to the training feature file (CRFsuite format)")
+    args = parser.parse_args()
+
+    params = dict(p.partition("=")[::2] for p in args.params)
+    trainer = CRFTrainer(args.algorithm, params, workers=args.workers)
+    start = time.time()
+    trainer.append_file(args.feature_file)
+    print("Read %s in %.3f sec." % (args.feature_file, time.time() - start))
+    trainer.train(args.model_file)
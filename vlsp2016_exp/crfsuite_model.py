@@ -0,0 +1,481 @@
+"""Class encapsulating a CRFsuite model.
+   Reads the binary model file written by `crfsuite learn` (model.bin)
+   and tags item sequences in-process with the Viterbi algorithm, so
+   that tagging does not need to spawn `crfsuite tag` and to write the
+   feature file to disk.
+   Models are written in the same format by write_model (e.g., by the native
+   trainer and the model compression tool).
+"""
+import struct
+import numpy as np
+import crfutils
+
+
+class ModelFormatError(Exception):
+    pass
+
+
+# Layout of a feature in the FEAT chunk: type, source, destination, weight.
+FEATURE_DTYPE = np.dtype([('type', '<u4'), ('src', '<u4'), ('dst', '<u4'), ('weight', '<f8')])
+
+# Feature types.
+FT_STATE = 0
+FT_TRANS = 1
+
+
+def read_cqdb(buf, offset):
+    """Read the strings of a Constant Quark Database (CQDB) chunk
+    Parameters
+    -----------
+    buf: bytes
+       Content of the model file
+    offset: int
+       Offset of the CQDB chunk in the model file
+
+    Return
+    -----------
+    strings: List
+       List of strings indexed by their identifiers
+    """
+    chunk, _, _, _, bwd_size, bwd_offset = struct.unpack_from('<4sIIIII', buf, offset)
+    if chunk != b'CQDB':
+        raise ModelFormatError('Invalid CQDB chunk at offset %d' % offset)
+    strings = []
+    bwd = struct.unpack_from('<%dI' % bwd_size, buf, offset + bwd_offset)
+    for i, p in enumerate(bwd):
+        if p == 0:
+            # No string is associated with this identifier.
+            strings.append(None)
+            continue
+        _, ksize = struct.unpack_from('<II', buf, offset + p)
+        start = offset + p + 8
+        # The key is stored with its null terminator.
+        strings.append(buf[start:start + ksize - 1].decode('utf-8'))
+    return strings
+
+
+def read_refs(buf, offset, num):
+    """Read the feature references (list of feature ids) of num items"""
+    chunk, _, n = struct.unpack_from('<4sII', buf, offset)
+    if n != num:
+        raise ModelFormatError('Invalid number of references in chunk %r' % chunk)
+    refs = []
+    for p in struct.unpack_from('<%dI' % num, buf, offset + 12):
+        k, = struct.unpack_from('<I', buf, p)
+        refs.append(np.frombuffer(buf, dtype='<u4', count=k, offset=p + 4))
+    return refs
+
+
+def rot(x, k):
+    return ((x << k) | (x >> (32 - k))) & 0xffffffff
+
+
+def hashlittle(key, initval=0):
+    """Jenkins lookup3 hash of a byte string (hash function of CQDB)"""
+    M = 0xffffffff
+    length = len(key)
+    a = b = c = (0xdeadbeef + length + initval) & M
+    i = 0
+    while length > 12:
+        a = (a + int.from_bytes(key[i:i + 4], 'little')) & M
+        b = (b + int.from_bytes(key[i + 4:i + 8], 'little')) & M
+        c = (c + int.from_bytes(key[i + 8:i + 12], 'little')) & M
+        a = (a - c) & M; a ^= rot(c, 4); c = (c + b) & M
+        b = (b - a) & M; b ^= rot(a, 6); a = (a + c) & M
+        c = (c - b) & M; c ^= rot(b, 8); b = (b + a) & M
+        a = (a - c) & M; a ^= rot(c, 16); c = (c + b) & M
+        b = (b - a) & M; b ^= rot(a, 19); a = (a + c) & M
+        c = (c - b) & M; c ^= rot(b, 4); b = (b + a) & M
+        length -= 12
+        i += 12
+    if length == 0:
+        return c
+    tail = key[i:] + b'\0' * (12 - length)
+    a = (a + int.from_bytes(tail[0:4], 'little')) & M
+    b = (b + int.from_bytes(tail[4:8], 'little')) & M
+    c = (c + int.from_bytes(tail[8:12], 'little')) & M
+    c ^= b; c = (c - rot(b, 14)) & M
+    a ^= c; a = (a - rot(c, 11)) & M
+    b ^= a; b = (b - rot(a, 25)) & M
+    c ^= b; c = (c - rot(b, 16)) & M
+    a ^= c; a = (a - rot(c, 4)) & M
+    b ^= a; b = (b - rot(a, 14)) & M
+    c ^= b; c = (c - rot(b, 24)) & M
+    return c
+
+
+def cqdb_chunk(strings):
+    """Build a Constant Quark Database (CQDB) chunk, the i-th string gets the identifier i"""
+    num_tables = 256
+    data_offset = 24 + 8 * num_tables
+    tables = [[] for i in range(num_tables)]
+    records = []
+    bwd = []
+    offset = data_offset
+    for i, s in enumerate(strings):
+        key = s.encode("utf-8") + b"\0"
+        h = hashlittle(key)
+        tables[h % num_tables].append((h, offset))
+        bwd.append(offset)
+        record = struct.pack("<II", i, len(key)) + key
+        records.append(record)
+        offset += len(record)
+
+    refs = []
+    buckets = []
+    for table in tables:
+        if not table:
+            refs.append((0, 0))
+            continue
+        n = len(table) * 2
+        slots = [(0, 0)] * n
+        for h, p in table:
+            k = (h >> 8) % n
+            while slots[k][1] != 0:
+                k = (k + 1) % n
+            slots[k] = (h, p)
+        refs.append((offset, n))
+        data = b"".join(struct.pack("<II", h, p) for h, p in slots)
+        buckets.append(data)
+        offset += len(data)
+
+    bwd_offset = offset
+    offset += 4 * len(bwd)
+    header = struct.pack("<4sIIIII", b"CQDB", offset, 0, 0x62445371, len(bwd), bwd_offset)
+    header += b"".join(struct.pack("<II", p, n) for p, n in refs)
+    return b"".join([header] + records + buckets + [struct.pack("<%dI" % len(bwd), *bwd)])
+
+
+def refs_chunk(chunk_id, offset, refs):
+    """Build a chunk of feature references (lists of feature ids) located at offset in the file"""
+    pos = offset + 12 + 4 * len(refs)
+    offsets = []
+    body = []
+    for r in refs:
+        if r is None:
+            offsets.append(0)
+            continue
+        data = struct.pack("<I", len(r)) + np.asarray(r, dtype="<u4").tobytes()
+        offsets.append(pos)
+        body.append(data)
+        pos += len(data)
+    header = struct.pack("<4sII", chunk_id, pos - offset, len(refs)) + struct.pack("<%dI" % len(refs), *offsets)
+    return b"".join([header] + body)
+
+
+def write_model(model_file, labels, attributes, features):
+    """Write a model in the format of `crfsuite learn`
+    Parameters
+    -----------
+    model_file: str
+       Path to the model file
+    labels: List
+       Label names
+    attributes: List
+       Attribute names, the sources of the state features
+    features: numpy array of FEATURE_DTYPE
+       Transition and state features. The attributes without state features
+       are left out (and the others renumbered), as crfsuite does.
+
+    Return
+    -----------
+    num_features: int
+       Number of features of the model
+    """
+    trans = features[features['type'] == FT_TRANS]
+    state = features[features['type'] == FT_STATE]
+    state = state[np.argsort(state['src'], kind='stable')]
+    attr_ids, new_attr = np.unique(state['src'], return_inverse=True)
+    state['src'] = new_attr
+    features = np.concatenate([trans, state])
+    n = len(trans)
+
+    fids = np.arange(len(features))
+    label_refs = [fids[:n][trans['src'] == i] for i in range(len(labels))] + [None, None]
+    state_ptr = np.searchsorted(new_attr, np.arange(len(attr_ids) + 1))
+    attr_refs = [fids[n + state_ptr[i]:n + state_ptr[i + 1]] for i in range(len(attr_ids))]
+
+    chunks = []
+    offset = 48
+    off_features = offset
+    chunks.append(struct.pack("<4sII", b"FEAT", 12 + features.nbytes, len(features)) + features.tobytes())
+    offset += len(chunks[-1])
+    off_labels = offset
+    chunks.append(cqdb_chunk(labels))
+    offset += len(chunks[-1])
+    off_attrs = offset
+    chunks.append(cqdb_chunk([attributes[a] for a in attr_ids]))
+    offset += len(chunks[-1])
+    off_labelrefs = offset
+    chunks.append(refs_chunk(b"LFRF", offset, label_refs))
+    offset += len(chunks[-1])
+    off_attrrefs = offset
+    chunks.append(refs_chunk(b"AFRF", offset, attr_refs))
+    offset += len(chunks[-1])
+
+    header = struct.pack("<4sI4s9I", b"lCRF", offset, b"FOMC", 100, len(features), len(labels), len(attr_ids),
+                         off_features, off_labels, off_attrs, off_labelrefs, off_attrrefs)
+    with open(model_file, "wb") as fo:
+        fo.write(header)
+        for chunk in chunks:
+            fo.write(chunk)
+    return len(features)
+
+
+def read_attributes(model_file):
+    """Read the attribute names of a model file, without its features"""
+    with open(model_file, 'rb') as f:
+        buf = f.read()
+    magic, _, model_type = struct.unpack_from('<4sI4s', buf, 0)
+    if magic != b'lCRF' or model_type != b'FOMC':
+        raise ModelFormatError('Not a CRFsuite model file')
+    off_attrs, = struct.unpack_from('<I', buf, 36)
+    return [a for a in read_cqdb(buf, off_attrs) if a is not None]
+
+
+def to_attributes(F):
+    """Convert the features of an item to (attribute, value) pairs
+    The conversion is the same as writing the features with
+    crfutils.output_features and reading them with the crfsuite frontend.
+    """
+    attrs = []
+    for a in F:
+        if isinstance(a, str):
+            if a.startswith('em'):
+                name, sep, value = a.partition(':')
+                attrs.append((name, float(value) if sep else 1.0))
+            else:
+                attrs.append((crfutils.escape(a), 1.0))
+        else:
+            attrs.append((crfutils.escape(a[0]), float('%f' % a[1])))
+    return attrs
+
+
+def parse_item(line):
+    """Parse a line of a feature file in CRFsuite format
+    Return the reference label and the list of (attribute, value) pairs
+    """
+    fields = line.split('\t')
+    attrs = []
+    for field in fields[1:]:
+        if not field:
+            continue
+        name, sep, value = field.partition(':')
+        attrs.append((name, float(value) if sep else 1.0))
+    return fields[0], attrs
+
+
+def read_sequences(fi):
+    """Return an iterator for item sequences (lists of attribute lists) in a feature file"""
+    xseq = []
+    for line in fi:
+        line = line.rstrip('\n')
+        if not line:
+            if xseq:
+                yield xseq
+            xseq = []
+        else:
+            xseq.append(parse_item(line)[1])
+    if xseq:
+        yield xseq
+
+
+class CRFSuiteModel(object):
+    """
+    Linear-chain CRF model trained by CRFsuite (crf1d model type).
+    Example usage:
+        model = CRFSuiteModel("model.bin")
+        extractor.feature_extractor(X)
+        tags = model.tag(X)
+    """
+    def __init__(self, model_file):
+        """Load the model.
+        Args:
+            model_file: Path to the model file written by `crfsuite learn`.
+        """
+        with open(model_file, 'rb') as f:
+            buf = f.read()
+        self.load(buf)
+
+    def load(self, buf):
+        (magic, _, model_type, _, _, num_labels, num_attrs,
+         off_features, off_labels, off_attrs, off_labelrefs, off_attrrefs) = struct.unpack_from('<4sI4s9I', buf, 0)
+        if magic != b'lCRF' or model_type != b'FOMC':
+            raise ModelFormatError('Not a CRFsuite model file')
+
+        self.labels = read_cqdb(buf, off_labels)
+        attrs = read_cqdb(buf, off_attrs)
+        self.attr_to_id = dict((a, i) for i, a in enumerate(attrs) if a is not None)
+        self.num_labels = num_labels
+        self.num_attrs = num_attrs
+
+        # The number of features is only recorded in the FEAT chunk.
+        chunk, _, n = struct.unpack_from('<4sII', buf, off_features)
+        if chunk != b'FEAT':
+            raise ModelFormatError('Invalid FEAT chunk')
+        features = np.frombuffer(buf, dtype=FEATURE_DTYPE, count=n, offset=off_features + 12)
+
+        # Transition weights, trans[i, j] is the weight of the transition i -> j.
+        self.trans = np.zeros((num_labels, num_labels))
+        is_trans = features['type'] == FT_TRANS
+        self.trans[features['src'][is_trans], features['dst'][is_trans]] = features['weight'][is_trans]
+
+        # State features of each attribute, stored in the order of the
+        # attribute references so that scores are accumulated as in CRFsuite.
+        refs = read_refs(buf, off_attrrefs, num_attrs)
+        counts = np.array([len(r) for r in refs], dtype=np.int64)
+        ids = np.concatenate(refs) if refs else np.zeros(0, dtype='<u4')
+        self.attr_ptr = np.zeros(num_attrs + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.attr_ptr[1:])
+        self.attr_labels = features['dst'][ids].astype(np.int64)
+        self.attr_weights = features['weight'][ids].astype(np.float64)
+
+    def attributes(self):
+        """Returns the list of attribute names, indexed by attribute id"""
+        attributes = [None] * self.num_attrs
+        for a, i in self.attr_to_id.items():
+            attributes[i] = a
+        return attributes
+
+    def features(self):
+        """Returns the features of the model (transition features, then state
+        features in the order of the attribute references), the input of write_model
+        """
+        src, dst = np.nonzero(self.trans)
+        n = len(src)
+        features = np.zeros(n + len(self.attr_labels), dtype=FEATURE_DTYPE)
+        features['type'][:n] = FT_TRANS
+        features['src'][:n] = src
+        features['dst'][:n] = dst
+        features['weight'][:n] = self.trans[src, dst]
+        features['type'][n:] = FT_STATE
+        features['src'][n:] = np.repeat(np.arange(self.num_attrs), np.diff(self.attr_ptr))
+        features['dst'][n:] = self.attr_labels
+        features['weight'][n:] = self.attr_weights
+        return features
+
+    def state_scores(self, xseq):
+        """Compute state scores of a sequence of attribute lists
+        Return a matrix of shape (len(xseq), num_labels)
+        """
+        items = []
+        attr_ids = []
+        values = []
+        for t, attrs in enumerate(xseq):
+            for name, value in attrs:
+                a = self.attr_to_id.get(name)
+                if a is not None:
+                    items.append(t)
+                    attr_ids.append(a)
+                    values.append(value)
+        state = np.zeros((len(xseq), self.num_labels))
+        if not attr_ids:
+            return state
+        attr_ids = np.array(attr_ids, dtype=np.int64)
+        starts = self.attr_ptr[attr_ids]
+        counts = self.attr_ptr[attr_ids + 1] - starts
+        # Indices of the state features of all attributes, in order.
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        fids = np.repeat(starts, counts) + offsets
+        rows = np.repeat(np.array(items, dtype=np.int64), counts)
+        weights = self.attr_weights[fids] * np.repeat(np.array(values), counts)
+        np.add.at(state, (rows, self.attr_labels[fids]), weights)
+        return state
+
+    def viterbi(self, states):
+        """Find the best label paths of a batch of sequences
+        Parameters
+        -----------
+        states: List
+           List of state score matrices (one for each sequence)
+
+        Return
+        -----------
+        paths: List
+           List of label id sequences
+        """
+        lengths = np.array([len(s) for s in states], dtype=np.int64)
+        paths = [[] for s in states]
+        if len(states) == 0 or lengths.max() == 0:
+            return paths
+        B, T, L = len(states), lengths.max(), self.num_labels
+        S = np.zeros((B, T, L))
+        for b, s in enumerate(states):
+            S[b, :len(s)] = s
+        score = S[:, 0, :].copy()
+        back = np.zeros((B, T, L), dtype=np.int64)
+        for t in range(1, T):
+            cand = score[:, :, None] + self.trans[None, :, :]
+            # argmax returns the first maximum, the same tie-breaking as CRFsuite.
+            best = cand.argmax(axis=1)
+            curr = np.take_along_axis(cand, best[:, None, :], axis=1)[:, 0, :] + S[:, t, :]
+            active = lengths > t
+            score[active] = curr[active]
+            back[active, t] = best[active]
+        for b in range(B):
+            n = lengths[b]
+            if n == 0:
+                continue
+            path = [int(score[b].argmax())]
+            for t in range(n - 1, 0, -1):
+                path.append(int(back[b, t, path[-1]]))
+            paths[b] = path[::-1]
+        return paths
+
+    def tag_attributes(self, xseqs):
+        """Tag a batch of sequences of attribute lists, return lists of labels"""
+        paths = self.viterbi([self.state_scores(xseq) for xseq in xseqs])
+        return [[self.labels[i] for i in path] for path in paths]
+
+    def tag(self, X):
+        """Tag a sequence whose features were generated by FeatureExtractor.feature_extractor"""
+        return self.tag_sequences([X])[0]
+
+    def tag_sequences(self, Xs, batch_size=64):
+        """Tag a list of sequences whose features were generated by FeatureExtractor.feature_extractor"""
+        tags = []
+        for i in range(0, len(Xs), batch_size):
+            batch = Xs[i:i + batch_size]
+            tags += self.tag_attributes([[to_attributes(x['F']) for x in X] for X in batch])
+        return tags
+
+    def tag_file(self, input_file, output_file, batch_size=64):
+        """Tag a feature file in CRFsuite format, the same output as `crfsuite tag`"""
+        with open(input_file) as fi, open(output_file, 'w') as fo:
+            batch = []
+            for xseq in read_sequences(fi):
+                batch.append(xseq)
+                if len(batch) >= batch_size:
+                    self.write_tags(fo, self.tag_attributes(batch))
+                    batch = []
+            if batch:
+                self.write_tags(fo, self.tag_attributes(batch))
+
+    def write_tags(self, fo, tags):
+        for y in tags:
+            for label in y:
+                fo.write('%s\n' % label)
+            fo.write('\n')
+
+
+def tag_sequences_multi(models, Xs, batch_size=64):
+    """Tag a list of sequences with several models
+    The attributes of each batch are converted once and decoded by all models.
+    Parameters
+    -----------
+    models: List
+       List of CRFSuiteModel
+    Xs: List
+       Sequences whose features were generated by FeatureExtractor.feature_extractor
+
+    Return
+    -----------
+    tags: List
+       For each model, the list of label sequences
+    """
+    tags = [[] for model in models]
+    for i in range(0, len(Xs), batch_size):
+        xseqs = [[to_attributes(x['F']) for x in X] for X in Xs[i:i + batch_size]]
+        for k, model in enumerate(models):
+            tags[k] += model.tag_attributes(xseqs)
+    return tags
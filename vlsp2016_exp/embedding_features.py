@@ -0,0 +1,137 @@
+"""Class encapsulating a table of preformatted word embedding features.
+   The values of the em1..emD observations of a word are formatted once
+   and then shared by all occurrences of the word.
+"""
+import sys
+
+
+def format_value(value):
+    return '1:%g' % value
+
+
+def embedding_range(embedding):
+    """Returns the minimum and maximum values of all vectors of an embedding"""
+    if hasattr(embedding, 'vectors'):
+        # EmbeddingStore
+        lo, hi = float(embedding.vectors.min()), float(embedding.vectors.max())
+        return min(lo * embedding.scale, hi * embedding.scale), max(lo * embedding.scale, hi * embedding.scale)
+    lo, hi = 0.0, 0.0
+    for vec in embedding.values():
+        lo = min(lo, min(vec))
+        hi = max(hi, max(vec))
+    return float(lo), float(hi)
+
+
+class UniformQuantizer(object):
+    """
+    Uniform scalar quantization of embedding values to a number of levels.
+    The range [lo, hi] is split into equal bins and a value is replaced by
+    the index of its bin, centered around zero (e.g., -1.5, -0.5, 0.5, 1.5
+    for 4 levels), which gives short feature values.
+    """
+    def __init__(self, levels, lo, hi):
+        if levels < 2:
+            raise ValueError("Invalid number of quantization levels: %d" % levels)
+        self.levels = levels
+        self.lo = lo
+        self.width = (hi - lo) / levels if hi > lo else 1.0
+
+    def __call__(self, value):
+        k = int((value - self.lo) / self.width)
+        k = min(max(k, 0), self.levels - 1)
+        return format_value(k - (self.levels - 1) / 2.0)
+
+
+class SignQuantizer(object):
+    """
+    Binarization of embedding values: 1 for positive values, -1 for negative
+    values and 0 for zero (e.g., the zero vector of unknown words).
+    """
+    def __call__(self, value):
+        if value > 0:
+            return '1:1'
+        elif value < 0:
+            return '1:-1'
+        return '1:0'
+
+
+def get_quantizer(quantize, embedding):
+    """Create a quantizer from the 'quantize' setting of the config file
+    Parameters
+    -----------
+    quantize: Dict
+       e.g., {'mode': 'uniform', 'bits': 4} or {'mode': 'sign'}
+    embedding: Dict or EmbeddingStore
+
+    Return
+    -----------
+    quantizer: callable that formats a value, or None if no quantization is used
+    """
+    if quantize is None:
+        return None
+    mode = quantize.get('mode')
+    if mode == 'uniform':
+        lo, hi = embedding_range(embedding)
+        return UniformQuantizer(2 ** quantize.get('bits', 4), lo, hi)
+    elif mode == 'sign':
+        return SignQuantizer()
+    elif mode is None or mode == 'none':
+        return None
+    raise ValueError("Invalid quantization mode: %s" % mode)
+
+
+class EmbeddingFeatureTable(object):
+    """
+    Maps a word to the tuple of formatted values of its embedding features.
+    Words that are not in the embedding share the zero-vector tuple.
+    Example usage:
+        table = EmbeddingFeatureTable(embedding, 25)
+        for d, value in enumerate(table.get("hà_nội")):
+            v['em%d' % (d+1)] = value
+    """
+    def __init__(self, embedding, dim, fallbacks=('<punct>', '<number>'), quantizer=None):
+        """Initialize the table.
+        Args:
+            embedding: Mapping from words to vectors (dict or EmbeddingStore).
+            dim: Dimension of vectors.
+            fallbacks: Special words that are formatted in advance.
+            quantizer: Function that formats a quantized value (see get_quantizer),
+                       values are formatted with full precision if it is None.
+        """
+        self.embedding = embedding
+        self.dim = dim
+        self.format_value = quantizer if quantizer is not None else format_value
+        # Formatted values are interned, so equal values share one string.
+        self.values = dict()
+        self.table = dict()
+        self.zero = self.format([0.0] * dim)
+        for word in fallbacks:
+            self.get(word)
+
+    def format(self, vec):
+        values = []
+        for d in range(len(vec)):
+            s = self.format_value(vec[d])
+            values.append(self.values.setdefault(s, s))
+        return tuple(values)
+
+    def get(self, word):
+        """Returns the formatted values of the embedding features of a word."""
+        values = self.table.get(word)
+        if values is None:
+            if word not in self.embedding:
+                return self.zero
+            values = self.format(self.embedding[word])
+            self.table[word] = values
+        return values
+
+    def memory_usage(self):
+        """Returns the approximate memory used by the table (in bytes)."""
+        size = sys.getsizeof(self.table) + sys.getsizeof(self.values) + sys.getsizeof(self.zero)
+        size += sum(sys.getsizeof(word) + sys.getsizeof(values) for word, values in self.table.items())
+        size += sum(sys.getsizeof(s) for s in self.values.keys())
+        return size
+
+    def stats(self):
+        return "Embedding feature table: words=%d, distinct values=%d, memory=%.2f MB" % (
+            len(self.table), len(self.values), self.memory_usage() / (1024.0 * 1024.0))
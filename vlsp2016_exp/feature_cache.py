@@ -0,0 +1,174 @@
+"""Content-addressed cache of feature files.
+   A feature file (CRFsuite format) only depends on the input data file,
+   the feature settings of the configuration file, the resources they
+   refer to (word embeddings, Brown clusters, gazetteer) and the code of
+   the feature extractor. The cache key is a hash of all of them, so runs
+   that only change the CRF options (e.g., a sweep over c2) reuse the
+   feature file extracted by the first run.
+
+   Entries are stored as <key>.crfsuite (or <key>.crfsuite.gz if the
+   cache is compressed) in the cache directory.
+
+SYNOPSIS (key of a data file):
+python feature_cache.py <config_file> <data_file>
+"""
+import os
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+from crfsuite_feature import FeatureExtractor, load_config
+from embedding_store import store_files
+
+# Version of the cache, to be increased when the format of entries changes.
+CACHE_VERSION = 1
+
+# Settings of the configuration file that do not change the features.
+NON_FEATURE_KEYS = ["crfpath", "crf_options", "observation_cache_size"]
+
+# Modules of the feature extractor.
+EXTRACTOR_MODULES = [
+    "crfsuite_feature.py", "crfutils.py", "observation_cache.py", "gazetteer.py",
+    "brown.py", "embedding_features.py", "embedding_store.py", "feature_hashing.py",
+    "feature_pruning.py",
+]
+
+
+def file_checksum(filepath):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def code_version():
+    """Hash of the source code of the feature extractor"""
+    h = hashlib.sha1()
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in EXTRACTOR_MODULES:
+        path = os.path.join(code_dir, name)
+        if os.path.isfile(path):
+            h.update(name.encode("utf-8"))
+            h.update(file_checksum(path).encode("utf-8"))
+    return h.hexdigest()
+
+
+def resource_files(cfg):
+    """Paths of the resource files used by the feature extractor"""
+    paths = []
+    embeddings = cfg.get("word_embeddings") or {}
+    if cfg.get("use_word_embedding") and embeddings.get("default") is not None:
+        embedding = embeddings[embeddings["default"]]
+        paths.append(embedding.get("path"))
+        if embedding.get("store") is not None:
+            paths += list(store_files(embedding["store"]))
+    if cfg.get("use_brown_clusters") and cfg.get("brown_cluster") is not None:
+        paths.append(cfg["brown_cluster"].get("path"))
+    paths.append(cfg.get("path_to_gazetteer_file"))
+    return [p for p in paths if p is not None]
+
+
+def resource_signature(path):
+    """Path, size and modification time of a resource file
+    Resources (e.g., word embeddings) can be large, so they are not hashed.
+    """
+    if not os.path.exists(path):
+        return [path, None, None]
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def cache_key(cfg, data_file):
+    """Returns the cache key of the features of a data file"""
+    settings = dict((k, v) for k, v in cfg.items() if k not in NON_FEATURE_KEYS)
+    key = {
+        "version": CACHE_VERSION,
+        "data": file_checksum(data_file),
+        "config": settings,
+        "resources": [resource_signature(p) for p in resource_files(cfg)],
+        "code": code_version(),
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class FeatureCache(object):
+    """
+    Directory of feature files addressed by cache_key.
+    Example usage:
+        cache = FeatureCache("./feature_cache")
+        cache.extract("config.yml", "train.txt", "exp/train.crfsuite")
+    """
+    def __init__(self, cache_dir, compress=False):
+        """Initialize the cache.
+        Args:
+            cache_dir: Directory of the entries, created if it does not exist.
+            compress: Store new entries compressed with gzip.
+        """
+        self.cache_dir = cache_dir
+        self.compress = compress
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, key):
+        """Returns the path of an existing entry, or None"""
+        for ext in [".crfsuite", ".crfsuite.gz"]:
+            path = os.path.join(self.cache_dir, key + ext)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def get(self, key, output_file):
+        """Copy the entry of a key to output_file, returns False if there is no entry"""
+        path = self.entry_path(key)
+        if path is None:
+            return False
+        if path.endswith(".gz"):
+            with gzip.open(path, "rb") as fi, open(output_file, "wb") as fo:
+                shutil.copyfileobj(fi, fo, 1 << 20)
+        else:
+            shutil.copyfile(path, output_file)
+        return True
+
+    def put(self, key, feature_file):
+        """Store a feature file as the entry of a key"""
+        path = os.path.join(self.cache_dir, key + (".crfsuite.gz" if self.compress else ".crfsuite"))
+        # Write to a temporary file first, so that a concurrent run never reads a partial entry
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        if self.compress:
+            with open(feature_file, "rb") as fi, gzip.open(tmp_path, "wb", compresslevel=6) as fo:
+                shutil.copyfileobj(fi, fo, 1 << 20)
+        else:
+            shutil.copyfile(feature_file, tmp_path)
+        os.replace(tmp_path, path)
+
+    def extract(self, config_file, input_file, output_file, workers=1, extractor=None):
+        """Extract the features of input_file into output_file, or copy them from the cache
+        Args:
+            config_file: Path to the configuration file of the feature extractor.
+            input_file: Path to the data file.
+            output_file: Path to the feature file.
+            workers: Number of processes for feature extraction.
+            extractor: FeatureExtractor of config_file, it is created only
+                       if the features are not in the cache and extractor is None.
+        Returns:
+            The feature extractor, None if it was not needed.
+        """
+        key = cache_key(load_config(config_file), input_file)
+        if self.get(key, output_file):
+            print("Features of %s found in cache: %s" % (input_file, self.entry_path(key)))
+            return extractor
+        if extractor is None:
+            extractor = FeatureExtractor(config_file)
+        extractor.extract(input_file, output_file, workers=workers)
+        try:
+            self.put(key, output_file)
+        except IOError as e:
+            print("[Warning] Cannot store features in cache: %s" % e)
+        return extractor
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python feature_cache.py <config_file> <data_file>")
+        sys.exit(1)
+    print(cache_key(load_config(sys.argv[1]), sys.argv[2]))
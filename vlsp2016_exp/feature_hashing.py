@@ -0,0 +1,76 @@
+"""Class encapsulating signed feature hashing of CRF attributes.
+   The feature strings generated by the templates (words, affixes, shapes,
+   conjunctions, disjunctive and regex features, ...) are replaced by short
+   attribute names h<index> (index in hexadecimal), where index is a hash of
+   the string with a given number of bits. The model then has at most
+   2^bits attributes, whatever the number of distinct feature strings.
+
+   With signed hashing, another bit of the hash gives the sign of the value
+   (+1 or -1) of the attribute, so that the features which collide on an
+   index tend to cancel out instead of adding up.
+
+   The embedding features (em1..emD) have real values and only a few distinct
+   names, they are not hashed.
+"""
+import zlib
+
+
+class FeatureHasher(object):
+    """
+    Hashing of the features of a sequence.
+    Example usage:
+        hasher = FeatureHasher(bits=20)
+        extractor.feature_extractor(X)
+        hasher.apply(X)
+    """
+    def __init__(self, bits=20, signed=True, cache_size=1000000):
+        """Initialize the hasher.
+        Args:
+            bits: Number of bits of the attribute indices (1 to 30).
+            signed: Use the sign bit of the hash as the value of the attribute.
+            cache_size: Maximum number of hashed feature strings kept in memory.
+        """
+        if not 1 <= bits <= 30:
+            raise ValueError("Invalid number of hashing bits: %d" % bits)
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.signed = signed
+        self.cache_size = cache_size
+        self.cache = dict()
+
+    def hash_feature(self, f):
+        """Returns the hashed attribute of a feature string, a name or a (name, -1) pair"""
+        a = self.cache.get(f)
+        if a is None:
+            h = zlib.crc32(f.encode('utf-8'))
+            a = 'h%x' % (h & self.mask)
+            # The bit 31 is not used by the index (bits <= 30)
+            if self.signed and h >> 31:
+                a = (a, -1.0)
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[f] = a
+        return a
+
+    def apply(self, X):
+        """Replace the features of an item sequence by their hashed attributes"""
+        hash_feature = self.hash_feature
+        for x in X:
+            F = x['F']
+            F[:] = [f if f.startswith('em') else hash_feature(f) for f in F]
+
+
+def get_hasher(feature_hashing):
+    """Create a hasher from the 'feature_hashing' setting of the config file
+    Parameters
+    -----------
+    feature_hashing: Dict
+       e.g., {'bits': 20} or {'bits': 18, 'signed': False}
+
+    Return
+    -----------
+    hasher: FeatureHasher, or None if feature hashing is not used
+    """
+    if not feature_hashing:
+        return None
+    return FeatureHasher(feature_hashing.get('bits', 20), signed=feature_hashing.get('signed', True))
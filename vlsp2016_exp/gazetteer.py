@@ -1,43 +1,170 @@
 """Class encapsulating a Gazetteer.
-   A Gazetteer contains a set of words that of some types
+   A Gazetteer contains a set of words that of some types.
+   Entries are stored in a trie over their (space-separated) syllables,
+   so that the longest entry starting at a position of a sentence is
+   found with a single walk over the following tokens.
+
+   Parsing the CSV file is slow, so the trie is compiled into an index
+   file (<csv file>.idx) together with the checksum of the CSV file.
+   The index is used instead of the CSV file as long as the checksum
+   matches.
+
+SYNOPSIS (build the index):
+python gazetteer.py <gazetteer_csv_file> [<index_file>]
 """
-import pandas as pd
+import os
+import sys
+import pickle
+import hashlib
+
+# Key of the entry type in a trie node (syllables are strings).
+TYPE = None
+
+# Version of the index file format.
+INDEX_VERSION = 1
+
+
+def file_checksum(filepath):
+    h = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def index_path(gazetteer_filepath):
+    return gazetteer_filepath + ".idx"
 
 
 class Gazetteer(object):
 
-    def __init__(self, gazetteer_filepath):
-        self.gazetteer = dict()
+    def __init__(self, gazetteer_filepath, index_filepath=None):
+        if index_filepath is None:
+            index_filepath = index_path(gazetteer_filepath)
+        checksum = file_checksum(gazetteer_filepath)
+        if not self.load_index(index_filepath, checksum):
+            self.read_csv(gazetteer_filepath)
+            self.checksum = checksum
+            try:
+                self.save_index(index_filepath)
+            except IOError as e:
+                print(e)
+
+    def clear(self):
+        self.trie = dict()
+        self.types = []
+        self.type_ids = dict()
+        self.size = 0
+        self.max_length_ = 0
+
+    def read_csv(self, gazetteer_filepath):
+        """Build the trie from a CSV file with columns type and value"""
+        import pandas as pd
+        self.clear()
         df = pd.read_csv(gazetteer_filepath)
         for type_, value_ in zip(df["type"], df["value"]):
-            self.gazetteer[str(value_)] = str(type_)
+            self.add(str(value_), str(type_))
 
-        self.max_length_ = None
+    def load_index(self, index_filepath, checksum):
+        """Load the index file if it was built from the same CSV file
+        Returns True if the index was loaded
+        """
+        if not os.path.isfile(index_filepath):
+            return False
+        try:
+            with open(index_filepath, "rb") as f:
+                index = pickle.load(f)
+        except (IOError, pickle.UnpicklingError, EOFError) as e:
+            print("[Warning] Cannot read gazetteer index %s: %s" % (index_filepath, e))
+            return False
+        if index.get("version") != INDEX_VERSION or index.get("checksum") != checksum:
+            print("Gazetteer index %s is out of date" % index_filepath)
+            return False
+        self.trie = index["trie"]
+        self.types = index["types"]
+        self.type_ids = dict((t, i) for i, t in enumerate(self.types))
+        self.size = index["size"]
+        self.max_length_ = index["max_length"]
+        self.checksum = checksum
+        return True
 
-    def max_length(self):
-        if self.max_length_ == None:
-            self.max_length_ = max([ len(val.split()) for val in self.gazetteer.keys() ])
+    def save_index(self, index_filepath):
+        index = {
+            "version": INDEX_VERSION,
+            "checksum": self.checksum,
+            "trie": self.trie,
+            "types": self.types,
+            "size": self.size,
+            "max_length": self.max_length_,
+        }
+        with open(index_filepath, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        print("Saved gazetteer index: %s" % index_filepath)
+
+    def add(self, value, type_):
+        if type_ not in self.type_ids:
+            self.type_ids[type_] = len(self.types)
+            self.types.append(type_)
+        node = self.trie
+        for syllable in value.split(" "):
+            node = node.setdefault(syllable, dict())
+        if TYPE not in node:
+            self.size += 1
+        node[TYPE] = self.type_ids[type_]
+        self.max_length_ = max(self.max_length_, len(value.split()))
 
+    def max_length(self):
         return self.max_length_
 
-    def is_in_gazetteer(self, value):
-        b = False
-        if self.gazetteer.__contains__(value):
-            b = True
+    def find(self, value):
+        """Returns the trie node of an entry, or None"""
+        node = self.trie
+        for syllable in value.split(" "):
+            node = node.get(syllable)
+            if node is None:
+                return None
+        return node
 
-        return b
+    def is_in_gazetteer(self, value):
+        node = self.find(value)
+        return node is not None and TYPE in node
 
     def gazetteer_type(self, value):
         type_ = "NA"
         if self.is_in_gazetteer(value):
-            type_ = self.gazetteer[value]
+            type_ = self.types[self.find(value)[TYPE]]
 
         return type_
 
+    def longest_match(self, tokens, start, end):
+        """Find the longest entry made of consecutive tokens
+        Args:
+            tokens: List of tokens, each token is a list of lowercased syllables.
+            start: Position of the first token of the entry.
+            end: The entry must end before this position.
+        Returns:
+            (position after the last token, type) of the longest entry,
+            or None if no entry starts at the position.
+        """
+        match = None
+        node = self.trie
+        for p in range(start, end):
+            for syllable in tokens[p]:
+                node = node.get(syllable)
+                if node is None:
+                    return match
+            if TYPE in node:
+                match = (p + 1, self.types[node[TYPE]])
+        return match
 
 if __name__ == "__main__":
-    gazetteer = Gazetteer("./data/Gazetteer/Vietnamese_Gazetteer_Address+Name.csv")
+    if len(sys.argv) < 2:
+        print("Usage: python gazetteer.py <gazetteer_csv_file> [<index_file>]")
+        sys.exit(1)
+    gazetteer_filepath = sys.argv[1]
+    index_filepath = sys.argv[2] if len(sys.argv) > 2 else index_path(gazetteer_filepath)
+    gazetteer = Gazetteer(gazetteer_filepath, index_filepath)
+    print("Entries: %d" % gazetteer.size)
     print("Max length: %d" % gazetteer.max_length())
     print(gazetteer.is_in_gazetteer("hồ chí minh"))
     print(gazetteer.is_in_gazetteer("hồ chí"))
-
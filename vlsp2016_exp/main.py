@@ -5,7 +5,11 @@ import pathlib
 import time
 from datetime import datetime
 from argparse import ArgumentParser
-from crfsuite_feature import FeatureExtractor
+from crfsuite_feature import FeatureExtractor, load_config
+from feature_cache import FeatureCache
+from crfsuite_model import CRFSuiteModel
+from tagger_pool import TaggerPool
+from crf_trainer import CRFTrainer, tag_data
 
 
 def copy_content(input_file, output_file):
@@ -25,6 +29,13 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("-no_extract", action="store_true", help="Do not do feature extraction")
     parser.add_argument("-tab", action="store_true", help="Use tab as delimiter character in data files")
+    parser.add_argument("-workers", type=int, default=1, help="Number of processes for feature extraction and tagging")
+    parser.add_argument("-feature_cache", default=None, help="Directory of cached feature files, reused by runs with the same data and feature settings")
+    parser.add_argument("-compress_cache", action="store_true", help="Store cached feature files compressed with gzip")
+    parser.add_argument("-trainer", default="crfsuite", choices=["crfsuite", "native"],
+                        help="Train with `crfsuite learn` (crfpath) or with crf_trainer.py on the features in memory (no feature files)")
+    parser.add_argument("-model_whitelist", action="store_true",
+                        help="Extract the features of the test data that are known to the trained model only")
     parser.add_argument("config_file", help = "Path to config file")
     parser.add_argument("exp_dir", help = "Path to experiment dir")
     parser.add_argument("training_file", help = "Path to training data")
@@ -40,6 +51,7 @@ if __name__ == "__main__":
     training_tag = os.path.join(args.exp_dir, "train.tag")
     training_out = os.path.join(args.exp_dir, "train.out")
     model_file = os.path.join(args.exp_dir, "model.bin")
+    whitelist_file = os.path.join(args.exp_dir, "whitelist.txt")
 
     test_crfsuite_file = os.path.join(args.exp_dir, "test.crfsuite")
     test_tag = os.path.join(args.exp_dir, "test.tag")
@@ -52,23 +64,62 @@ if __name__ == "__main__":
     os.system('echo "Test data file: %s" >> %s' % (args.test_file, log_file))
     os.system('echo "-----------------" >> %s' % log_file)
 
-    extractor = FeatureExtractor(args.config_file)
-    if not args.no_extract:
+    cfg = load_config(args.config_file)
+    cache = None
+    if args.feature_cache is not None:
+        cache = FeatureCache(args.feature_cache, compress=args.compress_cache)
+    # Pruned extraction counts the features of the training data first, the
+    # whitelist of the features that are kept is saved with the model
+    pruning = cfg.get("feature_pruning") is not None
+    if pruning and cache is not None:
+        print("[Warning] The feature cache is not used with feature pruning")
+        cache = None
+    # The extractor is not created if all features are found in the cache
+    extractor = None
+    native = args.trainer == "native"
+    if native:
+        trainer = CRFTrainer.from_crf_options(cfg["crf_options"], workers=args.workers)
+    if native and not args.no_extract:
         print("Step 1: Extract features for training data")
         start = time.time()
-        extractor.extract(args.training_file, training_crfsuite_file)
+        extractor = FeatureExtractor(args.config_file)
+        if pruning:
+            extractor.prune(args.training_file, whitelist_file, workers=args.workers)
+        trainer.append_data(extractor, args.training_file)
+        end = time.time()
+        minutes = (end - start) // 60
+        secs = (end - start) % 60
+        print("Finished in {:.2f} min {:.2f} sec.".format(minutes, secs), flush=True)
+        print()
+    elif native:
+        trainer.append_file(training_crfsuite_file)
+    elif not args.no_extract:
+        print("Step 1: Extract features for training data")
+        start = time.time()
+        if cache is not None:
+            extractor = cache.extract(args.config_file, args.training_file, training_crfsuite_file, workers=args.workers)
+        else:
+            extractor = FeatureExtractor(args.config_file)
+            if pruning:
+                extractor.prune(args.training_file, whitelist_file, workers=args.workers)
+            extractor.extract(args.training_file, training_crfsuite_file, workers=args.workers)
         end = time.time()
         minutes = (end - start) // 60
         secs = (end - start) % 60
         print("Finished in {:.2f} min {:.2f} sec.".format(minutes, secs), flush=True)
         print()
 
-    crfpath = extractor.crfpath()
+    crfpath = cfg["crfpath"]
     print("Step 2: Training CRF model")
     start = time.time()
-    comd = "%s learn %s -m %s %s" % ( crfpath, extractor.crf_options(), model_file, training_crfsuite_file)
-    print(comd)
-    os.system(comd)
+    if native:
+        trainer.train(model_file)
+        # Free the training data before tagging
+        trainer = None
+    else:
+        comd = "%s learn %s -m %s %s" % ( crfpath, cfg["crf_options"], model_file, training_crfsuite_file)
+        print(comd)
+        os.system(comd)
     end = time.time()
     minutes = (end - start) // 60
     secs = (end - start) % 60
@@ -76,9 +127,12 @@ if __name__ == "__main__":
     print()
 
     print("Step 3: Tag training data")
-    comd = "%s tag -m %s %s > %s" % (crfpath, model_file, training_crfsuite_file, training_tag)
-    print(comd)
-    os.system(comd)
+    # The tagger processes are kept for step 5
+    model = TaggerPool(model_file, args.workers) if args.workers > 1 else CRFSuiteModel(model_file)
+    if extractor is not None and native:
+        tag_data(extractor, model, args.training_file, training_tag)
+    else:
+        model.tag_file(training_crfsuite_file, training_tag)
     if args.tab:
         comd = "paste %s %s > %s" % (args.training_file, training_tag, training_out)
     else:
@@ -87,10 +141,22 @@ if __name__ == "__main__":
     os.system(comd)
     print()
 
-    if not args.no_extract:
+    # The test features unknown to the model are not generated (no cache)
+    if args.model_whitelist and not args.no_extract:
+        if extractor is None:
+            extractor = FeatureExtractor(args.config_file)
+        extractor.restrict_to_models([model_file])
+        cache = None
+
+    # The native trainer tags the test data with the features in memory
+    if not args.no_extract and not native:
         print("Step 4: Extract features for test data")
         start = time.time()
-        extractor.extract(args.test_file, test_crfsuite_file)
+        if cache is not None:
+            extractor = cache.extract(args.config_file, args.test_file, test_crfsuite_file,
+                                      workers=args.workers, extractor=extractor)
+        else:
+            extractor.extract(args.test_file, test_crfsuite_file, workers=args.workers)
         end = time.time()
         minutes = (end - start) // 60
         secs = (end - start) % 60
@@ -98,9 +164,12 @@ if __name__ == "__main__":
         print()
 
     print("Step 5: Tag test data")
-    comd = "%s tag -m %s %s > %s" % (crfpath, model_file, test_crfsuite_file, test_tag)
-    print(comd)
-    os.system(comd)
+    if extractor is not None and native:
+        tag_data(extractor, model, args.test_file, test_tag)
+    else:
+        model.tag_file(test_crfsuite_file, test_tag)
+    if args.workers > 1:
+        model.close()
     if args.tab:
         comd = "paste %s %s > %s" % (args.test_file, test_tag, test_out)
     else:
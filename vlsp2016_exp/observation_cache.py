@@ -0,0 +1,64 @@
+"""Class encapsulating a bounded LRU cache for token observations.
+   Most observation fields only depend on the surface string of a token,
+   so they can be computed once per word type and reused.
+"""
+from collections import OrderedDict
+
+
+class ObservationCache(object):
+    """
+    Least-recently-used cache that maps a word type to its static observations.
+    Example usage:
+        cache = ObservationCache(max_size=100000)
+        obs = cache.get("Hà_Nội")
+        if obs is None:
+            obs = compute(...)
+            cache.put("Hà_Nội", obs)
+    """
+    def __init__(self, max_size=100000):
+        """Initialize the cache.
+        Args:
+            max_size: Maximum number of word types kept in the cache.
+                      A value <= 0 disables caching.
+        """
+        self.max_size = max_size
+        self.clear()
+
+    def clear(self):
+        """Reset the cache, deletes all entries and statistics."""
+        self.entries   = OrderedDict()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def enabled(self):
+        return self.max_size > 0
+
+    def get(self, key):
+        """Returns the cached observations of a word type, or None."""
+        obs = self.entries.get(key)
+        if obs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return obs
+
+    def put(self, key, obs):
+        """Stores observations of a word type, evicting the least recently used entry if full."""
+        if not self.enabled():
+            return
+        self.entries[key] = obs
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return "Observation cache: size=%d/%d, hits=%d, misses=%d, evictions=%d, hit rate=%.2f%%" % (
+            len(self.entries), self.max_size, self.hits, self.misses, self.evictions,
+            100.0 * self.hit_rate())
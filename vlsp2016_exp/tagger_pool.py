@@ -0,0 +1,244 @@
+"""Pool of persistent CRF tagger processes.
+   Each worker is a subprocess (python tagger_pool.py <model_file>) that
+   loads the model once with CRFSuiteModel and then tags the batches it
+   reads from its standard input. Batches are sent to whichever worker is
+   idle, so tagging scales with the number of cores, and a worker that
+   dies is restarted and its batch is sent again.
+
+   Line protocol (both directions): a message is a line with the number of
+   lines n, followed by the n lines.
+   - Request: sequences in CRFsuite format (an item per line, a sequence
+     ends with an empty line), as written by crfutils.output_features.
+   - Response: labels of the non-empty sequences of the request, a label
+     per line, a sequence ends with an empty line (as `crfsuite tag`).
+
+SYNOPSIS (worker):
+python tagger_pool.py <model_file>
+"""
+import io
+import os
+import sys
+import queue
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import crfutils
+from crfsuite_model import CRFSuiteModel, read_sequences
+
+
+def write_message(fo, lines):
+    fo.write('%d\n' % len(lines))
+    fo.writelines(lines)
+    fo.flush()
+
+
+def read_message(fi):
+    header = fi.readline()
+    if not header:
+        raise EOFError('Tagger process closed the pipe')
+    n = int(header)
+    lines = [fi.readline() for i in range(n)]
+    if n > 0 and not lines[-1]:
+        raise EOFError('Tagger process closed the pipe')
+    return lines
+
+
+def sequence_lines(X, field=''):
+    """Returns the lines of a sequence in CRFsuite format"""
+    fo = io.StringIO()
+    crfutils.output_features(fo, X, field)
+    return fo.getvalue().splitlines(True)
+
+
+def read_tags(lines):
+    """Split the response lines into label sequences"""
+    tags = []
+    y = []
+    for line in lines:
+        line = line.rstrip('\n')
+        if not line:
+            tags.append(y)
+            y = []
+        else:
+            y.append(line)
+    return tags
+
+
+class TaggerWorker(object):
+    """A tagger subprocess and its pipes"""
+
+    def __init__(self, model_file):
+        self.model_file = model_file
+        self.restarts = 0
+        self.start()
+
+    def start(self):
+        self.proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), self.model_file],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.stdin = io.TextIOWrapper(self.proc.stdin, encoding='utf-8', newline='\n')
+        self.stdout = io.TextIOWrapper(self.proc.stdout, encoding='utf-8', newline='\n')
+
+    def tag(self, lines):
+        write_message(self.stdin, lines)
+        return read_message(self.stdout)
+
+    def close(self):
+        try:
+            self.stdin.close()
+        except OSError:
+            pass
+        self.proc.wait()
+
+    def restart(self):
+        self.proc.kill()
+        self.close()
+        self.restarts += 1
+        self.start()
+
+
+class TaggerPool(object):
+    """
+    Tags sequences with a pool of tagger processes for a model.
+    Example usage:
+        with TaggerPool("model.bin", workers=4) as pool:
+            pool.tag_file("test.crfsuite", "test.tag")
+    """
+    def __init__(self, model_file, workers=2, batch_size=64, max_retries=2):
+        """Start the tagger processes.
+        Args:
+            model_file: Path to the model file written by `crfsuite learn`.
+            workers: Number of tagger processes.
+            batch_size: Number of sequences sent to a worker at once.
+            max_retries: Number of times a batch is sent again after a worker died.
+        """
+        self.model_file = model_file
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.workers = [TaggerWorker(model_file) for i in range(workers)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+        for worker in self.workers:
+            worker.close()
+
+    def tag_batch(self, lines):
+        """Tag a batch of lines with an idle worker, returns the response lines"""
+        worker = self.idle.get()
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return worker.tag(lines)
+                except (EOFError, OSError, ValueError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    print("[Warning] Tagger process of %s failed (%s), restarting" % (self.model_file, e),
+                          file=sys.stderr)
+                    worker.restart()
+        finally:
+            self.idle.put(worker)
+
+    def submit(self, batches):
+        """Submit batches of lines, returns a list of futures of the response lines"""
+        return [self.executor.submit(self.tag_batch, lines) for lines in batches]
+
+    def imap(self, batches):
+        """Tag batches of lines, yields the response lines of each batch in order
+        At most two batches per worker are in flight, so that batches can be
+        read lazily from a large file.
+        """
+        pending = deque()
+        for lines in batches:
+            pending.append(self.executor.submit(self.tag_batch, lines))
+            if len(pending) >= 2 * len(self.workers):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def tag_file(self, input_file, output_file):
+        """Tag a feature file in CRFsuite format, the same output as `crfsuite tag`"""
+        with open(input_file) as fi, open(output_file, 'w') as fo:
+            for lines in self.imap(crfutils.readchunks(fi, self.batch_size)):
+                fo.writelines(lines)
+
+    def tag_sequences(self, Xs):
+        """Tag a list of sequences whose features were generated by FeatureExtractor.feature_extractor"""
+        return tag_sequences_multi([self], Xs)[0]
+
+
+def tag_sequences_multi(pools, Xs):
+    """Tag a list of sequences with the pools of several models
+    The sequences are converted to CRFsuite format once, and the pools
+    tag them at the same time.
+    Parameters
+    -----------
+    pools: List
+       List of TaggerPool
+    Xs: List
+       Sequences whose features were generated by FeatureExtractor.feature_extractor
+
+    Return
+    -----------
+    tags: List
+       For each model, the list of label sequences (empty sequences get no label)
+    """
+    nonempty = [X for X in Xs if X]
+    batch_size = min(pool.batch_size for pool in pools)
+    batches = []
+    for i in range(0, len(nonempty), batch_size):
+        lines = []
+        for X in nonempty[i:i + batch_size]:
+            lines += sequence_lines(X)
+        batches.append(lines)
+    futures = [pool.submit(batches) for pool in pools]
+
+    tags = []
+    for fs in futures:
+        lines = []
+        for f in fs:
+            lines += f.result()
+        ys = iter(read_tags(lines))
+        tags.append([next(ys) if X else [] for X in Xs])
+    return tags
+
+
+def tag_file(model_file, input_file, output_file, workers=1):
+    """Tag a feature file in-process (workers=1) or with a pool of tagger processes"""
+    if workers > 1:
+        with TaggerPool(model_file, workers) as pool:
+            pool.tag_file(input_file, output_file)
+    else:
+        CRFSuiteModel(model_file).tag_file(input_file, output_file)
+
+
+def serve(model_file):
+    """Run a tagger process: tag the requests read from stdin"""
+    fi = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='\n')
+    fo = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='\n')
+    # stdout is reserved for the protocol
+    sys.stdout = sys.stderr
+    model = CRFSuiteModel(model_file)
+    while True:
+        try:
+            lines = read_message(fi)
+        except EOFError:
+            break
+        out = io.StringIO()
+        model.write_tags(out, model.tag_attributes(list(read_sequences(lines))))
+        write_message(fo, out.getvalue().splitlines(True))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python tagger_pool.py <model_file>")
+        sys.exit(1)
+    serve(sys.argv[1])
@@ -0,0 +1,71 @@
+"""Compression of a trained CRF model by pruning its weights.
+   Most weights of a model trained with L2 regularization are close to
+   zero and barely change the tags, but they make the model file large and
+   slow to load, and each of them is accumulated at tagging time. The
+   compressed model keeps:
+   - the features whose weight has an absolute value >= threshold, and/or
+   - the top_k state features of each label (by absolute weight).
+   Attributes left without state features are removed from the model.
+
+SYNOPSIS:
+python compress_model.py [-threshold <t>] [-top_k <k>] <model_file> <output_file>
+"""
+import os
+from argparse import ArgumentParser
+import numpy as np
+from crfsuite_model import CRFSuiteModel, FT_STATE, write_model
+
+
+def prune_features(features, threshold=None, top_k=None):
+    """Select the features kept by the compression
+    Parameters
+    -----------
+    features: numpy array of FEATURE_DTYPE
+       Features of the model (CRFSuiteModel.features)
+    threshold: float
+       Minimum absolute weight of the kept features (transition and state features)
+    top_k: int
+       Maximum number of state features of each label
+
+    Return
+    -----------
+    features: numpy array of FEATURE_DTYPE
+       Kept features, in the same order
+    """
+    keep = np.ones(len(features), dtype=bool)
+    magnitude = np.abs(features['weight'])
+    if threshold is not None:
+        keep &= magnitude >= threshold
+    if top_k is not None:
+        is_state = features['type'] == FT_STATE
+        for label in np.unique(features['dst'][is_state]):
+            ids = np.nonzero(is_state & keep & (features['dst'] == label))[0]
+            if len(ids) > top_k:
+                # Stable sort, ties are broken by feature order.
+                order = np.argsort(-magnitude[ids], kind='stable')
+                keep[ids[order[top_k:]]] = False
+    return features[keep]
+
+
+def compress_model(model_file, output_file, threshold=None, top_k=None):
+    """Write the compressed model, returns the numbers of features before and after compression"""
+    model = CRFSuiteModel(model_file)
+    features = model.features()
+    kept = prune_features(features, threshold, top_k)
+    write_model(output_file, model.labels, model.attributes(), kept)
+    return len(features), len(kept)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-threshold", type=float, default=None, help="Minimum absolute weight of the kept features")
+    parser.add_argument("-top_k", type=int, default=None, help="Maximum number of state features of each label")
+    parser.add_argument("model_file", help="Path to the model file")
+    parser.add_argument("output_file", help="Path to the compressed model file")
+    args = parser.parse_args()
+
+    if args.threshold is None and args.top_k is None:
+        parser.error("-threshold and/or -top_k is required")
+    before, after = compress_model(args.model_file, args.output_file, args.threshold, args.top_k)
+    print("Features: %d -> %d, model size: %.1fKB -> %.1fKB" % (
+        before, after, os.path.getsize(args.model_file) / 1024.0, os.path.getsize(args.output_file) / 1024.0))
@@ -4,14 +4,21 @@
 import os
 import sys
 import re
-import pandas as pd
+import io
+import multiprocessing
 import numpy as np
 from argparse import ArgumentParser
 from collections import OrderedDict
+from functools import lru_cache
 import regex
 from brown import BrownClusters
 from w2v import W2VClusters
 from gazetteer import Gazetteer
+from observation_cache import ObservationCache
+from embedding_store import EmbeddingStore
+from embedding_features import EmbeddingFeatureTable, get_quantizer
+from feature_hashing import get_hasher
+from feature_pruning import FeatureCounter, FeatureFilter, count_features
 import crfutils
 import yaml
 
@@ -65,18 +72,15 @@ def load_embedding_vectors_word2vec(filename, binary=True, scale=1.0):
         embedding_dim = vector_size
         if binary:
             binary_len = np.dtype('float32').itemsize * vector_size
+            data = f.read()
+            pos = 0
             for line_no in range(vocab_size):
-                word = []
-                while True:
-                    ch = f.read(1)
-                    if ch == b' ':
-                        break
-                    if ch == b'':
-                        raise EOFError("unexpected end of input; is count incorrect or file otherwise damaged?")
-                    if ch != b'\n':
-                        word.append(ch)
-                word = str(b''.join(word), encoding=encoding, errors='strict')
-                embedding_index[word] = np.fromstring(f.read(binary_len), dtype='float32')
+                end = data.find(b' ', pos)
+                if end < 0 or end + 1 + binary_len > len(data):
+                    raise EOFError("unexpected end of input; is count incorrect or file otherwise damaged?")
+                word = str(data[pos:end].replace(b'\n', b''), encoding=encoding, errors='strict')
+                embedding_index[word] = np.frombuffer(data, dtype='float32', count=vector_size, offset=end + 1) * scale
+                pos = end + 1 + binary_len
         else:
             for line_no in range(vocab_size):
                 line = f.readline()
@@ -88,7 +92,7 @@ def load_embedding_vectors_word2vec(filename, binary=True, scale=1.0):
                 word   = '_'.join(parts[0:len(parts)-embedding_dim])
                 vector = []
                 for d in parts[-embedding_dim:]:
-                    vector.append(np.float32(d))
+                    vector.append(np.float32(d) * scale)
                 embedding_index[word] = vector
         f.close()
         print('Vector Dimensions = %d' % embedding_dim)
@@ -354,129 +358,133 @@ def _getType(token, word_list):
     else:
         return False
 
-def isfProvince(token):
-    province_words = [
+# Lexicons of the f* observations used by the regexps patterns.
+# Tokens are lowercased before the lookup, so capitalized entries
+# (e.g., "ĐH", "Đảng") never match.
+LEXICONS = OrderedDict([
+    ("fProvince", frozenset([
         "tỉnh", "thành_phố", "tp.", "tp",
         "huyện", "quận", "xã", "phường",
         "thị_trấn", "thôn", "bản", "làng",
         "xóm", "ấp",
-    ]
-    return _getType(token, province_words)
-
-def isfPress(token):
-    press_words = [
+    ])),
+    ("fPress", frozenset([
         "báo", "tờ", "tạp_chí", "đài", "thông_tấn_xã",
-    ]
-    return _getType(token, press_words)
-
-def isfCommunist(token):
-    communist_words = [
+    ])),
+    ("fCommunist", frozenset([
         "thành_ủy", "tỉnh_ủy", "quận_ủy",
         "thành_uỷ", "tỉnh_uỷ", "quận_uỷ",
         "huyện_ủy", "xã_ủy", "đảng_ủy",
         "huyện_uỷ", "xã_uỷ", "đảng_uỷ",
-    ]
-    if token.lower() == "tỉnh_ủy":
-        return True
-    return _getType(token, communist_words)
+    ])),
+    ("fPolice", frozenset([
+        "công_an", "cảnh_sát",
+    ])),
+    ("fSchool", frozenset([
+        "ĐH", "CĐ", "THPT", "THCS", "tiểu_học",
+    ])),
+    ("fInstitution", frozenset([
+        "trường", "học_viện", "viện", "institute", "university",
+    ])),
+    ("fCompany", frozenset([
+        "công_ty", "công_ty_cổ_phần",
+        "tập_đoàn", "hãng", "xí_nghiệp",
+    ])),
+    ("fUnion", frozenset([
+        "liên_hiệp", "hội", "hợp_tác_xã",
+        "câu_lạc_bộ", "trung_tâm", "liên_đoàn", "tổng_liên_đoàn",
+    ])),
+    ("fMilitary", frozenset([
+        "sư_đoàn", "lữ_đoàn", "trung_đoàn", "tiểu_đoàn",
+        "quân_khu", "liên_khu",
+    ])),
+    ("fMinistryPrefix", frozenset([
+        "bộ", "ủy_ban",
+    ])),
+    ("fMinistry", frozenset([
+        "chính_trị", "ngoại_giao", "quốc_phòng", "công_an",
+        "tư_pháp", "tài_chính", "công_thương", "xây_dựng",
+        "nội_vụ", "y_tế", "lao_động",
+        "giao_thông", "thông_tin", "tt", "giáo_dục", "gd",
+        "nông_nghiệp", "nn", "kế_hoạch", "kh",
+        "khoa_học", "văn_hóa", "tài_nguyên", "tn",
+        "dân_tộc",
+    ])),
+    ("fDepartmentPrefix", frozenset([
+        "sở", "phòng", "ban", "chi_cục", "tổng_cục",
+    ])),
+    ("fVillage", frozenset([
+        "quận", "q", "q.", "ấp", "quán", "khu",
+        "tổ", "khóm", "xóm", "trạm", "số", "ngách", "ngõ",
+    ])),
+    ("fRegion", frozenset([
+        "bang", "nước", "vùng", "miền",
+    ])),
+    ("fLocPrefix", frozenset([
+        "sông", "núi", "chợ", "châu",
+        "đảo", "đèo", "cầu", "đồi", "đồn",
+        "thủ_đô", "khách_sạn", "sân_bay", "nhà_hàng", "cảng",
+        "đường", "phố", "đại_lộ", "chung_cư", "rạch",
+        "hồ", "kênh",
+    ])),
+    ("fRoad", frozenset([
+        "tỉnh_lộ", "quốc_lộ",
+    ])),
+    ("fParty", frozenset([
+        "Đảng", "đảng",
+    ])),
+])
+
+def isfProvince(token):
+    return _getType(token, LEXICONS["fProvince"])
+
+def isfPress(token):
+    return _getType(token, LEXICONS["fPress"])
+
+def isfCommunist(token):
+    return _getType(token, LEXICONS["fCommunist"])
 
 def isfPolice(token):
-    police_words = [
-        "công_an", "cảnh_sát",
-    ]
-    return _getType(token, police_words)
+    return _getType(token, LEXICONS["fPolice"])
 
 def isfSchool(token):
-    word_list = [
-        "ĐH", "CĐ", "THPT", "THCS", "tiểu_học",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fSchool"])
 
 def isfInstitution(token):
-    word_list = [
-        "trường", "học_viện", "viện", "institute", "university",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fInstitution"])
 
 def isfCompany(token):
-    word_list = [
-        "công_ty", "công_ty_cổ_phần",
-        "tập_đoàn", "hãng", "xí_nghiệp",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fCompany"])
 
 def isfUnion(token):
-    word_list = [
-        "liên_hiệp", "hội", "hợp_tác_xã",
-        "câu_lạc_bộ", "trung_tâm", "liên_đoàn", "tổng_liên_đoàn",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fUnion"])
 
 def isfMilitary(token):
-    word_list = [
-        "sư_đoàn", "lữ_đoàn", "trung_đoàn", "tiểu_đoàn",
-        "quân_khu", "liên_khu",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fMilitary"])
 
 def isfMinistryPrefix(token):
-    word_list = [
-        "bộ", "ủy_ban",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fMinistryPrefix"])
 
 def isfMinistry(token):
-    word_list = [
-        "chính_trị", "ngoại_giao", "quốc_phòng", "công_an",
-        "tư_pháp", "tài_chính", "công_thương", "xây_dựng",
-        "nội_vụ", "y_tế", "ngoại_giao", "lao_động", 
-        "giao_thông", "thông_tin", "tt", "giáo_dục", "gd",
-        "nông_nghiệp", "nn", "kế_hoạch", "kh",   
-        "khoa_học", "kh", "văn_hóa", "tài_nguyên", "tn", 
-        "dân_tộc",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fMinistry"])
 
 def isfDepartmentPrefix(token):
-    word_list = [
-        "sở", "phòng", "ban", "chi_cục", "tổng_cục",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fDepartmentPrefix"])
 
 def isfVillage(token):
-    word_list = [
-        "quận", "q", "q.", "ấp", "quán", "khu",
-        "tổ", "khóm", "xóm", "trạm", "số", "ngách", "ngõ",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fVillage"])
 
 def isfRegion(token):
-    word_list = [
-        "bang", "nước", "vùng", "miền",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fRegion"])
 
 def isfLocPrefix(token):
-    word_list = [
-        "sông", "núi", "chợ", "châu", 
-        "đảo", "đèo", "cầu", "đồi", "đồn", 
-        "thủ_đô", "khách_sạn", "sân_bay", "nhà_hàng", "cảng",
-        "đường", "phố", "đại_lộ", "chung_cư", "rạch",
-        "hồ", "kênh",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fLocPrefix"])
 
 def isfRoad(token):
-    word_list = [
-        "tỉnh_lộ", "quốc_lộ",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fRoad"])
 
 def isfParty(token):
-    word_list = [
-        "Đảng", "đảng",
-    ]
-    return _getType(token, word_list)
+    return _getType(token, LEXICONS["fParty"])
 
 
 def disjunctive(X, t, field, begin, end):
@@ -516,93 +524,127 @@ regexps = OrderedDict({
     "locAddress":    ["fNumber", "fName"],
 })
 
-def gen_regex_observation(X):
-    """Generate observations based on regular expressions
+# Token predicates of the regexps patterns that are not lexicons
+PREDICATES = OrderedDict([
+    ("fNumber",  is_number),
+    ("fCapital", is_capitalized),
+    ("fAllcaps", lambda w: w.isupper()),
+    ("fName",    lambda w: isName(w) or w.isupper()),
+    ("fCode",    isCode),
+])
+
+# Bit of each f* observation in a token mask
+PREDICATE_BITS = OrderedDict((name, 1 << i) for i, name in enumerate(list(PREDICATES) + list(LEXICONS)))
+
+# Mask of the lexicon observations of a (lowercased) word
+LEXICON_MASKS = dict()
+for name, words in LEXICONS.items():
+    for word in words:
+        LEXICON_MASKS[word] = LEXICON_MASKS.get(word, 0) | PREDICATE_BITS[name]
+
+@lru_cache(maxsize=100000)
+def token_mask(token):
+    """Returns the bitmask of the f* observations of a token (see PREDICATE_BITS)
     """
-    for t in range(len(X)):
-        X[t]['fNumber']    = is_number(X[t]['w'])
-        X[t]['fCapital']   = is_capitalized(X[t]['w'])
-        X[t]['fAllcaps']   = X[t]['w'].isupper()
-        X[t]['fName']      = isName(X[t]['w']) or X[t]['w'].isupper()
-        X[t]['fCode']      = isCode(X[t]['w'])
-        X[t]['fProvince']  = isfProvince(X[t]['w'])
-        X[t]['fPress']     = isfPress(X[t]['w'])
-        X[t]['fCommunist'] = isfCommunist(X[t]['w'])
-        X[t]['fPolice']    = isfPolice(X[t]['w'])
-        X[t]['fSchool']    = isfSchool(X[t]['w'])
-        X[t]['fInstitution'] = isfInstitution(X[t]['w'])
-        X[t]['fCompany']   = isfCompany(X[t]['w'])
-        X[t]['fUnion']     = isfUnion(X[t]['w'])
-        X[t]['fMilitary']  = isfMilitary(X[t]['w'])
-        X[t]['fMinistryPrefix'] = isfMinistryPrefix(X[t]['w'])
-        X[t]['fMinistry']  = isfMinistry(X[t]['w'])
-        X[t]['fDepartmentPrefix'] = isfDepartmentPrefix(X[t]['w'])
-        X[t]['fVillage']   = isfVillage(X[t]['w'])
-        X[t]['fVillage']   = isfVillage(X[t]['w'])
-        X[t]['fRegion']    = isfRegion(X[t]['w'])
-        X[t]['fLocPrefix'] = isfLocPrefix(X[t]['w'])
-        X[t]['fRoad']      = isfRoad(X[t]['w'])
-        X[t]['fParty']     = isfParty(X[t]['w'])
-
-    fRegex = 'fRegex'
-
-    sorted_patterns = sorted(regexps.keys(), key=lambda k: len(regexps[k]), reverse=True)
-    marked = [ False for t in range(len(X)) ]
-    for t in range(len(X)):
-        if X[t].get(fRegex) != None:
-            continue
+    mask = LEXICON_MASKS.get(token.lower(), 0)
+    for name, predicate in PREDICATES.items():
+        if predicate(token):
+            mask |= PREDICATE_BITS[name]
+    return mask
 
-        for pattern in sorted_patterns:
-            p = pattern if pattern != 'orgParty3' else 'orgParty2'
-            attr_list = regexps[pattern]
-            if t + len(attr_list) - 1 >= len(X):
-                continue
-            
-            val = True
-            for i in range(len(attr_list)):
-                if X[t+i][attr_list[i]] == False:
-                    val = False
-                    break
-
-            if val == True:
-                for i in range(len(attr_list)):
-                    X[t+i][fRegex] = p
+class PatternMatcher(object):
+    """
+    Trie over the observation sequences of the regexps patterns.
+    Starting from a position, the tokens that satisfy a sequence are followed
+    simultaneously, and the longest matching pattern is returned. Patterns of
+    the same length are ranked by their order in the table.
+    """
+    def __init__(self, patterns, labels=None):
+        """Compile the patterns.
+        Args:
+            patterns: OrderedDict that maps a pattern name to a list of f* observations.
+            labels: Dict that maps a pattern name to its label (default: the name).
+        """
+        labels = labels or dict()
+        # node = [mask of the children, {bit: child}, (rank, label) or None]
+        self.root = [0, dict(), None]
+        for rank, (name, attr_list) in enumerate(patterns.items()):
+            node = self.root
+            for attr in attr_list:
+                bit = PREDICATE_BITS[attr]
+                node[0] |= bit
+                node = node[1].setdefault(bit, [0, dict(), None])
+            if node[2] is None:
+                node[2] = (rank, labels.get(name, name))
+
+    def match(self, masks, start):
+        """Find the pattern matched by the tokens from a position
+        Args:
+            masks: List of token masks of a sentence.
+            start: Position of the first token.
+        Returns:
+            (position after the last token, label) of the matched pattern,
+            or None if no pattern matches.
+        """
+        match = None
+        nodes = [self.root]
+        for p in range(start, len(masks)):
+            mask = masks[p]
+            nodes = [child for node in nodes if node[0] & mask
+                     for bit, child in node[1].items() if bit & mask]
+            if not nodes:
                 break
-        if X[t].get(fRegex) == None:
-            X[t][fRegex] = 'NA'
+            accepted = [node[2] for node in nodes if node[2] is not None]
+            if accepted:
+                match = (p + 1, min(accepted)[1])
+        return match
+
+# orgParty3 is labeled as orgParty2
+pattern_matcher = PatternMatcher(regexps, labels={"orgParty3": "orgParty2"})
+
+def gen_regex_observation(X):
+    """Generate observations based on regular expressions
+    fRegex: label of the pattern matched by the token, patterns are matched
+            from left to right (longest first), 'NA' if there is none
+    """
+    masks = [token_mask(x['w']) for x in X]
+    t = 0
+    while t < len(X):
+        match = pattern_matcher.match(masks, t)
+        if match is None:
+            X[t]['fRegex'] = 'NA'
+            t += 1
+        else:
+            p, label = match
+            for i in range(t, p):
+                X[i]['fRegex'] = label
+            t = p
 
 def gen_gazetteer_observation(X, gazetteer = None, def_="NA"):
     """Generate Gazetteer Observations
+    gz: whether the token belongs to the longest gazetteer entry starting
+        at the leftmost unmatched position
+    gzt: type of that gazetteer entry (def_ if there is none)
     """
     if gazetteer == None:
         return
 
+    tokens = [x["w"].lower().split("_") for x in X]
+    # An entry spans at most max_length()+1 tokens and never includes the last token
+    max_tokens = gazetteer.max_length() + 1
     for t in range(len(X)):
         if X[t].get("gz") != None:
             continue
 
-        start_gaze = False
-        for offset in range(gazetteer.max_length()+1,0,-1):
-            p = t + offset
-            if p >= len(X):
-                continue
-
-            tokens_ = []
+        match = gazetteer.longest_match(tokens, t, min(t + max_tokens, len(X) - 1))
+        if match is not None:
+            p, type_ = match
             for i in range(t,p):
-                tokens_ += X[i]["w"].split("_")
-            value_ = " ".join(tokens_)
-            value_ = value_.lower()
-
-            if gazetteer.is_in_gazetteer(value_):
-                # print(value_, file=sys.stderr)
-                start_gaze = True
-                type_ = gazetteer.gazetteer_type(value_)
-                for i in range(t,p):
-                    X[i]["gz"]  = b( True )
-                break
-
-        if not start_gaze:
+                X[i]["gz"]  = b( True )
+                X[i]["gzt"] = type_
+        else:
             X[t]["gz"] = b( False )
+            X[t]["gzt"] = def_
 
 
 def regexp_features(X, t):
@@ -640,6 +682,34 @@ def regexp_features(X, t):
         X[t]['F'].append('p[0]|r[1]=%s|%s' % (current_pos, next_reg))
 
 
+# Feature extractor used by the worker processes of FeatureExtractor.extract.
+# With the fork start method it is inherited from the parent process, so the
+# loaded embeddings, Brown clusters and gazetteer are shared copy-on-write.
+_worker_extractor = None
+
+def _init_worker(extractor):
+    global _worker_extractor
+    _worker_extractor = extractor
+
+def _extract_chunk(lines):
+    cache = _worker_extractor.observation_cache
+    hits, misses = cache.hits, cache.misses
+    fo = io.StringIO()
+    crfutils.extract_features(_worker_extractor.feature_extractor,
+                              fields=_worker_extractor.fields,
+                              fi=lines, fo=fo, compact=True,
+                              writer=_worker_extractor.feature_writer)
+    return fo.getvalue(), cache.hits - hits, cache.misses - misses
+
+def _count_chunk(lines):
+    return _worker_extractor.count_chunk(lines)
+
+def _pool_context():
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return multiprocessing.get_context()
+
+
 def load_config(config_file):
     try:
         with open(config_file, 'r') as ymlfile:
@@ -702,22 +772,29 @@ class FeatureExtractor(object):
         if embedding_name is not None:
             binary = cfg['word_embeddings'][embedding_name]['binary']
             word_embedding_data_file = cfg['word_embeddings'][embedding_name]['path']
+            word_embedding_store = cfg['word_embeddings'][embedding_name].get('store')
         else:
             word_embedding_data_file = None
+            word_embedding_store = None
             binary = None
 
         if word_embedding_data_file is not None and cfg["use_word_embedding"]:
             scale = cfg['word_embeddings']['scale'] if cfg['word_embeddings'].__contains__('scale') else 1.0
 
-            if embedding_name == "glove":
+            if word_embedding_store is not None and EmbeddingStore.exists(word_embedding_store):
+                self.embedding = EmbeddingStore(word_embedding_store, scale = scale)
+                self.embeddingdim = self.embedding.dim
+            elif embedding_name == "glove":
                 self.embedding, self.embeddingdim = read_word_embedding_data(word_embedding_data_file, scale = scale)
             elif embedding_name == "word2vec":
                 self.embedding, self.embeddingdim = load_embedding_vectors_word2vec(word_embedding_data_file, binary=binary, scale = scale)
             else:
                 raise ValueError("Invalid embedding name: %s" % embedding_name)
             self.use_word_embedding = True
-            for d in range(self.embeddingdim):
-                U.append('em%d' % (d+1))
+            self.embedding_fields   = ['em%d' % (d+1) for d in range(self.embeddingdim)]
+            quantizer = get_quantizer(cfg['word_embeddings'].get('quantize'), self.embedding)
+            self.embedding_features = EmbeddingFeatureTable(self.embedding, self.embeddingdim, quantizer = quantizer)
+            U += self.embedding_fields
         else:
             self.use_word_embedding = False
             self.embedding          = {}
@@ -747,13 +824,36 @@ class FeatureExtractor(object):
             self.gazetteer = Gazetteer(path_to_gazetteer_file)
             U.append("gz")
             B.append("gz")
+            if cfg.get("use_gazetteer_type"):
+                U.append("gzt")
+                B.append("gzt")
         else:
             self.gazetteer = None
 
+        observation_cache_size = 100000
+        if cfg.get("observation_cache_size") is not None:
+            observation_cache_size = cfg.get("observation_cache_size")
+        self.observation_cache = ObservationCache(observation_cache_size)
+
+        # Feature hashing (optional): features are replaced by hashed attributes
+        self.feature_hasher = get_hasher(cfg.get("feature_hashing"))
+
         for name in U:
             self.templates += [((name, i),) for i in range(-2, 3)]
         for name in B:
             self.templates += [((name, i), (name, i+1)) for i in range(-2, 2)]
+        self.template_engine = crfutils.TemplateEngine(self.templates)
+        self.feature_writer = crfutils.FeatureWriter(self.templates)
+
+        # Frequency-based pruning (optional): only the features of the whitelist are emitted
+        self.feature_pruning = cfg.get("feature_pruning")
+        self.feature_filter = None
+        if self.feature_pruning and self.feature_pruning.get("whitelist") is not None:
+            whitelist_file = self.feature_pruning["whitelist"]
+            if os.path.isfile(whitelist_file):
+                self.set_whitelist(FeatureFilter.load(whitelist_file))
+            else:
+                print("[Warning] Whitelist %s not found, features are not pruned" % whitelist_file)
 
     def crf_options(self):
         return self.cfg["crf_options"]
@@ -762,100 +862,107 @@ class FeatureExtractor(object):
         return self.cfg["crfpath"]
 
     def observation(self, v, defval=''):
+        # All observations depend only on the surface string of the token,
+        # so they are computed once per word type and shared through the cache.
+        key = v['w'] if not defval else (v['w'], defval)
+        obs = self.observation_cache.get(key)
+        if obs is None:
+            obs = self.type_observation(v['w'], defval)
+            self.observation_cache.put(key, obs)
+        v.update(obs)
+
+    def type_observation(self, w, defval=''):
+        v = {}
         # Lowercased token.
-        v['wl'] = v['w'].lower()
+        v['wl'] = w.lower()
         # Token shape.
-        v['shape'] = get_shape(v['w'])
+        v['shape'] = get_shape(w)
         # Token shape degenerated.
         v['shaped'] = degenerate(v['shape'])
         # Token type.
-        v['type'] = get_type(v['w'])
+        v['type'] = get_type(w)
 
         # Prefixes (length between one to four).
-        v['p1'] = v['w'][0] if len(v['w']) >= 1 else defval
-        v['p2'] = v['w'][:2] if len(v['w']) >= 2 else defval
-        v['p3'] = v['w'][:3] if len(v['w']) >= 3 else defval
-        v['p4'] = v['w'][:4] if len(v['w']) >= 4 else defval
+        v['p1'] = w[0] if len(w) >= 1 else defval
+        v['p2'] = w[:2] if len(w) >= 2 else defval
+        v['p3'] = w[:3] if len(w) >= 3 else defval
+        v['p4'] = w[:4] if len(w) >= 4 else defval
 
         # Suffixes (length between one to four).
-        v['s1'] = v['w'][-1] if len(v['w']) >= 1 else defval
-        v['s2'] = v['w'][-2:] if len(v['w']) >= 2 else defval
-        v['s3'] = v['w'][-3:] if len(v['w']) >= 3 else defval
-        v['s4'] = v['w'][-4:] if len(v['w']) >= 4 else defval
+        v['s1'] = w[-1] if len(w) >= 1 else defval
+        v['s2'] = w[-2:] if len(w) >= 2 else defval
+        v['s3'] = w[-3:] if len(w) >= 3 else defval
+        v['s4'] = w[-4:] if len(w) >= 4 else defval
 
         # Two digits
-        v['2d'] = b(get_2d(v['w']))
+        v['2d'] = b(get_2d(w))
         # Four digits.
-        v['4d'] = b(get_4d(v['w']))
+        v['4d'] = b(get_4d(w))
         # Alphanumeric token.
-        v['d&a'] = b(get_da(v['w']))
+        v['d&a'] = b(get_da(w))
         # Digits and '-'.
-        v['d&-'] = b(get_dand(v['w'], '-'))
+        v['d&-'] = b(get_dand(w, '-'))
         # Digits and '/'.
-        v['d&/'] = b(get_dand(v['w'], '/'))
+        v['d&/'] = b(get_dand(w, '/'))
         # Digits and ','.
-        v['d&,'] = b(get_dand(v['w'], ','))
+        v['d&,'] = b(get_dand(w, ','))
         # Digits and '.'.
-        v['d&.'] = b(get_dand(v['w'], '.'))
+        v['d&.'] = b(get_dand(w, '.'))
         # A uppercase letter followed by '.'
-        v['up'] = b(get_capperiod(v['w']))
+        v['up'] = b(get_capperiod(w))
 
         # An initial uppercase letter.
-        v['iu'] = b(v['w'] and v['w'][0].isupper())
+        v['iu'] = b(w and w[0].isupper())
         # All uppercase letters.
-        v['au'] = b(v['w'].isupper())
+        v['au'] = b(w.isupper())
         # All lowercase letters.
-        v['al'] = b(v['w'].islower())
+        v['al'] = b(w.islower())
         # All digit letters.
-        v['ad'] = b(v['w'].isdigit())
+        v['ad'] = b(w.isdigit())
         # All other (non-alphanumeric) letters.
-        v['ao'] = b(get_all_other(v['w']))
+        v['ao'] = b(get_all_other(w))
 
         # Contains a uppercase letter.
-        v['cu'] = b(contains_upper(v['w']))
+        v['cu'] = b(contains_upper(w))
         # Contains a lowercase letter.
-        v['cl'] = b(contains_lower(v['w']))
+        v['cl'] = b(contains_lower(w))
         # Contains a alphabet letter.
-        v['ca'] = b(contains_alpha(v['w']))
+        v['ca'] = b(contains_alpha(w))
         # Contains a digit.
-        v['cd'] = b(contains_digit(v['w']))
+        v['cd'] = b(contains_digit(w))
         # Contains a symbol.
-        v['cs'] = b(contains_symbol(v['w']))
+        v['cs'] = b(contains_symbol(w))
 
         # New features from other papers
 
         # MIX: is mixed case letters, e.g., “iPhone”
-        v['mix'] = b( contains_mix_cases(v['w']) )
+        v['mix'] = b( contains_mix_cases(w) )
         # ACRONYM: e.g., T. or Th.
-        v['acr'] = b( isACRONYM(v['w']) )
+        v['acr'] = b( isACRONYM(w) )
         # Ends with digit, e.g, A9, B52
-        v['ed']  = b( ends_with_digit(v['w']) )
+        v['ed']  = b( ends_with_digit(w) )
         # HYPHEN: contains hyphen, such as New-York
-        v['hyp'] = b( contains_hyphen(v['w']) )
+        v['hyp'] = b( contains_hyphen(w) )
         # DATE: check if a token is date
-        v['da']  = b( is_date(v['w']) )
+        v['da']  = b( is_date(w) )
         # is name, where consecutive syllables are capitalized, e.g., “Hà_Nội”, “Buôn_Mê_Thuột”
-        v['na']  = b( isName(v['w']) )
+        v['na']  = b( isName(w) )
         # is code, e.g, “21B”
-        v['co']  = b( isCode(v['w']) )
+        v['co']  = b( isCode(w) )
         # is weight
-        v['wei'] = b( isWeight(v['w']) )
+        v['wei'] = b( isWeight(w) )
 
         if self.use_word_embedding:
             # Word embedding features
-            word = v['w'].lower()
+            word = w.lower()
             if is_punct(word):
                 word = '<punct>'
             elif is_number(word):
                 word = '<number>'
 
-            vec = []
-            if word not in self.embedding:
-                vec = [0.0 for i in range(self.embeddingdim)]
-            else:
-                vec = self.embedding[word]
-            for d in range(len(vec)):
-                v['em%d' % (d+1)] = '1:%g' % (vec[d])
+            # Values are formatted once per word by the embedding feature table
+            for name, value in zip(self.embedding_fields, self.embedding_features.get(word)):
+                v[name] = value
 
         if self.use_brown_clusters:
             word = v['wl']
@@ -863,8 +970,10 @@ class FeatureExtractor(object):
             v['bcb'] = bitstring
             for l in self.prefix_lengths:
                 v['%dbits' % l] = bitstring[0:l] if len(bitstring) >= l else ""
+        return v
 
-    def feature_extractor(self, X):
+    def feature_extractor(self, X, raw=False):
+        # raw: the features are neither pruned nor hashed (see count_chunk).
         # Append observations.
         for x in X:
             self.observation(x)
@@ -874,7 +983,9 @@ class FeatureExtractor(object):
         gen_gazetteer_observation(X, gazetteer = self.gazetteer)
         
         # Apply the feature templates.
-        crfutils.apply_templates(X, self.templates)
+        self.template_engine.apply(X)
+        # The template features are already restricted to the whitelist (see set_whitelist)
+        starts = [len(x['F']) for x in X] if self.feature_filter is not None and not raw else None
 
         # Append disjunctive features.
         for t in range(len(X)):
@@ -889,16 +1000,122 @@ class FeatureExtractor(object):
             X[0]['F'].append('__BOS__')
             X[-1]['F'].append('__EOS__')
 
-    def extract(self, input_file, output_file):
+        if raw:
+            return
+        if self.feature_filter is not None:
+            self.feature_filter.apply(X, starts)
+        if self.feature_hasher is not None:
+            self.feature_hasher.apply(X)
+
+    def sequence(self, words, label='O'):
+        """Build the item sequence of a sentence and extract its features
+        The items are the same as the ones read by crfutils.readiter from a
+        data file (crfutils.Item), the first field is the word and the other
+        fields are label.
+        Args:
+            words: List of words (strings) of the sentence.
+            label: Value of the other fields.
+        Returns:
+            X: List of items, the features are stored in x['F'].
+        """
+        names = self.fields.split(' ')
+        X = []
+        for w in words:
+            item = {'F': []}
+            for name in names:
+                item[name] = label
+            item[names[0]] = w
+            X.append(crfutils.Item(item))
+        self.feature_extractor(X)
+        return X
+
+    def extract(self, input_file, output_file, workers=1, chunk_size=200):
         fi = open(input_file)
         fo = open(output_file, 'w')
 
-        crfutils.extract_features(self.feature_extractor, 
-                                  fields=self.fields,
-                                  fi=fi, fo=fo)
+        if workers > 1:
+            self.extract_parallel(fi, fo, workers, chunk_size)
+        else:
+            # Items keep the cached observations of their word by reference
+            crfutils.extract_features(self.feature_extractor, 
+                                      fields=self.fields,
+                                      fi=fi, fo=fo, compact=True,
+                                      writer=self.feature_writer)
 
         fi.close()
         fo.close()
+        print(self.observation_cache.stats())
+        if self.use_word_embedding:
+            print(self.embedding_features.stats())
+
+    def extract_parallel(self, fi, fo, workers, chunk_size=200):
+        """Extract features with a pool of worker processes
+        The input is split into chunks of at most chunk_size sentences,
+        and the features of the chunks are written in the original order,
+        so the output is identical to the one of the serial extraction.
+        """
+        with _pool_context().Pool(workers, initializer=_init_worker, initargs=(self,)) as pool:
+            chunks = crfutils.readchunks(fi, chunk_size)
+            for out, hits, misses in pool.imap(_extract_chunk, chunks):
+                fo.write(out)
+                self.observation_cache.hits += hits
+                self.observation_cache.misses += misses
+
+    def set_whitelist(self, feature_filter):
+        """Only emit the features of a whitelist (FeatureFilter)
+        The templates that generate no feature of the whitelist are removed,
+        the others only format the values of the whitelisted features.
+        """
+        self.feature_filter = feature_filter
+        values = feature_filter.template_values()
+        self.template_engine = crfutils.TemplateEngine(self.templates)
+        for prefix, template, lo, hi, known in self.template_engine.templates:
+            if prefix.startswith('em'):
+                values[prefix] = None
+        self.template_engine.restrict(values)
+
+    def restrict_to_models(self, model_files):
+        """Only emit the features known to trained models (inference time)
+        The attributes of the models form the whitelist, the features that
+        the models would ignore are not generated.
+        """
+        if self.feature_hasher is not None:
+            print("[Warning] Features are hashed, they are not restricted to the attributes of the models")
+            return
+        self.set_whitelist(FeatureFilter.from_models(model_files))
+
+    def count_chunk(self, lines):
+        """Count the features of a chunk of lines of a data file"""
+        counts = dict()
+        for X in crfutils.readiter(lines, self.fields.split(' '), compact=True):
+            self.feature_extractor(X, raw=True)
+            count_features(X, counts)
+        return counts
+
+    def prune(self, input_file, whitelist_file=None, workers=1, chunk_size=200):
+        """First pass of pruned extraction: count the features of the training data
+        The features seen at least min_count times (feature_pruning setting)
+        form the whitelist, which is used by the next extractions and saved
+        to whitelist_file.
+        """
+        pruning = self.feature_pruning or {}
+        counter = FeatureCounter(pruning.get("min_count", 2), width_bits=pruning.get("sketch_bits", 22),
+                                 depth=pruning.get("sketch_depth", 4))
+        self.feature_filter = None
+        self.template_engine = crfutils.TemplateEngine(self.templates)
+        with open(input_file) as fi:
+            chunks = crfutils.readchunks(fi, chunk_size)
+            if workers > 1:
+                with _pool_context().Pool(workers, initializer=_init_worker, initargs=(self,)) as pool:
+                    for counts in pool.imap(_count_chunk, chunks):
+                        counter.add(counts)
+            else:
+                for lines in chunks:
+                    counter.add(self.count_chunk(lines))
+        print(counter.stats())
+        self.set_whitelist(FeatureFilter(counter.whitelist))
+        if whitelist_file is not None:
+            self.feature_filter.save(whitelist_file)
 
 
 if __name__ == '__main__':
@@ -907,7 +1124,11 @@ if __name__ == '__main__':
                         required=True)
     parser.add_argument("input", help = "Path to input file")
     parser.add_argument("output", help = "Path to crfsuite feature file")
+    parser.add_argument("-workers", type=int, default=1, help = "Number of worker processes")
+    parser.add_argument("-model", action="append", help = "Only generate the features known to a model file (can be repeated)")
     args = parser.parse_args()
 
     extractor = FeatureExtractor(args.config)
-    extractor.extract(args.input, args.output)
\ No newline at end of file
+    if args.model:
+        extractor.restrict_to_models(args.model)
+    extractor.extract(args.input, args.output, workers=args.workers)
\ No newline at end of file
@@ -2,8 +2,8 @@
 A miscellaneous utility for sequential labeling.
 Copyright 2010,2011 Naoaki Okazaki.
 """
-import re
 import sys
+import itertools
 
 def apply_templates(X, templates):
     """
@@ -33,7 +33,164 @@ def apply_templates(X, templates):
             if values:
                 X[t]['F'].append('%s=%s' % (name, '|'.join(values)))
 
-def readiter(fi, names, sep=' '):
+class TemplateEngine(object):
+    """
+    Column-oriented version of L{apply_templates}.
+    The name prefix of each template is built once when the engine is
+    created. When applied to a sequence, every field is stored as a
+    column (list of values) and all features of a template are generated
+    with a single pass over the shifted columns. The generated features
+    are the same as the ones of L{apply_templates}, in the same order.
+    """
+    def __init__(self, templates):
+        """
+        @type   templates:  list of tuple of (str, int)
+        @param  templates:  The feature templates.
+        """
+        self.templates = []
+        for template in templates:
+            name = '|'.join(['%s[%d]' % (f, o) for f, o in template])
+            offsets = [o for f, o in template]
+            # The last element is the set of the known values of the template (see restrict).
+            self.templates.append((name + '=', template, min(offsets), max(offsets), None))
+        self.fields = []
+        for template in templates:
+            for f, o in template:
+                if f not in self.fields:
+                    self.fields.append(f)
+
+    def columns(self, X):
+        return dict((f, [x[f] for x in X]) for f in self.fields)
+
+    def apply(self, X):
+        """
+        Generate features for an item sequence and store them in the 'F'
+        field of each item.
+
+        @type   X:      list of mapping objects
+        @param  X:      The item sequence.
+        """
+        n = len(X)
+        C = self.columns(X)
+        F = [x['F'] for x in X]
+        for prefix, template, lo, hi, known in self.templates:
+            # Positions t such that all t + offset are inside the sequence.
+            begin = max(0, -lo)
+            end = min(n, n - hi)
+            if begin >= end:
+                continue
+            if len(template) == 1:
+                field, offset = template[0]
+                column = C[field][begin+offset:end+offset]
+                if known is None:
+                    for f, v in zip(F[begin:end], column):
+                        f.append(prefix + v)
+                else:
+                    for f, v in zip(F[begin:end], column):
+                        if v in known:
+                            f.append(prefix + v)
+            else:
+                columns = [C[field][begin+offset:end+offset] for field, offset in template]
+                if known is None:
+                    for f, values in zip(F[begin:end], zip(*columns)):
+                        f.append(prefix + '|'.join(values))
+                else:
+                    for f, values in zip(F[begin:end], zip(*columns)):
+                        if values in known:
+                            f.append(prefix + '|'.join(values))
+
+    def restrict(self, values):
+        """
+        Only generate known features. The values of a template are looked
+        up before its features are formatted, so the unknown features cost
+        a set lookup instead of a string concatenation.
+
+        @type   values: dict
+        @param  values: Maps the name prefix of a template (e.g., 'w[0]=')
+                        to the set of its known values (the part of the
+                        feature after the prefix), or to None to generate
+                        all its values. The other templates are removed.
+        """
+        templates = []
+        for prefix, template, lo, hi, known in self.templates:
+            if prefix not in values:
+                continue
+            known = values[prefix]
+            if known is not None and len(template) > 1:
+                known = _split_values(known, len(template))
+            templates.append((prefix, template, lo, hi, known))
+        self.templates = templates
+
+def _split_values(values, k):
+    """
+    Set of the tuples of k field values whose join by '|' is one of the
+    values. A value with more than k - 1 '|' characters (in field values)
+    is split in all possible ways, which all give the same feature.
+    """
+    tuples = set()
+    for v in values:
+        parts = v.split('|')
+        if len(parts) == k:
+            tuples.add(tuple(parts))
+        elif len(parts) > k:
+            for cuts in itertools.combinations(range(1, len(parts)), k - 1):
+                bounds = (0,) + cuts + (len(parts),)
+                tuples.add(tuple('|'.join(parts[bounds[i]:bounds[i+1]]) for i in range(k)))
+    return tuples
+
+# Shared mapping of the items that have no observations yet.
+_NO_OBSERVATIONS = {}
+
+class Item(object):
+    """
+    Compact item of a sequence (see L{readiter} with compact=True).
+    The fields read from the data file and the values set afterwards are
+    stored in the item itself, while the observations of its word, which
+    are the same for all items of the word, are kept by reference (see
+    L{update}) instead of being copied into every item. An item supports
+    the mapping operations used on items: x[name], x[name] = value,
+    x.get(name) and name in x.
+    """
+    __slots__ = ('values', 'shared')
+
+    def __init__(self, values):
+        """
+        @type   values: dict
+        @param  values: The values of the item, including the 'F' field.
+        """
+        self.values = values
+        self.shared = _NO_OBSERVATIONS
+
+    def __getitem__(self, name):
+        values = self.values
+        if name in values:
+            return values[name]
+        return self.shared[name]
+
+    def __setitem__(self, name, value):
+        self.values[name] = value
+
+    def __contains__(self, name):
+        return name in self.values or name in self.shared
+
+    def get(self, name, default=None):
+        values = self.values
+        if name in values:
+            return values[name]
+        return self.shared.get(name, default)
+
+    def update(self, mapping):
+        """
+        Add the values of a mapping to the item. The first mapping whose
+        names are not values of the item is kept by reference, so it must
+        not be modified afterwards (e.g., the cached observations of a word).
+        """
+        if self.shared is _NO_OBSERVATIONS and self.values.keys().isdisjoint(mapping):
+            self.shared = mapping
+        else:
+            self.values.update(mapping)
+
+def readiter(fi, names, sep=' ', compact=False):
     """
     Return an iterator for item sequences read from a file object.
     This function reads a sequence from a file object L{fi}, and
@@ -49,6 +206,8 @@ def readiter(fi, names, sep=' '):
     @param  names:  The list of field names.
     @type   sep:    str
     @param  sep:    The separator character.
+    @type   compact: bool
+    @param  compact: Yield sequences of L{Item} instead of dicts.
     @rtype          list of mapping objects
     @return         An iterator for sequences.
     """
@@ -70,9 +229,37 @@ def readiter(fi, names, sep=' '):
             item = {'F': []}    # 'F' is reserved for features.
             for i in range(len(names)):
                 item[names[i]] = fields[i]
-            X.append(item)
+            X.append(Item(item) if compact else item)
             prev_line = line
 
+def readchunks(fi, size=200):
+    """
+    Return an iterator for chunks of raw lines read from a file object.
+    Every chunk ends at a sentence boundary (an empty line) and holds at
+    most L{size} sentences, so that applying L{readiter} to the chunks
+    one after another yields the same sequences as applying it to the
+    whole file.
+
+    @type   fi:     file
+    @param  fi:     The file object.
+    @type   size:   int
+    @param  size:   The maximum number of sentences in a chunk.
+    @rtype          list of str
+    @return         An iterator for chunks of lines.
+    """
+    lines = []
+    n = 0
+    for line in fi:
+        lines.append(line)
+        if not line.strip('\n'):
+            n += 1
+            if n >= size:
+                yield lines
+                lines = []
+                n = 0
+    if lines:
+        yield lines
+
 def escape(src):
     """
     Escape colon characters from feature names.
@@ -84,6 +271,34 @@ def escape(src):
     """
     return src.replace(':', '__COLON__')
 
+def unescape(src):
+    """
+    Restore the colon characters of an escaped feature name (see L{escape}).
+
+    @type   src:    str
+    @param  src:    An escaped feature name
+    @rtype          str
+    @return         The feature name.
+    """
+    return src.replace('__COLON__', ':')
+
+def format_feature(a):
+    """
+    Format a feature in CRFSuite format. Embedding features (whose name
+    starts with 'em') are already formatted as name:value, colons of the
+    other feature names are escaped.
+
+    @type   a:      str or tuple of (str, float)
+    @param  a:      The feature.
+    @rtype          str
+    @return         The formatted feature.
+    """
+    if isinstance(a, str):
+        if a.startswith('em'):
+            return a
+        return escape(a)
+    return '%s:%f' % (escape(a[0]), a[1])
+
 def output_features(fo, X, field=''):
     """
     Output features (and reference labels) of a sequence in CRFSuite
@@ -97,19 +312,79 @@ def output_features(fo, X, field=''):
     @type   field:  str
     @param  field:  The field name of reference labels.
     """
-    for t in range(len(X)):
-        if field:
-            fo.write('%s' % X[t][field])
-        for a in X[t]['F']:
-            if isinstance(a, str):
-                if re.search(r'^em', a):
-                    fo.write('\t%s' % a)
-                else:
-                    fo.write('\t%s' % escape(a))
-            else:
-                fo.write('\t%s:%f' % (escape(a[0]), a[1]))
-        fo.write('\n')
-    fo.write('\n')
+    lines = []
+    for x in X:
+        line = '%s' % x[field] if field else ''
+        for a in x['F']:
+            line += '\t' + format_feature(a)
+        lines.append(line + '\n')
+    lines.append('\n')
+    fo.write(''.join(lines))
+
+class FeatureWriter(object):
+    """
+    Buffered version of L{output_features} for the features generated by
+    a set of templates.
+    The embedding features, whose values are formatted as 1:value, are
+    generated by the templates whose first field is an embedding field
+    (em1, em2, ...), so the number of colons they contain at each position
+    of a sequence is known from the templates. A token line that contains
+    no other colon is written as it is, the features of the other lines are
+    escaped one by one. The output is the same as the one of
+    L{output_features}, and a sequence is written with a single write.
+    """
+    def __init__(self, templates):
+        """
+        @type   templates:  list of tuple of (str, int)
+        @param  templates:  The feature templates.
+        """
+        self.templates = []
+        for template in templates:
+            if template and template[0][0].startswith('em'):
+                offsets = [o for f, o in template]
+                colons = len([f for f, o in template if f.startswith('em')])
+                self.templates.append((min(offsets), max(offsets), colons))
+        # Colons of the embedding features at each position, by sequence length.
+        self.colons = {}
+
+    def embedding_colons(self, n):
+        colons = self.colons.get(n)
+        if colons is None:
+            colons = [0] * n
+            for lo, hi, k in self.templates:
+                for t in range(max(0, -lo), min(n, n - hi)):
+                    colons[t] += k
+            self.colons[n] = colons
+        return colons
+
+    def write(self, fo, X, field=''):
+        """
+        Output features (and reference labels) of a sequence in CRFSuite
+        format (see L{output_features}).
+
+        @type   fo:     file
+        @param  fo:     The file object.
+        @type   X:      list of mapping objects
+        @param  X:      The sequence.
+        @type   field:  str
+        @param  field:  The field name of reference labels.
+        """
+        lines = []
+        for x, colons in zip(X, self.embedding_colons(len(X))):
+            F = x['F']
+            line = '%s' % x[field] if field else ''
+            if F:
+                try:
+                    features = '\t'.join(F)
+                except TypeError:
+                    # Features given as (name, value) tuples.
+                    features = None
+                if features is None or features.count(':') != colons:
+                    features = '\t'.join([format_feature(a) for a in F])
+                line += '\t' + features
+            lines.append(line + '\n')
+        lines.append('\n')
+        fo.write(''.join(lines))
 
 def to_crfsuite(X):
     """
@@ -141,7 +416,11 @@ def extract_features(feature_extractor, fields='w pos y', sep=' ', **kwargs):
     if fo == None:
         fo = sys.stdout
 
+    write = output_features
+    if kwargs.get('writer') is not None:
+        write = kwargs.get('writer').write
+
     F = fields.split(' ')
-    for X in readiter(fi, F, sep):
+    for X in readiter(fi, F, sep, compact=kwargs.get('compact', False)):
         feature_extractor(X)
-        output_features(fo, X, 'y')
\ No newline at end of file
+        write(fo, X, 'y')
\ No newline at end of file
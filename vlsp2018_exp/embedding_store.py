@@ -0,0 +1,109 @@
+"""Class encapsulating a compact store of word embeddings.
+   A store consists of two NumPy files made from a GloVe or word2vec file:
+   - <prefix>.vocab.npy: sorted vocabulary (UTF-8 encoded words)
+   - <prefix>.vectors.npy: float32 matrix, the i-th row is the vector of the i-th word
+   Both files are opened with np.load(mmap_mode='r'), so loading a store is
+   almost instantaneous and extractor processes share the same pages.
+
+SYNOPSIS:
+python embedding_store.py [-binary] <glove|word2vec> <embedding_file> <store_prefix>
+"""
+import os
+import numpy as np
+from argparse import ArgumentParser
+
+
+def store_files(prefix):
+    return prefix + '.vocab.npy', prefix + '.vectors.npy'
+
+
+def save_embedding_store(embedding, embeddingdim, prefix):
+    """Save a dictionary of word vectors as an embedding store
+    Parameters
+    -----------
+    embedding: Dict
+       Dictionary that maps word to vectors
+    embeddingdim: int
+       Dimension of vectors
+    prefix: String
+       Path prefix of the store files
+    """
+    words = sorted([w.encode('utf-8') for w in embedding.keys()])
+    width = max([len(w) for w in words] + [1])
+    vocab = np.array(words, dtype='S%d' % width)
+    vectors = np.zeros((len(words), embeddingdim), dtype=np.float32)
+    for i, w in enumerate(words):
+        vectors[i] = embedding[w.decode('utf-8')]
+    vocab_file, vectors_file = store_files(prefix)
+    np.save(vocab_file, vocab)
+    np.save(vectors_file, vectors)
+    print("Saved %d vectors to %s, %s" % (len(words), vocab_file, vectors_file))
+
+
+class EmbeddingStore(object):
+    """
+    Read-only mapping from words to vectors backed by memory-mapped files.
+    Example usage:
+        embedding = EmbeddingStore("../resources/glove.vie.25d")
+        if "hà_nội" in embedding:
+            vec = embedding["hà_nội"]
+    """
+    def __init__(self, prefix, scale=1.0):
+        """Open an embedding store.
+        Args:
+            prefix: Path prefix of the store files.
+            scale: Scale factor applied to the vectors.
+        """
+        vocab_file, vectors_file = store_files(prefix)
+        print("Opening embedding store: %s" % prefix)
+        self.vocab = np.load(vocab_file, mmap_mode='r')
+        self.vectors = np.load(vectors_file, mmap_mode='r')
+        self.dim = self.vectors.shape[1]
+        self.scale = scale
+
+    @staticmethod
+    def exists(prefix):
+        return all(os.path.isfile(f) for f in store_files(prefix))
+
+    def index(self, word):
+        """Returns the row of a word, or -1 if the word is not in the vocabulary."""
+        key = word.encode('utf-8')
+        i = int(np.searchsorted(self.vocab, key))
+        if i < len(self.vocab) and self.vocab[i] == key:
+            return i
+        return -1
+
+    def __contains__(self, word):
+        return self.index(word) >= 0
+
+    def __getitem__(self, word):
+        i = self.index(word)
+        if i < 0:
+            raise KeyError(word)
+        if self.scale == 1.0:
+            return self.vectors[i]
+        return self.vectors[i].astype(np.float64) * self.scale
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __iter__(self):
+        for w in self.vocab:
+            yield w.decode('utf-8')
+
+
+if __name__ == "__main__":
+    from crfsuite_feature import read_word_embedding_data, load_embedding_vectors_word2vec
+
+    parser = ArgumentParser()
+    parser.add_argument("-binary", action="store_true", help="word2vec file is in binary format")
+    parser.add_argument("embedding_name", choices=["glove", "word2vec"], help="Format of the embedding file")
+    parser.add_argument("embedding_file", help="Path to embedding file")
+    parser.add_argument("store_prefix", help="Path prefix of the output store files")
+    args = parser.parse_args()
+
+    if args.embedding_name == "glove":
+        embedding, embeddingdim = read_word_embedding_data(args.embedding_file)
+    else:
+        embedding, embeddingdim = load_embedding_vectors_word2vec(args.embedding_file, binary=args.binary)
+    save_embedding_store(embedding, embeddingdim, args.store_prefix)
@@ -1,7 +1,7 @@
 """
 Evaluate CRF model given input file in CoNLL format
 SYNOPSIS:
-python eval_model.py [-work_dir <work_dir>] [-config_file <config_file>] <model_file> <test_gold>
+python eval_model.py [-work_dir <work_dir>] [-config_file <config_file>] [-workers <n>] <model_file> <test_gold>
 """
 import os
 import pathlib
@@ -9,6 +9,7 @@ from datetime import datetime
 import time
 from argparse import ArgumentParser
 from crfsuite_feature import FeatureExtractor
+import tagger_pool
 
 
 def copy_content(input_file, output_file):
@@ -37,6 +38,8 @@ if __name__ == "__main__":
     parser.add_argument("-work_dir", default="./work_dir", help="Path to working directory (save intermediate results)")
     parser.add_argument("-config_file", default="./config_files/config1.yml", help="Path to config file")
     parser.add_argument("-log", required=True, help="Path to log file")
+    parser.add_argument("-workers", type=int, default=1, help="Number of processes for feature extraction and tagging")
+    parser.add_argument("-model_whitelist", action="store_true", help="Only generate the features known to the model (attributes of the model file)")
     parser.add_argument("model_file", help="Path to model file")
     parser.add_argument("test_gold", help="Gold standard data (in CoNLL 2003 format with two fields w y)")
     args = parser.parse_args()
@@ -55,15 +58,13 @@ if __name__ == "__main__":
     print("Extract features for test data")
 
     extractor = FeatureExtractor(args.config_file)
-    extractor.extract(args.test_gold, test_crfsuite_file)
+    if args.model_whitelist:
+        extractor.restrict_to_models([args.model_file])
+    extractor.extract(args.test_gold, test_crfsuite_file, workers=args.workers)
     time_elapsed(start)
 
-    crfpath = extractor.crfpath()
-
     print("Tag test data")
-    comd = "%s tag -m %s %s > %s" % (crfpath, args.model_file, test_crfsuite_file, test_tag)
-    print(comd)
-    os.system(comd)
+    tagger_pool.tag_file(args.model_file, test_crfsuite_file, test_tag, workers=args.workers)
 
     comd = "paste -d ' ' %s %s > %s" % (args.test_gold, test_tag, test_out)
     print(comd)
@@ -0,0 +1,174 @@
+"""Classes encapsulating frequency-based pruning of CRF attributes.
+   Many features generated by the templates (rare conjunctions, affixes of
+   hapax words, ...) occur only once in the training data. Pruned extraction
+   is done in two passes over the training data:
+   1. The features of the training data are counted with a count-min sketch,
+      whose memory does not depend on the number of distinct features. The
+      features whose count reaches min_count form the whitelist.
+   2. The features are extracted, only the features of the whitelist are
+      emitted.
+   The whitelist is saved (one feature per line) and loaded by inference-time
+   extraction, which then does not emit the features unknown to the model.
+   A whitelist can also be read from the attributes of trained models
+   (FeatureFilter.from_models), so that inference-time extraction only
+   generates the features that the models use.
+
+   The embedding features (em1..emD) are dense, they are never pruned.
+"""
+import zlib
+import numpy as np
+import crfutils
+from crfsuite_model import read_attributes
+
+
+def feature_key(f):
+    """64-bit key of a feature string (stable across processes)"""
+    b = f.encode('utf-8')
+    return zlib.crc32(b) | (zlib.adler32(b) << 32)
+
+
+class CountMinSketch(object):
+    """
+    Count-min sketch: depth rows of 2^width_bits counters, a key is counted
+    in one counter of each row (multiply-shift hashing), and its count is
+    estimated by the minimum of its counters. Estimates are never below the
+    true counts.
+    Example usage:
+        sketch = CountMinSketch(width_bits=22, depth=4)
+        estimates = sketch.add(keys, counts)
+    """
+    def __init__(self, width_bits=22, depth=4, seed=0):
+        rng = np.random.RandomState(seed)
+        self.width_bits = width_bits
+        self.depth = depth
+        self.shift = np.uint64(64 - width_bits)
+        # Odd multipliers of multiply-shift hashing
+        self.multipliers = rng.randint(0, 1 << 62, size=depth, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.uint32)
+
+    def indices(self, keys):
+        return (self.multipliers[:, None] * keys[None, :]) >> self.shift
+
+    def add(self, keys, counts):
+        """Add the counts of distinct keys (uint64 array), returns the new estimates of their counts"""
+        counts = counts.astype(np.uint32)
+        estimates = None
+        for row, idx in enumerate(self.indices(keys)):
+            np.add.at(self.table[row], idx, counts)
+            values = self.table[row][idx]
+            estimates = values if estimates is None else np.minimum(estimates, values)
+        return estimates
+
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class FeatureCounter(object):
+    """
+    Streaming count of features (first pass of pruned extraction).
+    Example usage:
+        counter = FeatureCounter(min_count=2)
+        for X in sequences:
+            counter.add(count_features(X))
+        whitelist = counter.whitelist
+    """
+    def __init__(self, min_count=2, width_bits=22, depth=4):
+        """Initialize the counter.
+        Args:
+            min_count: Minimum count of the features of the whitelist.
+            width_bits: Number of counters of each row of the sketch (2^width_bits).
+            depth: Number of rows of the sketch.
+        """
+        self.min_count = min_count
+        self.sketch = CountMinSketch(width_bits, depth)
+        self.whitelist = set()
+        self.num_features = 0
+
+    def add(self, counts):
+        """Add the counts of features (dict that maps features to their counts in a chunk of data)"""
+        features = [f for f in counts if f not in self.whitelist]
+        self.num_features += sum(counts.values())
+        if not features:
+            return
+        keys = np.fromiter((feature_key(f) for f in features), dtype=np.uint64, count=len(features))
+        values = np.fromiter((counts[f] for f in features), dtype=np.uint32, count=len(features))
+        estimates = self.sketch.add(keys, values)
+        for i in np.nonzero(estimates >= self.min_count)[0]:
+            self.whitelist.add(features[i])
+
+    def stats(self):
+        return "Feature counter: %d features, %d in whitelist (min_count=%d), sketch: %.1f MB" % (
+            self.num_features, len(self.whitelist), self.min_count, self.sketch.nbytes() / (1024.0 * 1024.0))
+
+
+def count_features(X, counts=None):
+    """Count the features of an item sequence that can be pruned, returns the dict of counts"""
+    if counts is None:
+        counts = dict()
+    for x in X:
+        for f in x['F']:
+            if not f.startswith('em'):
+                counts[f] = counts.get(f, 0) + 1
+    return counts
+
+
+class FeatureFilter(object):
+    """
+    Filter of the features of a sequence by a whitelist.
+    Example usage:
+        feature_filter = FeatureFilter.load("whitelist.txt")
+        extractor.feature_extractor(X)
+        feature_filter.apply(X)
+    """
+    def __init__(self, whitelist):
+        """
+        Args:
+            whitelist: Set of the features that are kept.
+        """
+        self.whitelist = whitelist
+
+    def apply(self, X, starts=None):
+        """Remove the features that are not in the whitelist from an item sequence
+        Args:
+            X: Item sequence.
+            starts: Position of the first feature to filter in each item (the
+                features before it, e.g., the features of a TemplateEngine
+                restricted to the whitelist, are kept).
+        """
+        whitelist = self.whitelist
+        for t, x in enumerate(X):
+            F = x['F']
+            s = starts[t] if starts is not None else 0
+            F[s:] = [f for f in F[s:] if f in whitelist or f.startswith('em')]
+
+    def template_values(self):
+        """Returns a dict that maps the name prefixes (name=) of the features of
+        the whitelist to the sets of their values (see TemplateEngine.restrict)
+        """
+        values = dict()
+        for f in self.whitelist:
+            i = f.find('=')
+            if i >= 0:
+                values.setdefault(f[:i + 1], set()).add(f[i + 1:])
+        return values
+
+    def save(self, whitelist_file):
+        with open(whitelist_file, 'w') as fo:
+            for f in sorted(self.whitelist):
+                fo.write('%s\n' % f)
+
+    @classmethod
+    def load(cls, whitelist_file):
+        with open(whitelist_file) as fi:
+            return cls(set(line.rstrip('\n') for line in fi))
+
+    @classmethod
+    def from_models(cls, model_files):
+        """Whitelist of the attributes of trained models (CRFsuite model files)"""
+        whitelist = set()
+        for model_file in model_files:
+            for a in read_attributes(model_file):
+                whitelist.add(a)
+                # Colons of the feature names are escaped in the model
+                whitelist.add(crfutils.unescape(a))
+        return cls(whitelist)
@@ -1,7 +1,11 @@
 """
 Generate NER results
 SYNOPSIS:
-python gen_ner_result.py -config <configFile> -l1_model <l1Model> -l2_model <l2Model> -joint_model <jointModel> <devData> <devOutputDir>
+python gen_ner_result.py -config <configFile> -l1_model <l1Model> -l2_model <l2Model> -joint_model <jointModel> [-workers <n>] [-batch_size <n>] [-batch_tokens <n>] <devData> <devOutputDir>
+
+Sentences of many files are tagged together in batches (-batch_size
+sentences, -batch_tokens tokens), and the results are written back to
+the output files of each input file.
 
 Output:
 - Prediction results (with XML tags) for three methods (to directories):
@@ -10,14 +14,16 @@ Output:
   + Hybrid
 """
 import re
-import sys
-import uuid
 import pandas as pd
 import pathlib
 from argparse import ArgumentParser
 from crfsuite_feature import FeatureExtractor
+from crfsuite_model import CRFSuiteModel, tag_sequences_multi
+import tagger_pool
+from tagger_pool import TaggerPool
 import os
 import time
+from collections import deque
 from word_segment import preprocess, get_raw, word_tokenize
 
 
@@ -35,58 +41,145 @@ def time_elapsed(start):
     print()
 
 
-def get_sent_tags(sentences, extractor, model_file, tmpdir):
-    tmp_input_file = os.path.join(tmpdir, str(uuid.uuid1()) + '.txt')
-    test_crfsuite_file = os.path.join(tmpdir, str(uuid.uuid1()) + '.crfsuite')
-    tmp_tag_result = os.path.join(tmpdir, str(uuid.uuid1()) + '.tag')
-
-    try:
-        with open(tmp_input_file, "w") as fo:
-            for words in sentences:
-                sequence = [(w.text, "O") for w in words]
-                for tp in sequence:
-                    fo.write(" ".join(tp))
-                    fo.write("\n")
+def get_sent_tags(sentences, extractor, models):
+    """Tag sentences in memory with several models
+    The features of the sentences are extracted once and shared by all models.
+    Args:
+        sentences: List of sentences, each sentence is a list of Token (see word_tokenize).
+        extractor: FeatureExtractor.
+        models: List of CRFSuiteModel, or list of TaggerPool.
+    Returns:
+        For each model, the list of tag lists (one for each sentence).
+    """
+    sequences = [extractor.sequence([w.text for w in words]) for words in sentences]
+    if isinstance(models[0], TaggerPool):
+        return tagger_pool.tag_sequences_multi(models, sequences)
+    return tag_sequences_multi(models, sequences)
+
+
+def split_joint_tags(joint_tags):
+    """Split the joint tags (e.g., B-ORG+B-LOC) into level 1 and level 2 tags"""
+    l1_tags = []
+    l2_tags = []
+    for tag in joint_tags:
+        tag1, tag2 = tag.split('+')
+        l1_tags.append(tag1)
+        l2_tags.append(tag2)
+    return l1_tags, l2_tags
+
+
+def combine_tags(l1_tags, l2_tags, joint_tags):
+    """Returns the (level 1, level 2) tags of a sentence for the three methods
+    - Joint: both levels from the joint model
+    - Separated: level 1 from the l1 model, level 2 from the l2 model
+    - Hybrid: level 1 from the l1 model, level 2 from the joint model
+    """
+    joint_l1_tags, joint_l2_tags = split_joint_tags(joint_tags)
+    return [
+        (joint_l1_tags, joint_l2_tags),
+        (l1_tags, l2_tags),
+        (l1_tags, joint_l2_tags),
+    ]
+
+
+def read_document(input_path, sent2ws):
+    """Read and tokenize an input file
+    Returns:
+        lines: Lines of the file.
+        sentences: List of sentences (list of Token) of the non-empty lines.
+        line_id_dict: Maps a line number to the id of its sentence.
+    """
+    lines = read(input_path)
+
+    sentences = []
+    line_id_dict = {}
+    sen_id = 0
+    for k, line in enumerate(lines):
+        if line == "":
+            continue
+        if line not in sent2ws:
+            raise ValueError("{} not found in dict".format(line))
+        tokenized_line = sent2ws[line]
+        words, _ = word_tokenize(tokenized_line, line)
+        sentences.append(words)
+        line_id_dict[k] = sen_id
+        sen_id += 1
+    return lines, sentences, line_id_dict
+
+
+def scatter_tags(pending, results):
+    """Append the tags of a batch to the documents waiting for them
+    Args:
+        pending: deque of (document, sentences, tags), tags is a list of
+                 tag lists for each model, filled in sentence order.
+        results: For each model, the tag lists of the batch.
+    Returns:
+        List of (document, tags) of the documents whose sentences are all tagged.
+    """
+    i = 0
+    n = len(results[0]) if results else 0
+    for doc, sentences, tags in pending:
+        if i == n:
+            break
+        m = min(len(sentences) - len(tags[0]), n - i)
+        for k in range(len(results)):
+            tags[k] += results[k][i:i + m]
+        i += m
+    done = []
+    while pending and len(pending[0][2][0]) == len(pending[0][1]):
+        doc, sentences, tags = pending.popleft()
+        done.append((doc, tags))
+    return done
+
+
+def tag_documents(documents, extractor, models, batch_size=500, batch_tokens=0):
+    """Tag the sentences of many documents in batches
+    Sentences of consecutive documents are gathered into batches of at most
+    batch_size sentences (and batch_tokens tokens if it is not 0), so that
+    small documents do not pay the tagging overhead for each file.
+    Args:
+        documents: Iterator of (document, sentences).
+        extractor: FeatureExtractor.
+        models: List of CRFSuiteModel.
+    Yields:
+        (document, tags) in the order of the documents, as soon as all
+        sentences of the document are tagged, tags is a list of tag lists
+        for each model.
+    """
+    pending = deque()
+    batch = []
+    n_tokens = 0
+    for doc, sentences in documents:
+        pending.append((doc, sentences, [[] for model in models]))
+        for words in sentences:
+            batch.append(words)
+            n_tokens += len(words)
+            if len(batch) >= batch_size or (batch_tokens > 0 and n_tokens >= batch_tokens):
+                for done in scatter_tags(pending, get_sent_tags(batch, extractor, models)):
+                    yield done
+                batch = []
+                n_tokens = 0
+    results = get_sent_tags(batch, extractor, models) if batch else [[] for model in models]
+    for done in scatter_tags(pending, results):
+        yield done
+
+
+def write_outputs(output_paths, lines, sentences, line_id_dict, l1_result, l2_result, joint_result):
+    """Write the joint, sep and hybrid outputs of a document"""
+    outputs = [open(path, "w", encoding="utf-8") for path in output_paths]
+    for k, line in enumerate(lines):
+        if line == "":
+            for fo in outputs:
                 fo.write("\n")
-    except IOError as e:
-        print(e)
-        os.remove(tmp_input_file)
-        sys.exit(1)
-
-    extractor.extract(tmp_input_file, test_crfsuite_file)
-    crfpath = extractor.crfpath()
-
-    # Tagging with CRFSuite
-    comd = '%s tag -m %s %s > %s' % (crfpath, model_file, test_crfsuite_file, tmp_tag_result)
-    # print(comd)
-    os.system(comd)
-
-    result_list = []
-    try:
-        with open(tmp_tag_result) as f:
-            cur_sent = []
-            for line in f:
-                if re.search(r'^[\s\t]*$', line):
-                    if len(cur_sent) != 0:
-                        result_list.append(cur_sent)
-                    cur_sent = []
-                else:
-                    line = line.strip()
-                    cur_sent.append(line)
-    except IOError as e:
-        print(e)
-
-    if len(cur_sent) != 0:
-        result_list.append(cur_sent)
-
-    try:
-        os.remove(tmp_input_file)
-        os.remove(test_crfsuite_file)
-        os.remove(tmp_tag_result)
-    except IOError as e:
-        print(e)
-
-    return result_list
+            continue
+        sen_id = line_id_dict[k]
+        words = sentences[sen_id]
+        output_tags = combine_tags(l1_result[sen_id], l2_result[sen_id], joint_result[sen_id])
+        for fo, (l1_tags, l2_tags) in zip(outputs, output_tags):
+            out = get_xml_tagged(words, l1_tags, l2_tags)
+            fo.write("{}\n".format(out))
+    for fo in outputs:
+        fo.close()
 
 
 def is_begin_of_chunk(i, ner_tags):
@@ -166,10 +259,13 @@ def get_xml_tagged(words, l1_tags, l2_tags, l3_tags=None):
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("-config_file", default="./config_files/config1.yml", help="Path to configuration file")
-    parser.add_argument("-tmpdir", default="./tmp", help="Path to temporary directory")
     parser.add_argument("-l1_model", required=True, help="Path to l1 model")
     parser.add_argument("-l2_model", required=True, help="Path to l2 model")
     parser.add_argument("-joint_model", required=True, help="Path to joint model")
+    parser.add_argument("-workers", type=int, default=1, help="Number of tagger processes per model")
+    parser.add_argument("-batch_size", type=int, default=500, help="Number of sentences tagged together (from many files)")
+    parser.add_argument("-batch_tokens", type=int, default=0, help="Maximum number of tokens of a batch (0: no limit)")
+    parser.add_argument("-model_whitelist", action="store_true", help="Only generate the features known to the models (attributes of the model files)")
     parser.add_argument("tokenized_data", help="Path to tokenized data")
     parser.add_argument("test_data_dir", help="Path to test data directory")
     parser.add_argument("output_dir", help="Path to output directory")
@@ -184,11 +280,14 @@ if __name__ == "__main__":
     for d in [joint_out_dir, sep_out_dir, hybrid_out_dir]:
         pathlib.Path(d).mkdir(parents=True, exist_ok=True)
 
-    tmpdir = args.tmpdir
-    if not os.path.isdir(tmpdir):
-        pathlib.Path(tmpdir).mkdir(parents=True, exist_ok=True)
-
     extractor = FeatureExtractor(args.config_file)
+    model_files = [args.l1_model, args.l2_model, args.joint_model]
+    if args.model_whitelist:
+        extractor.restrict_to_models(model_files)
+    if args.workers > 1:
+        models = [TaggerPool(model_file, args.workers) for model_file in model_files]
+    else:
+        models = [CRFSuiteModel(model_file) for model_file in model_files]
 
     input_paths = []
     input_files = []
@@ -218,79 +317,38 @@ if __name__ == "__main__":
         ws = df['ws'][i]
         sent2ws[sent] = ws
 
-    # Generate output for Joint model
+    def read_documents():
+        for i, input_path in enumerate(input_paths):
+            lines, sentences, line_id_dict = read_document(input_path, sent2ws)
+            yield (i, lines, sentences, line_id_dict), sentences
+
     i = 0
+    n_sentences = 0
     print_every = 20
-    for input_path, joint_output_path, sep_output_path, hybrid_output_path in zip(input_paths, joint_output_paths, sep_output_paths, hybrid_output_paths):
+    tag_start = time.time()
+    # Features of each batch are extracted once and decoded by the three models
+    tagged = tag_documents(read_documents(), extractor, models,
+                           batch_size=args.batch_size, batch_tokens=args.batch_tokens)
+    for (doc_id, lines, sentences, line_id_dict), (l1_result, l2_result, joint_result) in tagged:
         i += 1
+        input_path = input_paths[doc_id]
+        joint_output_path = joint_output_paths[doc_id]
+        sep_output_path = sep_output_paths[doc_id]
+        hybrid_output_path = hybrid_output_paths[doc_id]
         if i % print_every == 0:
             percent = 100.0 * i / n_files
             print("%s -> %s (%2.f%%)" % (input_path, joint_output_path, percent))
             print("%s -> %s (%2.f%%)" % (input_path, sep_output_path, percent))
             print("%s -> %s (%2.f%%)" % (input_path, hybrid_output_path, percent))
             time_elapsed(start)
-        lines = read(input_path)
-
-        sentences = []
-        line_id_dict = {}
-        sen_id = 0
-        for k, line in enumerate(lines):
-            if line == "":
-                continue
-            if line not in sent2ws:
-                raise ValueError("{} not found in dict".format(line))
-            tokenized_line = sent2ws[line]
-            words, _ = word_tokenize(tokenized_line, line)
-            sentences.append(words)
-            line_id_dict[k] = sen_id
-            sen_id += 1
-        l1_result = get_sent_tags(sentences, extractor, args.l1_model, tmpdir)
-        l2_result = get_sent_tags(sentences, extractor, args.l2_model, tmpdir)
-        joint_result = get_sent_tags(sentences, extractor, args.joint_model, tmpdir)
-        assert len(joint_result) == len(sentences)
-        assert len(l1_result) == len(sentences)
-        assert len(l2_result) == len(sentences)
-        with open(joint_output_path, "w", encoding="utf-8") as fo:
-            for k, line in enumerate(lines):
-                if line == "":
-                    fo.write("\n")
-                    continue
-                sen_id = line_id_dict[k]
-                words = sentences[sen_id]
-                joint_tags = joint_result[sen_id]
-                l1_tags = []
-                l2_tags = []
-                for tag in joint_tags:
-                    tag1, tag2 = tag.split('+')
-                    l1_tags.append(tag1)
-                    l2_tags.append(tag2)
-                out = get_xml_tagged(words, l1_tags, l2_tags)
-                fo.write("{}\n".format(out))
-        # separated model output
-        with open(sep_output_path, "w", encoding="utf-8") as fo:
-            for k, line in enumerate(lines):
-                if line == "":
-                    fo.write("\n")
-                    continue
-                sen_id = line_id_dict[k]
-                words = sentences[sen_id]
-                l1_tags = l1_result[sen_id]
-                l2_tags = l2_result[sen_id]
-                out = get_xml_tagged(words, l1_tags, l2_tags)
-                fo.write("{}\n".format(out))
-        # hybrid model output
-        with open(hybrid_output_path, "w", encoding="utf-8") as fo:
-            for k, line in enumerate(lines):
-                if line == "":
-                    fo.write("\n")
-                    continue
-                sen_id = line_id_dict[k]
-                words = sentences[sen_id]
-                l1_tags = l1_result[sen_id]
-                joint_tags = joint_result[sen_id]
-                l2_tags = []
-                for tag in joint_tags:
-                    tag1, tag2 = tag.split('+')
-                    l2_tags.append(tag2)
-                out = get_xml_tagged(words, l1_tags, l2_tags)
-                fo.write("{}\n".format(out))
+        n_sentences += len(sentences)
+        write_outputs([joint_output_path, sep_output_path, hybrid_output_path],
+                      lines, sentences, line_id_dict, l1_result, l2_result, joint_result)
+
+    elapsed = time.time() - tag_start
+    if args.workers > 1:
+        for model in models:
+            model.close()
+    print("# Documents: {}, sentences: {}".format(i, n_sentences))
+    print("{:.2f} documents/sec, {:.2f} sentences/sec".format(i / elapsed, n_sentences / elapsed))
+    time_elapsed(start)
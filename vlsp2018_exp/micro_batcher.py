@@ -0,0 +1,188 @@
+"""Micro-batching scheduler for online tagging.
+   Callers submit single sentences and get a future. A background thread
+   gathers the pending sentences into a batch until the batch has
+   max_batch_tokens tokens (or max_batch_sentences sentences) or the oldest
+   sentence has waited for max_delay seconds, then extracts the features of
+   the batch and tags it with all models at once.
+"""
+import sys
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from crfsuite_model import tag_sequences_multi
+import tagger_pool
+from tagger_pool import TaggerPool
+
+
+class Percentiles(object):
+    """Keeps the last values of a measure and computes their percentiles"""
+
+    def __init__(self, size=10000):
+        self.values = deque(maxlen=size)
+
+    def add(self, value):
+        self.values.append(value)
+
+    def percentile(self, p):
+        if not self.values:
+            return 0.0
+        values = sorted(self.values)
+        k = min(int(p / 100.0 * len(values)), len(values) - 1)
+        return values[k]
+
+    def mean(self):
+        if not self.values:
+            return 0.0
+        return sum(self.values) / float(len(self.values))
+
+
+def size_bucket(n):
+    """Returns the smallest power of two that is >= n"""
+    b = 1
+    while b < n:
+        b *= 2
+    return b
+
+
+class MicroBatcher(object):
+    """
+    Tags sentences of many callers in batches.
+    Example usage:
+        batcher = MicroBatcher(extractor, [l1_model, l2_model, joint_model])
+        future = batcher.submit(["Ông", "Nguyễn_Văn_A", "sống", "ở", "Hà_Nội"])
+        l1_tags, l2_tags, joint_tags = future.result()
+        batcher.close()
+    """
+    def __init__(self, extractor, models, max_delay=0.005, max_batch_tokens=2000, max_batch_sentences=256):
+        """Start the scheduler thread.
+        Args:
+            extractor: FeatureExtractor.
+            models: List of CRFSuiteModel, or list of TaggerPool.
+            max_delay: Maximum time (sec.) a sentence waits for its batch to fill.
+            max_batch_tokens: A batch is tagged as soon as it has this number of tokens.
+            max_batch_sentences: A batch is tagged as soon as it has this number of sentences.
+        """
+        self.extractor = extractor
+        self.models = models
+        self.max_delay = max_delay
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_sentences = max_batch_sentences
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.sentences = 0
+        self.tokens = 0
+        self.batches = 0
+        self.errors = 0
+        self.batch_sizes = dict()
+        self.batch_sentences = Percentiles()
+        self.batch_tokens = Percentiles()
+        self.queueing_delay = Percentiles()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, words):
+        """Submit a sentence (list of words), returns a future of the tags of all models"""
+        future = Future()
+        self.queue.put((words, future, time.time()))
+        return future
+
+    def tag(self, words):
+        return self.submit(words).result()
+
+    def close(self):
+        """Tag the pending sentences and stop the scheduler thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def next_batch(self):
+        """Wait for the next batch, returns None when the scheduler is closed"""
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        n_tokens = len(item[0])
+        deadline = item[2] + self.max_delay
+        while n_tokens < self.max_batch_tokens and len(batch) < self.max_batch_sentences:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    item = self.queue.get(timeout=timeout)
+                else:
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Close after this batch
+                self.queue.put(None)
+                break
+            batch.append(item)
+            n_tokens += len(item[0])
+        return batch
+
+    def tag_batch(self, batch):
+        sequences = [self.extractor.sequence(words) for words, _, _ in batch]
+        if isinstance(self.models[0], TaggerPool):
+            return tagger_pool.tag_sequences_multi(self.models, sequences)
+        return tag_sequences_multi(self.models, sequences)
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+            start = time.time()
+            n_tokens = sum(len(words) for words, _, _ in batch)
+            with self.lock:
+                self.batches += 1
+                self.sentences += len(batch)
+                self.tokens += n_tokens
+                bucket = size_bucket(len(batch))
+                self.batch_sizes[bucket] = self.batch_sizes.get(bucket, 0) + 1
+                self.batch_sentences.add(len(batch))
+                self.batch_tokens.add(n_tokens)
+                for _, _, submitted in batch:
+                    self.queueing_delay.add(start - submitted)
+            try:
+                results = self.tag_batch(batch)
+            except Exception as e:
+                print("[Error] Tagging a batch failed: %r" % e, file=sys.stderr)
+                with self.lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                continue
+            for i, (_, future, _) in enumerate(batch):
+                if not future.cancelled():
+                    future.set_result([tags[i] for tags in results])
+
+    def stats(self):
+        """Counters of the scheduler"""
+        with self.lock:
+            return {
+                "pending": self.queue.qsize(),
+                "sentences": self.sentences,
+                "tokens": self.tokens,
+                "batches": self.batches,
+                "errors": self.errors,
+                # Number of batches by size (sentences), sizes are rounded up to powers of two
+                "batch_size_histogram": dict((str(k), v) for k, v in sorted(self.batch_sizes.items())),
+                "batch_sentences": {
+                    "mean": self.batch_sentences.mean(),
+                    "p50": self.batch_sentences.percentile(50),
+                    "p99": self.batch_sentences.percentile(99),
+                },
+                "batch_tokens": {
+                    "mean": self.batch_tokens.mean(),
+                    "p50": self.batch_tokens.percentile(50),
+                    "p99": self.batch_tokens.percentile(99),
+                },
+                "queueing_delay_ms": {
+                    "mean": 1000.0 * self.queueing_delay.mean(),
+                    "p50": 1000.0 * self.queueing_delay.percentile(50),
+                    "p99": 1000.0 * self.queueing_delay.percentile(99),
+                },
+            }
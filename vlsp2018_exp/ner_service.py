@@ -0,0 +1,278 @@
+"""
+Local HTTP service for NER
+The feature extractor (word embeddings, Brown clusters, gazetteer) and the
+l1, l2 and joint models are loaded once. Sentences of concurrent requests
+are gathered into micro-batches, whose features are extracted once and
+tagged by the three models, and each sentence is returned with ENAMEX tags
+(see gen_ner_result.get_xml_tagged) for the requested method.
+
+SYNOPSIS:
+python ner_service.py -config_file <configFile> -l1_model <l1Model> -l2_model <l2Model> -joint_model <jointModel>
+                      [-host <host>] [-port <port>] [-segmenter ./word_segment.sh]
+                      [-max_batch_sentences <n>] [-max_batch_tokens <n>] [-max_delay <sec>] [-max_queue <n>] [-queue_timeout <sec>]
+
+API:
+POST /ner
+    {"sentences": ["Ông Nguyễn_Văn_A sống ở Hà_Nội"], "segmented": true, "method": "joint"}
+    -> {"method": "joint", "results": ["Ông <ENAMEX TYPE=\"PERSON\">Nguyễn Văn A</ENAMEX> sống ở ..."]}
+    - sentences: word-segmented sentences (syllables of a word are joined by "_"),
+      or raw sentences if segmented is false (requires -segmenter)
+    - method: joint, sep or hybrid (default: joint)
+GET /metrics
+    Request counters and latency percentiles (p50, p99), batch size distribution
+    and queueing delay of the micro-batching scheduler.
+GET /health
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from crfsuite_feature import FeatureExtractor
+from crfsuite_model import CRFSuiteModel
+from gen_ner_result import combine_tags, get_xml_tagged
+from micro_batcher import MicroBatcher, Percentiles
+from word_segment import preprocess, word_tokenize
+
+
+# Methods in the order of the outputs of combine_tags
+METHODS = ["joint", "sep", "hybrid"]
+
+MAX_BODY_SIZE = 1 << 20
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class LatencyStats(Percentiles):
+    """Latencies of the last requests"""
+
+    def stats(self):
+        return {
+            "count": len(self.values),
+            "p50_ms": 1000.0 * self.percentile(50),
+            "p99_ms": 1000.0 * self.percentile(99),
+        }
+
+
+def segment(segmenter, raw_sentences):
+    """Word-segment raw sentences with RDRsegmenter (see word_segment.sh)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        raw_file = os.path.join(tmpdir, "raw.txt")
+        with open(raw_file, "w", encoding="utf-8") as fo:
+            for s in raw_sentences:
+                fo.write("%s\n" % s)
+        subprocess.run(["bash", os.path.abspath(segmenter), raw_file], check=True,
+                       stdout=subprocess.DEVNULL)
+        with open(raw_file + ".WS", encoding="utf-8") as f:
+            ws_sentences = [l.rstrip("\n") for l in f]
+    if len(ws_sentences) != len(raw_sentences):
+        raise ValueError("Segmenter returned %d sentences for %d" % (len(ws_sentences), len(raw_sentences)))
+    return ws_sentences
+
+
+class NERService(object):
+    """
+    Tags the sentences of HTTP requests with a MicroBatcher, so that the
+    sentences of concurrent requests are tagged together. At most max_queue
+    requests are pending, a request is rejected (503) if it cannot get a
+    slot within queue_timeout seconds.
+    """
+    def __init__(self, extractor, models, segmenter=None, max_batch_sentences=64, max_batch_tokens=2000,
+                 max_delay=0.005, max_queue=1000, queue_timeout=1.0):
+        self.segmenter = segmenter
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.batcher = MicroBatcher(extractor, models, max_delay=max_delay,
+                                    max_batch_tokens=max_batch_tokens,
+                                    max_batch_sentences=max_batch_sentences)
+        self.latency = LatencyStats()
+        self.pending = 0
+        self.counters = {
+            "requests": 0,
+            "errors": 0,
+            "rejected": 0,
+        }
+
+    async def start(self, host, port):
+        self.slots = asyncio.Semaphore(self.max_queue)
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    async def tag(self, sentences):
+        """Tag sentences (lists of Token), returns the (l1, l2, joint) tags of each sentence"""
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.counters["rejected"] += 1
+            raise HTTPError(503, "Too many pending requests")
+        self.pending += 1
+        try:
+            futures = [asyncio.wrap_future(self.batcher.submit([w.text for w in words])) for words in sentences]
+            return await asyncio.gather(*futures)
+        finally:
+            self.pending -= 1
+            self.slots.release()
+
+    async def handle_ner(self, body):
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON")
+        if not isinstance(request, dict):
+            raise HTTPError(400, "Request must be a JSON object")
+        sentences = request.get("sentences")
+        if not isinstance(sentences, list) or not all(isinstance(s, str) for s in sentences):
+            raise HTTPError(400, "'sentences' must be a list of strings")
+        method = request.get("method", "joint")
+        if method not in METHODS:
+            raise HTTPError(400, "'method' must be one of %s" % ", ".join(METHODS))
+
+        raw_sentences = [preprocess(s) for s in sentences]
+        if request.get("segmented", True):
+            ws_sentences = raw_sentences
+            raw_sentences = [s.replace("_", " ") for s in ws_sentences]
+        else:
+            if self.segmenter is None:
+                raise HTTPError(400, "Raw sentences are not supported, the service was started without -segmenter")
+            loop = asyncio.get_event_loop()
+            ws_sentences = await loop.run_in_executor(None, segment, self.segmenter, raw_sentences)
+
+        words_list = [word_tokenize(ws, raw)[0] for ws, raw in zip(ws_sentences, raw_sentences)]
+        tags = await self.tag(words_list)
+        k = METHODS.index(method)
+        results = []
+        for words, (l1_tags, l2_tags, joint_tags) in zip(words_list, tags):
+            l1, l2 = combine_tags(l1_tags, l2_tags, joint_tags)[k]
+            results.append(get_xml_tagged(words, l1, l2))
+        return {"method": method, "results": results}
+
+    def metrics(self):
+        metrics = dict(self.counters)
+        metrics["pending_requests"] = self.pending
+        metrics["latency"] = self.latency.stats()
+        metrics["batcher"] = self.batcher.stats()
+        return metrics
+
+    async def dispatch(self, method, path, body):
+        if path == "/ner":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            start = time.time()
+            self.counters["requests"] += 1
+            response = await self.handle_ner(body)
+            self.latency.add(time.time() - start)
+            return response
+        elif path == "/metrics":
+            return self.metrics()
+        elif path == "/health":
+            return {"status": "ok"}
+        raise HTTPError(404, "Unknown path %s" % path)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = dict()
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    parts = request_line.decode("latin-1").split()
+                    if len(parts) != 3:
+                        raise HTTPError(400, "Invalid request line")
+                    method, path, version = parts
+                    keep_alive = keep_alive and version == "HTTP/1.1"
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY_SIZE:
+                        keep_alive = False
+                        raise HTTPError(413, "Request body is larger than %d bytes" % MAX_BODY_SIZE)
+                    body = await reader.readexactly(length) if length > 0 else b""
+                    status, payload = 200, await self.dispatch(method, path.split("?")[0], body)
+                except HTTPError as e:
+                    self.counters["errors"] += 1
+                    status, payload = e.status, {"error": e.message}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except Exception as e:
+                    self.counters["errors"] += 1
+                    print("[Error] %r" % e, file=sys.stderr)
+                    status, payload = 500, {"error": str(e)}
+
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(("HTTP/1.1 %d %s\r\n"
+                              "Content-Type: application/json; charset=utf-8\r\n"
+                              "Content-Length: %d\r\n"
+                              "Connection: %s\r\n\r\n" % (status, REASONS.get(status, ""), len(data),
+                                                          "keep-alive" if keep_alive else "close")).encode("latin-1"))
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-config_file", default="./config_files/config1.yml", help="Path to configuration file")
+    parser.add_argument("-l1_model", required=True, help="Path to l1 model")
+    parser.add_argument("-l2_model", required=True, help="Path to l2 model")
+    parser.add_argument("-joint_model", required=True, help="Path to joint model")
+    parser.add_argument("-host", default="127.0.0.1", help="Host to listen on")
+    parser.add_argument("-port", type=int, default=8000, help="Port to listen on")
+    parser.add_argument("-segmenter", default=None, help="Word segmentation script for raw sentences (e.g., ./word_segment.sh)")
+    parser.add_argument("-max_batch_sentences", type=int, default=64, help="Maximum number of sentences of a batch")
+    parser.add_argument("-max_batch_tokens", type=int, default=2000, help="Maximum number of tokens of a batch")
+    parser.add_argument("-max_delay", type=float, default=0.005, help="Maximum time (sec.) a request waits for a batch to fill")
+    parser.add_argument("-max_queue", type=int, default=1000, help="Maximum number of pending requests")
+    parser.add_argument("-queue_timeout", type=float, default=1.0, help="Time (sec.) to wait for a queue slot before rejecting a request")
+    parser.add_argument("-model_whitelist", action="store_true", help="Only generate the features known to the models (attributes of the model files)")
+    args = parser.parse_args()
+
+    model_files = [args.l1_model, args.l2_model, args.joint_model]
+    extractor = FeatureExtractor(args.config_file)
+    if args.model_whitelist:
+        extractor.restrict_to_models(model_files)
+    models = [CRFSuiteModel(model_file) for model_file in model_files]
+    service = NERService(extractor, models, segmenter=args.segmenter,
+                         max_batch_sentences=args.max_batch_sentences, max_batch_tokens=args.max_batch_tokens,
+                         max_delay=args.max_delay,
+                         max_queue=args.max_queue, queue_timeout=args.queue_timeout)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(service.start(args.host, args.port))
+    print("Serving on http://%s:%d" % (args.host, args.port), flush=True)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    loop.run_until_complete(server.wait_closed())
@@ -0,0 +1,280 @@
+"""Hyperparameter sweep over the CRFsuite training options
+SYNOPSIS:
+python sweep.py [-search grid|random] [-trials <n>] [-seed <n>] [-jobs <n>] [-workers <n>] [-feature_cache <dir>]
+                [-algorithm <a1,a2,...>] [-c1 <v1,v2,...>] [-c2 <v1,v2,...>] [-max_iterations <n1,n2,...>]
+                [-possible_states <0,1>] [-possible_transitions <0,1>]
+                <config_file> <exp_dir> <training_file> <heldout_file>
+
+Features of the training and held-out data are extracted once with the
+settings of the configuration file. Then a CRF model is trained with
+`crfsuite learn` for each setting of the training options, at most -jobs
+models at the same time, each model tags the held-out data and is
+evaluated with conlleval.py. The settings ranked by F1 score are written
+to <exp_dir>/results.tsv together with the wall time of each job.
+
+Search:
+- grid: all combinations of the given values.
+- random: -trials settings, c1 and c2 are drawn (log-uniformly if the
+  minimum is > 0) between the minimum and the maximum of the given values,
+  the other parameters are drawn from the given values.
+A parameter that is not given takes its value in the crf_options of the
+configuration file (or the default of crfsuite if it is not there). c1 and
+c2 are only used by the algorithms that support them.
+
+Example:
+python sweep.py -jobs 4 -c2 0.1,0.5,1,3.2,10 ./config_files/config1.yml ./data/exp1/sweep/l1 ./data/exp1/train/train_ws-l1.txt ./data/exp1/dev/dev_ws-l1.txt
+"""
+import os
+import time
+import math
+import shlex
+import random
+import itertools
+import pathlib
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import conlleval
+from crfsuite_feature import FeatureExtractor, load_config
+from crfsuite_model import CRFSuiteModel
+from crf_trainer import parse_crf_options
+from feature_cache import FeatureCache
+
+# Swept parameters and their names in crfsuite.
+PARAMETERS = [
+    ("c1", "c1"),
+    ("c2", "c2"),
+    ("max_iterations", "max_iterations"),
+    ("possible_states", "feature.possible_states"),
+    ("possible_transitions", "feature.possible_transitions"),
+]
+
+# Parameters supported by each training algorithm of crfsuite,
+# in addition to the feature.* parameters.
+ALGORITHM_PARAMETERS = {
+    "lbfgs": ["c1", "c2", "max_iterations"],
+    "l2sgd": ["c2", "max_iterations"],
+    "ap": ["max_iterations"],
+    "pa": ["max_iterations"],
+    "arow": ["max_iterations"],
+}
+
+
+def format_crf_options(algorithm, params, others):
+    options = ["-a %s" % algorithm] if algorithm is not None else []
+    options += ["-p %s=%s" % (name, value) for name, value in params]
+    return " ".join(options + others)
+
+
+class Sweep(object):
+    """
+    Settings of the crf_options of a sweep.
+    A setting is a dict with the algorithm and the values of PARAMETERS,
+    None means that the parameter is not given to crfsuite.
+    """
+    def __init__(self, crf_options, values):
+        """
+        Args:
+            crf_options: crf_options of the configuration file.
+            values: Dict from "algorithm" and the names of PARAMETERS to lists
+                    of values (strings), a missing or empty list means the
+                    value of crf_options.
+        """
+        algorithm, params, self.others = parse_crf_options(crf_options)
+        params = dict(params)
+        swept = set(crfsuite_name for _, crfsuite_name in PARAMETERS)
+        # Parameters of crf_options that are not swept are given as they are
+        self.fixed = [(name, value) for name, value in params.items() if name not in swept]
+        self.values = dict()
+        self.values["algorithm"] = values.get("algorithm") or [algorithm]
+        for name, crfsuite_name in PARAMETERS:
+            self.values[name] = values.get(name) or [params.get(crfsuite_name)]
+
+    def normalize(self, setting):
+        """Drop the parameters that are not supported by the algorithm of a setting"""
+        supported = ALGORITHM_PARAMETERS.get(setting["algorithm"])
+        if supported is not None:
+            for name in ["c1", "c2", "max_iterations"]:
+                if name not in supported:
+                    setting[name] = None
+        return setting
+
+    def grid(self):
+        names = ["algorithm"] + [name for name, _ in PARAMETERS]
+        settings = []
+        for values in itertools.product(*[self.values[name] for name in names]):
+            setting = self.normalize(dict(zip(names, values)))
+            if setting not in settings:
+                settings.append(setting)
+        return settings
+
+    def random(self, trials, seed=None):
+        rng = random.Random(seed)
+        settings = []
+        for i in range(trials):
+            setting = {"algorithm": rng.choice(self.values["algorithm"])}
+            for name, _ in PARAMETERS:
+                values = self.values[name]
+                if name in ["c1", "c2"] and len(values) > 1:
+                    lo, hi = min(float(v) for v in values), max(float(v) for v in values)
+                    if lo > 0:
+                        value = math.exp(rng.uniform(math.log(lo), math.log(hi)))
+                    else:
+                        value = rng.uniform(lo, hi)
+                    setting[name] = "%.4g" % value
+                else:
+                    setting[name] = rng.choice(values)
+            settings.append(self.normalize(setting))
+        return settings
+
+    def crf_options(self, setting):
+        params = [(crfsuite_name, setting[name]) for name, crfsuite_name in PARAMETERS
+                  if setting[name] is not None]
+        return format_crf_options(setting["algorithm"], params + self.fixed, self.others)
+
+
+def evaluate(test_file, tag_file):
+    """Returns the overall precision, recall and F1 score of the tagged test data"""
+    with open(test_file) as f1, open(tag_file) as f2:
+        lines = []
+        for line, tag in zip(f1, f2):
+            line = line.strip('\n')
+            tag = tag.strip('\n')
+            lines.append("%s %s" % (line, tag) if line.strip() else "")
+    counts = conlleval.evaluate(lines)
+    overall = conlleval.calculate_metrics(counts.correct_chunk, counts.found_guessed, counts.found_correct)
+    return 100. * overall.prec, 100. * overall.rec, 100. * overall.fscore
+
+
+def run_job(job):
+    """Train a model with the crf_options of a job and evaluate it on the held-out data"""
+    pathlib.Path(job["dir"]).mkdir(parents=True, exist_ok=True)
+    model_file = os.path.join(job["dir"], "model.bin")
+    tag_file = os.path.join(job["dir"], "heldout.tag")
+    log_file = os.path.join(job["dir"], "learn.log")
+
+    result = dict(job)
+    start = time.time()
+    comd = "%s learn %s -m %s %s > %s 2>&1" % (job["crfpath"], job["crf_options"], model_file,
+                                               job["training_crfsuite_file"], log_file)
+    status = os.system(comd)
+    result["training_time"] = time.time() - start
+    if status != 0 or not os.path.isfile(model_file):
+        result["error"] = "crfsuite learn failed with status %d, see %s" % (status >> 8, log_file)
+        result["time"] = time.time() - start
+        return result
+
+    CRFSuiteModel(model_file).tag_file(job["heldout_crfsuite_file"], tag_file)
+    result["precision"], result["recall"], result["f1"] = evaluate(job["heldout_file"], tag_file)
+    result["time"] = time.time() - start
+    return result
+
+
+def write_results(results, output_file):
+    """Write the results ranked by F1 score, failed jobs come last"""
+    ranked = sorted(results, key=lambda r: (r.get("f1") is None, -(r.get("f1") or 0.0), r["id"]))
+    with open(output_file, "w") as fo:
+        fo.write("rank\tjob\tf1\tprecision\trecall\ttraining_time\ttime\tcrf_options\n")
+        for rank, r in enumerate(ranked):
+            if r.get("f1") is None:
+                fo.write("-\t%s\t-\t-\t-\t%.2f\t%.2f\t%s\n" % (r["id"], r["training_time"], r["time"], r["crf_options"]))
+            else:
+                fo.write("%d\t%s\t%.2f\t%.2f\t%.2f\t%.2f\t%.2f\t%s\n" % (
+                    rank + 1, r["id"], r["f1"], r["precision"], r["recall"], r["training_time"], r["time"], r["crf_options"]))
+    return ranked
+
+
+def split_values(s):
+    return [v.strip() for v in s.split(",") if v.strip()] if s else []
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("-search", default="grid", choices=["grid", "random"], help="Grid search or random search")
+    parser.add_argument("-trials", type=int, default=10, help="Number of settings of the random search")
+    parser.add_argument("-seed", type=int, default=None, help="Seed of the random search")
+    parser.add_argument("-jobs", type=int, default=2, help="Maximum number of models trained at the same time")
+    parser.add_argument("-workers", type=int, default=1, help="Number of processes for feature extraction")
+    parser.add_argument("-feature_cache", default=None, help="Directory of cached feature files")
+    parser.add_argument("-algorithm", default=None, help="Comma-separated training algorithms (lbfgs, l2sgd, ap, pa, arow)")
+    parser.add_argument("-c1", default=None, help="Comma-separated values of c1 (lbfgs)")
+    parser.add_argument("-c2", default=None, help="Comma-separated values of c2 (lbfgs, l2sgd)")
+    parser.add_argument("-max_iterations", default=None, help="Comma-separated values of max_iterations")
+    parser.add_argument("-possible_states", default=None, help="Comma-separated values of feature.possible_states")
+    parser.add_argument("-possible_transitions", default=None, help="Comma-separated values of feature.possible_transitions")
+    parser.add_argument("config_file", help="Path to config file")
+    parser.add_argument("exp_dir", help="Path to experiment dir")
+    parser.add_argument("training_file", help="Path to training data")
+    parser.add_argument("heldout_file", help="Path to held-out data")
+    args = parser.parse_args()
+
+    START = time.time()
+    pathlib.Path(args.exp_dir).mkdir(parents=True, exist_ok=True)
+    cfg = load_config(args.config_file)
+
+    values = dict((name, split_values(getattr(args, name))) for name in ["algorithm"] + [n for n, _ in PARAMETERS])
+    sweep = Sweep(cfg["crf_options"], values)
+    if args.search == "grid":
+        settings = sweep.grid()
+    else:
+        settings = sweep.random(args.trials, args.seed)
+    print("Settings: %d" % len(settings))
+
+    print("Step 1: Extract features for training and held-out data")
+    start = time.time()
+    training_crfsuite_file = os.path.join(args.exp_dir, "train.crfsuite")
+    heldout_crfsuite_file = os.path.join(args.exp_dir, "heldout.crfsuite")
+    pruning = cfg.get("feature_pruning") is not None
+    if pruning and args.feature_cache is not None:
+        print("[Warning] The feature cache is not used with feature pruning")
+    if args.feature_cache is not None and not pruning:
+        cache = FeatureCache(args.feature_cache)
+        extractor = cache.extract(args.config_file, args.training_file, training_crfsuite_file, workers=args.workers)
+        cache.extract(args.config_file, args.heldout_file, heldout_crfsuite_file, workers=args.workers, extractor=extractor)
+    else:
+        extractor = FeatureExtractor(args.config_file)
+        if pruning:
+            extractor.prune(args.training_file, os.path.join(args.exp_dir, "whitelist.txt"), workers=args.workers)
+        extractor.extract(args.training_file, training_crfsuite_file, workers=args.workers)
+        extractor.extract(args.heldout_file, heldout_crfsuite_file, workers=args.workers)
+    print("Finished in {:.2f} sec.".format(time.time() - start), flush=True)
+    print()
+
+    print("Step 2: Train and evaluate %d models, %d at a time" % (len(settings), args.jobs))
+    jobs = []
+    for i, setting in enumerate(settings):
+        job_id = "job%03d" % i
+        jobs.append({
+            "id": job_id,
+            "dir": os.path.join(args.exp_dir, job_id),
+            "crfpath": cfg["crfpath"],
+            "crf_options": sweep.crf_options(setting),
+            "training_crfsuite_file": training_crfsuite_file,
+            "heldout_crfsuite_file": heldout_crfsuite_file,
+            "heldout_file": args.heldout_file,
+        })
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [executor.submit(run_job, job) for job in jobs]
+        for future in as_completed(futures):
+            r = future.result()
+            results.append(r)
+            if r.get("error") is not None:
+                print("[%d/%d] %s: %s (%s)" % (len(results), len(jobs), r["id"], r["error"], r["crf_options"]), flush=True)
+            else:
+                print("[%d/%d] %s: F1 = %.2f, %.2f sec. (%s)" % (len(results), len(jobs), r["id"], r["f1"], r["time"],
+                                                                  r["crf_options"]), flush=True)
+    print()
+
+    results_file = os.path.join(args.exp_dir, "results.tsv")
+    ranked = write_results(results, results_file)
+    print("| Rank | Job | F1 | Precision | Recall | Time (sec.) | crf_options |")
+    print("|------|-----|----|-----------|--------|-------------|-------------|")
+    for rank, r in enumerate(ranked):
+        if r.get("f1") is None:
+            print("| - | {} | failed | | | {:.2f} | {} |".format(r["id"], r["time"], r["crf_options"]))
+        else:
+            print("| {} | {} | {:.2f} | {:.2f} | {:.2f} | {:.2f} | {} |".format(
+                rank + 1, r["id"], r["f1"], r["precision"], r["recall"], r["time"], r["crf_options"]))
+    print()
+    print("Results: %s" % results_file)
+    print("Finished in {:.2f} sec.".format(time.time() - START), flush=True)
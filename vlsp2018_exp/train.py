@@ -5,7 +5,11 @@ import pathlib
 import time
 from datetime import datetime
 from argparse import ArgumentParser
-from crfsuite_feature import FeatureExtractor
+from crfsuite_feature import FeatureExtractor, load_config
+from feature_cache import FeatureCache
+import tagger_pool
+from crfsuite_model import CRFSuiteModel
+from crf_trainer import CRFTrainer, tag_data
 
 
 def copy_content(input_file, output_file):
@@ -24,6 +28,10 @@ def copy_content(input_file, output_file):
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--keep_temp", action = "store_true", help = "Keep temporary feature files")
+    parser.add_argument("--workers", type = int, default = 1, help = "Number of processes for feature extraction and tagging")
+    parser.add_argument("--feature_cache", default = None, help = "Directory of cached feature files, reused by runs with the same data and feature settings")
+    parser.add_argument("--compress_cache", action = "store_true", help = "Store cached feature files compressed with gzip")
+    parser.add_argument("--trainer", default = "crfsuite", choices = ["crfsuite", "native"], help = "Train with `crfsuite learn` (crfpath) or with crf_trainer.py on the features in memory (no feature files)")
     parser.add_argument("config_file", help = "Path to config file")
     parser.add_argument("exp_dir", help = "Path to experiment dir")
     parser.add_argument("training_file", help = "Path to training data")
@@ -38,6 +46,7 @@ if __name__ == "__main__":
     training_tag = os.path.join(args.exp_dir, "train.tag")
     training_out = os.path.join(args.exp_dir, "train.out")
     model_file = os.path.join(args.exp_dir, "model.bin")
+    whitelist_file = os.path.join(args.exp_dir, "whitelist.txt")
 
     test_crfsuite_file = os.path.join(args.exp_dir, "test.crfsuite")
     test_tag = os.path.join(args.exp_dir, "test.tag")
@@ -49,22 +58,44 @@ if __name__ == "__main__":
     os.system('echo "Training data file: %s" >> %s' % (args.training_file, log_file))
     os.system('echo "-----------------" >> %s' % log_file)
 
-    extractor = FeatureExtractor(args.config_file)
+    cfg = load_config(args.config_file)
     print("Step 1: Extract features for training data")
     start = time.time()
-    extractor.extract(args.training_file, training_crfsuite_file)
+    native = args.trainer == "native"
+    # Pruned extraction counts the features of the training data first, the
+    # whitelist of the features that are kept is saved with the model
+    pruning = cfg.get("feature_pruning") is not None
+    if pruning and args.feature_cache is not None:
+        print("[Warning] The feature cache is not used with feature pruning")
+    if native or pruning or args.feature_cache is None:
+        extractor = FeatureExtractor(args.config_file)
+        if pruning:
+            extractor.prune(args.training_file, whitelist_file, workers=args.workers)
+    if native:
+        trainer = CRFTrainer.from_crf_options(cfg["crf_options"], workers=args.workers)
+        trainer.append_data(extractor, args.training_file)
+    elif args.feature_cache is not None and not pruning:
+        cache = FeatureCache(args.feature_cache, compress=args.compress_cache)
+        cache.extract(args.config_file, args.training_file, training_crfsuite_file, workers=args.workers)
+    else:
+        extractor.extract(args.training_file, training_crfsuite_file, workers=args.workers)
     end = time.time()
     minutes = (end - start) // 60
     secs = (end - start) % 60
     print("Finished in {:.2f} min {:.2f} sec.".format(minutes, secs), flush=True)
     print()
 
-    crfpath = extractor.crfpath()
+    crfpath = cfg["crfpath"]
     print("Step 2: Training CRF model")
     start = time.time()
-    comd = "%s learn %s -m %s %s" % ( crfpath, extractor.crf_options(), model_file, training_crfsuite_file)
-    print(comd)
-    os.system(comd)
+    if native:
+        trainer.train(model_file)
+        # Free the training data before tagging
+        trainer = None
+    else:
+        comd = "%s learn %s -m %s %s" % ( crfpath, cfg["crf_options"], model_file, training_crfsuite_file)
+        print(comd)
+        os.system(comd)
     end = time.time()
     minutes = (end - start) // 60
     secs = (end - start) % 60
@@ -72,9 +103,14 @@ if __name__ == "__main__":
     print()
 
     print("Step 3: Tag training data")
-    comd = "%s tag -m %s %s > %s" % (crfpath, model_file, training_crfsuite_file, training_tag)
-    print(comd)
-    os.system(comd)
+    if native:
+        if args.workers > 1:
+            with tagger_pool.TaggerPool(model_file, args.workers) as pool:
+                tag_data(extractor, pool, args.training_file, training_tag)
+        else:
+            tag_data(extractor, CRFSuiteModel(model_file), args.training_file, training_tag)
+    else:
+        tagger_pool.tag_file(model_file, training_crfsuite_file, training_tag, workers=args.workers)
     comd = "paste -d ' ' %s %s > %s" % (args.training_file, training_tag, training_out)
     print(comd)
     os.system(comd)
@@ -91,7 +127,7 @@ if __name__ == "__main__":
     os.system(comd)
     print()
 
-    if not args.keep_temp:
+    if not args.keep_temp and not native:
         print("Step 7: Cleaning temporary files")
         os.remove(training_crfsuite_file)
         print()